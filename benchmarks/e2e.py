@@ -0,0 +1,137 @@
+"""
+offline end to end benchmark against the bundled stub model server
+
+measures, with the stub's latency and token rate subtracted where known:
+  - time to first token and per turn overhead of REPL chat turns
+  - url extraction time for pages served by the stub
+  - github directory ingestion against the stub's github api, cold, from the
+    cache and revalidated with conditional requests
+  - pairwise task loop step time (prompt assembly, completion, validation)
+  - the share of each prompt the stub saw repeat a recent prompt's prefix
+
+usage: python -m benchmarks.e2e [--turns 10] [--latency 0.05] [--tokens-per-second 200]
+                                [--pages dir] [--github dir] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+from time import perf_counter
+
+from pair_ai.backend import OpenAIBackend, set_backend
+from pair_ai.stub_server import StubServer, split_tokens
+
+CHAT_RESPONSE = ("Here is an explanation of the code you loaded. " * 8 +
+                 "\n```python\ndef example():\n    return 42\n```\n")
+NEXT_STEP = {"work_done": "Read the files.", "notes": "none", "read_filenames": [],
+             "next_step_hint": "Summarize.", "task_done": False}
+
+
+def synthetic_pages(directory):
+    body = ''.join(f'<p>Paragraph {i} of the benchmark page with <b>some</b> text. {"lorem ipsum " * 20}</p>'
+                   for i in range(2000))
+    with open(os.path.join(directory, 'large.html'), 'w') as f:
+        f.write(f'<html lang="en"><head><title>Benchmark</title></head><body><article>{body}</article></body></html>')
+
+
+def bench_chat(turns, latency, tokens_per_second):
+    from pair_ai.context_packer import PackedChatContext
+    ctx = PackedChatContext(model='gpt-4', min_response_tokens=800, max_response_tokens=None)
+    expected_stream = len(split_tokens(CHAT_RESPONSE)) / tokens_per_second if tokens_per_second else 0
+    ttft, overhead = [], []
+    for i in range(turns):
+        t0 = perf_counter()
+        first = None
+        for cr in ctx.user_message_stream(f"question {i}: explain the code"):
+            if first is None:
+                first = perf_counter() - t0
+        total = perf_counter() - t0
+        ttft.append(first)
+        overhead.append(total - latency - expected_stream)
+    return {"ttft_median_s": statistics.median(ttft),
+            "ttft_overhead_median_s": statistics.median(ttft) - latency,
+            "turn_overhead_median_s": statistics.median(overhead)}
+
+
+def bench_extract(server, pages_dir, repeat=3):
+    from pair_ai.extract import url_to_text
+    results = {}
+    for name in sorted(os.listdir(pages_dir)):
+        url = f"{server.url}/pages/{name}"
+        times = []
+        for _ in range(repeat):
+            t0 = perf_counter()
+            url_to_text(url, use_cache=False)
+            times.append(perf_counter() - t0)
+        results[name] = min(times)
+    return results
+
+
+def bench_github(server, cache_dir):
+    from pair_ai import github_api, url_cache
+    from pair_ai.extract import MAX_TEXT_CHARS
+    github_api.API_URL = f"{server.url}/github/api"
+    github_api.RAW_URL = f"{server.url}/github/raw"
+    url_cache.URL_CACHE_DIR = cache_dir
+    url = "https://github.com/stub/repo/tree/HEAD/pair_ai"
+    results = {}
+    for name, ttl in (("cold_s", 0), ("cached_s", url_cache.DEFAULT_TTL), ("revalidated_s", 0)):
+        t0 = perf_counter()
+        text, title = github_api.github_text(url, MAX_TEXT_CHARS, ttl=ttl)
+        results[name] = perf_counter() - t0
+    results["chars"] = len(text)
+    results["requests"] = dict(server.github)
+    return results
+
+
+def bench_task_step(steps, latency):
+    from pair_ai.pairwise import Task, NextStep, PROMPT_PREFIX, task_prompt, create
+    task = Task(description="summarize the project", repo_outline="README.md (10 lines)", work_summary="", step=0)
+    times = []
+    for _ in range(steps):
+        t0 = perf_counter()
+        create(task_prompt(task), NextStep, retry=0, model='gpt-4', prefix=PROMPT_PREFIX)
+        task.step += 1
+        times.append(perf_counter() - t0)
+    return {"step_median_s": statistics.median(times),
+            "step_overhead_median_s": statistics.median(times) - latency}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05, help="stub seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200)
+    parser.add_argument("--pages", help="directory of saved pages (default: a synthetic page)")
+    parser.add_argument("--github", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help="directory the stub serves as a github repository (default: this repository)")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pages = args.pages
+        if not pages:
+            pages = tmp
+            synthetic_pages(pages)
+        recordings = [{"match": "multi-step task", "response": json.dumps(NEXT_STEP)},
+                      {"match": "explain the code", "response": CHAT_RESPONSE}]
+        with StubServer(recordings=recordings, latency=args.latency,
+                        tokens_per_second=args.tokens_per_second, pages_dir=pages,
+                        github_dir=args.github) as server:
+            set_backend(OpenAIBackend(api_base=server.api_base, api_key="stub"))
+            results = {"chat": bench_chat(args.turns, args.latency, args.tokens_per_second),
+                       "extract_s": bench_extract(server, pages),
+                       "github": bench_github(server, os.path.join(tmp, "urls")),
+                       "task_step": bench_task_step(args.turns, args.latency),
+                       "prefix_reuse": server.prefix.hit_rates()}
+
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
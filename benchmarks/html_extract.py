@@ -0,0 +1,72 @@
+"""
+benchmark html text extraction against the previous multi-parse implementation
+
+usage: python -m benchmarks.html_extract <directory of saved .html pages> [repeat]
+"""
+
+import os
+import sys
+from time import perf_counter
+
+from bs4 import BeautifulSoup
+from readability import Document
+
+from pair_ai.extract import html_text
+
+
+def legacy_html_text(html):
+    """
+    the previous extraction path: two BeautifulSoup parses, readability from the
+    raw string, and quadratic string concatenation
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    try:
+        language = soup.html["lang"]
+    except:
+        language = ""
+    doc = Document(html)
+    title = doc.title()
+    soup = BeautifulSoup(doc.summary(), 'html.parser')
+    blacklist = ['[document]','noscript','header','html','meta','head','input','script', "style"]
+    output = ""
+    for t in soup.find_all(text=True):
+        if t.parent.name not in blacklist:
+            output += '{} '.format(t)
+    return output, title, language
+
+
+def load_corpus(path):
+    pages = {}
+    for fn in sorted(os.listdir(path)):
+        if fn.endswith(('.html', '.htm')):
+            with open(os.path.join(path, fn), encoding='utf-8', errors='replace') as f:
+                pages[fn] = f.read()
+    return pages
+
+
+def bench(fn, html, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = perf_counter()
+        fn(html)
+        best = min(best, perf_counter() - t0)
+    return best
+
+
+def main():
+    corpus = load_corpus(sys.argv[1])
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    total_legacy = total_new = 0
+    print(f"{'page':40} {'bytes':>10} {'legacy s':>10} {'new s':>10} {'speedup':>8}")
+    for name, html in corpus.items():
+        t_legacy = bench(legacy_html_text, html, repeat)
+        t_new = bench(html_text, html, repeat)
+        total_legacy += t_legacy
+        total_new += t_new
+        print(f"{name[:40]:40} {len(html):10d} {t_legacy:10.4f} {t_new:10.4f} {t_legacy / t_new:7.1f}x")
+    if corpus:
+        print(f"{'total':40} {'':10} {total_legacy:10.4f} {total_new:10.4f} {total_legacy / total_new:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
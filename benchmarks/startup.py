@@ -0,0 +1,113 @@
+"""
+startup benchmark for the pair REPL
+
+reports the -X importtime breakdown of importing pair_ai.pair and the
+wall clock time from launching the REPL in a pseudo terminal until the
+first prompt is drawn.  with --baseline the run fails if time to first
+prompt regressed by more than --tolerance against a previous --json result.
+
+usage: python -m benchmarks.startup [--runs N] [--json out.json] [--baseline base.json] [--tolerance 0.2]
+"""
+
+import argparse
+import json
+import os
+import pty
+import select
+import subprocess
+import sys
+from time import perf_counter
+
+PROMPT_MARKER = b"Enter your code"
+REPL_CMD = [sys.executable, "-c", "from pair_ai.pair import repl; repl()"]
+
+
+def import_times(module="pair_ai.pair"):
+    """
+    return (total seconds, [(cumulative seconds, module)]) for the imports of module
+    no more than one level below the top
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, check=True)
+    top = []
+    total = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, raw_name = line.split("|")
+        name = raw_name.strip()
+        depth = (len(raw_name) - len(raw_name.lstrip()) - 1) // 2
+        if name == module:
+            total = int(cumulative_us) / 1e6
+        elif depth <= 1:
+            top.append((int(cumulative_us) / 1e6, name))
+    return total, sorted(top, reverse=True)
+
+
+def time_to_first_prompt(timeout=60.0):
+    """
+    launch the REPL in a pseudo terminal and return the seconds until the prompt appears
+    """
+    pid, fd = pty.fork()
+    if pid == 0:
+        os.execvp(REPL_CMD[0], REPL_CMD)
+    t0 = perf_counter()
+    output = b""
+    try:
+        while perf_counter() - t0 < timeout:
+            ready, _, _ = select.select([fd], [], [], 0.05)
+            if not ready:
+                continue
+            try:
+                output += os.read(fd, 4096)
+            except OSError:
+                break
+            if PROMPT_MARKER in output:
+                return perf_counter() - t0
+        raise RuntimeError(f"no prompt within {timeout}s, output: {output[-500:]!r}")
+    finally:
+        try:
+            os.write(fd, b"\x04")       # Ctrl-D exits the REPL
+        except OSError:
+            pass
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+        os.close(fd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="number of imports to list")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="previous --json results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed fractional regression")
+    args = parser.parse_args()
+
+    total, top = import_times()
+    print(f"import pair_ai.pair: {total*1000:.1f} ms")
+    for seconds, name in top[:args.top]:
+        print(f"  {seconds*1000:8.1f} ms  {name}")
+
+    runs = sorted(time_to_first_prompt() for _ in range(args.runs))
+    median = runs[len(runs) // 2]
+    print(f"time to first prompt: median {median*1000:.1f} ms, min {runs[0]*1000:.1f} ms over {args.runs} runs")
+
+    results = {"import_seconds": total, "first_prompt_seconds": median}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["first_prompt_seconds"]
+        limit = baseline * (1 + args.tolerance)
+        if median > limit:
+            print(f"REGRESSION: {median*1000:.1f} ms > {limit*1000:.1f} ms ({baseline*1000:.1f} ms baseline)")
+            sys.exit(1)
+        print(f"ok: within {args.tolerance:.0%} of {baseline*1000:.1f} ms baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+model backend shared by the REPL and pairwise
+
+ModelBackend is the interface the rest of pair uses to talk to a chat
+model.  OpenAIBackend calls the openai package (either the pre 1.0 or the
+1.0+ client api) against OpenAI or any compatible server, such as the
+bundled stub_server, selected with PAIR_API_BASE.  setting PAIR_RECORD to
+a file appends every exchange to it in the jsonl format stub_server replays.
+"""
+
+import json
+import os
+import threading
+import time
+import urllib.parse
+from typing import Iterator, List, Optional
+
+
+class ModelBackend:
+
+    def complete(self, messages: List[dict], model: str, temperature: float = 0, **kwargs) -> str:
+        """
+        return the response text for messages
+        """
+        raise NotImplementedError
+
+    def stream(self, messages: List[dict], model: str, temperature: float = 0, **kwargs) -> Iterator[str]:
+        """
+        yield the response text for messages as deltas
+        """
+        yield self.complete(messages, model, temperature, **kwargs)
+
+    def complete_function(self, messages: List[dict], model: str, name: str, parameters: dict,
+                          description: str = "", temperature: float = 0, **kwargs) -> str:
+        """
+        force a call of the function name with json schema parameters and return its arguments json.
+        backends without function calling return the plain completion.
+        """
+        return self.complete(messages, model, temperature, **kwargs)
+
+    def model_status(self, model: str) -> str:
+        """
+        return "available" or a description of why the model is unavailable
+        """
+        return "available"
+
+
+class OpenAIBackend(ModelBackend):
+
+    def __init__(self, api_base: Optional[str] = None, api_key: Optional[str] = None, record_to: Optional[str] = None):
+        import openai
+        self.openai = openai
+        self.v1 = hasattr(openai, 'chat')
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.api_base = api_base
+        self.record_to = record_to
+        self._record_lock = threading.Lock()
+        if self.v1:
+            kwargs = {'api_key': self.api_key or 'unset'}
+            if api_base:
+                kwargs['base_url'] = api_base
+            self.client = openai.OpenAI(**kwargs)
+        else:
+            openai.api_key = self.api_key
+            if api_base:
+                openai.api_base = api_base
+
+    def _record(self, messages, text):
+        if not self.record_to:
+            return
+        # the same text stub_server matches against: the last user message, else the last message
+        last = next((m['content'] for m in reversed(messages) if m['role'] == 'user'),
+                    messages[-1]['content'] if messages else "")
+        with self._record_lock, open(self.record_to, 'a') as f:
+            f.write(json.dumps({'match': last[-200:], 'response': text}) + '\n')
+
+    def complete(self, messages, model, temperature=0, **kwargs):
+        if self.v1:
+            response = self.client.chat.completions.create(model=model, messages=messages,
+                                                           temperature=temperature, **kwargs)
+            text = response.choices[0].message.content
+        else:
+            response = self.openai.ChatCompletion.create(model=model, messages=messages,
+                                                         temperature=temperature, **kwargs)
+            text = response['choices'][0]['message']['content']
+        self._record(messages, text)
+        return text
+
+    def stream(self, messages, model, temperature=0, **kwargs):
+        if self.v1:
+            response = self.client.chat.completions.create(model=model, messages=messages, temperature=temperature,
+                                                           stream=True, **kwargs)
+            deltas = (chunk.choices[0].delta.content or '' for chunk in response if chunk.choices)
+        else:
+            response = self.openai.ChatCompletion.create(model=model, messages=messages, temperature=temperature,
+                                                         stream=True, **kwargs)
+            deltas = (chunk['choices'][0]['delta'].get('content', '') for chunk in response)
+        text = []
+        for delta in deltas:
+            if delta:
+                text.append(delta)
+                yield delta
+        self._record(messages, ''.join(text))
+
+    def complete_function(self, messages, model, name, parameters, description="", temperature=0, **kwargs):
+        function = {"name": name, "parameters": parameters}
+        if description:
+            function["description"] = description
+        if self.v1:
+            response = self.client.chat.completions.create(model=model, messages=messages, temperature=temperature,
+                                                           tools=[{"type": "function", "function": function}],
+                                                           tool_choice={"type": "function", "function": {"name": name}},
+                                                           **kwargs)
+            message = response.choices[0].message
+            text = message.tool_calls[0].function.arguments if message.tool_calls else message.content
+        else:
+            response = self.openai.ChatCompletion.create(model=model, messages=messages, temperature=temperature,
+                                                         functions=[function], function_call={"name": name}, **kwargs)
+            message = response['choices'][0]['message']
+            text = message.get('function_call', {}).get('arguments') or message.get('content')
+        self._record(messages, text)
+        return text
+
+    def model_status(self, model):
+        try:
+            if self.v1:
+                self.client.models.retrieve(model)
+            else:
+                self.openai.Model.retrieve(model)
+            return "available"
+        except Exception as e:
+            return f"unavailable ({e})"
+
+
+class RateLimiter:
+    """
+    token bucket shared by threads: at most rate acquisitions per period seconds, with bursts up to burst
+    """
+
+    def __init__(self, rate: float, period: float = 60.0, burst: Optional[int] = None):
+        self.interval = period / rate
+        self.burst = burst or 1
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.interval)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.interval
+            time.sleep(wait)
+
+
+class RateLimitedBackend(ModelBackend):
+    """
+    wraps another backend so that every request first waits on a shared RateLimiter
+    """
+
+    def __init__(self, backend: ModelBackend, limiter: RateLimiter):
+        self.backend = backend
+        self.limiter = limiter
+
+    def complete(self, messages, model, temperature=0, **kwargs):
+        self.limiter.acquire()
+        return self.backend.complete(messages, model, temperature, **kwargs)
+
+    def stream(self, messages, model, temperature=0, **kwargs):
+        self.limiter.acquire()
+        yield from self.backend.stream(messages, model, temperature, **kwargs)
+
+    def complete_function(self, messages, model, name, parameters, description="", temperature=0, **kwargs):
+        self.limiter.acquire()
+        return self.backend.complete_function(messages, model, name, parameters, description, temperature, **kwargs)
+
+    def model_status(self, model):
+        return self.backend.model_status(model)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> ModelBackend:
+    """
+    return the process wide backend, by default an OpenAIBackend configured from
+    PAIR_API_BASE and PAIR_RECORD
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = OpenAIBackend(api_base=os.getenv("PAIR_API_BASE"),
+                                     record_to=os.getenv("PAIR_RECORD"))
+        return _backend
+
+
+def api_host() -> str:
+    """
+    the host the backend sends requests to, for retry's per host circuit breaker
+    """
+    api_base = getattr(get_backend(), 'api_base', None)
+    return urllib.parse.urlparse(api_base).netloc if api_base else 'api.openai.com'
+
+
+def set_backend(backend: ModelBackend):
+    global _backend
+    with _backend_lock:
+        _backend = backend
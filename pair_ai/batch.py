@@ -0,0 +1,147 @@
+"""
+headless batch runner for pairwise tasks
+
+reads tasks from a jsonl file, one object per line:
+
+  {"id": "summarize-docs", "description": "...", "next_step_hint": "...",
+   "root": "path/to/repo", "model": "gpt-4", "max_steps": 20}
+
+only description is required.  tasks run concurrently on a thread pool,
+every model request waits on one shared rate limiter, and steps are
+approved by AutoApprovePolicy.  questions the model asks are queued to
+questions.jsonl and the task carries on.  a result record per task, with
+per step timings and token counts, is appended to results.jsonl as each
+task finishes; with --skip-done tasks already recorded as done are not run
+again, and with --resume tasks that stopped part way carry on from their
+last saved step.
+
+usage: pair-batch tasks.jsonl [--out pair-batch-results] [--concurrency 4] [--rpm 60]
+                              [--policy read-only|create|overwrite] [--max-steps 30] [--resume]
+"""
+
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import List, Optional
+
+from loguru import logger
+
+from .backend import RateLimiter, RateLimitedBackend, get_backend, set_backend
+from .pairwise import AutoApprovePolicy, DEFAULT_NEXT_STEP_HINT, run_task
+
+POLICIES = {'read-only': AutoApprovePolicy(allow_create=False),
+            'create':    AutoApprovePolicy(allow_create=True),
+            'overwrite': AutoApprovePolicy(allow_create=True, allow_overwrite=True)}
+
+
+def load_tasks(path: str) -> List[dict]:
+    tasks = []
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            task = json.loads(line)
+            if not task.get('description'):
+                raise ValueError(f"{path}:{n}: task has no description")
+            task.setdefault('id', f"task-{n}")
+            tasks.append(task)
+    return tasks
+
+
+def done_ids(results_path: str) -> set:
+    """
+    the ids of tasks recorded as done in an earlier run
+    """
+    if not os.path.exists(results_path):
+        return set()
+    with open(results_path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return {r['id'] for r in records if r.get('status') == 'done'}
+
+
+class BatchRunner:
+
+    def __init__(self, out_dir: str, policy: AutoApprovePolicy, concurrency: int = 4,
+                 model: str = 'gpt-4', max_steps: Optional[int] = 30, resume: bool = False):
+        self.out_dir = out_dir
+        self.policy = policy
+        self.concurrency = concurrency
+        self.model = model
+        self.max_steps = max_steps
+        self.resume = resume
+        self.results_path = os.path.join(out_dir, 'results.jsonl')
+        self.questions_path = os.path.join(out_dir, 'questions.jsonl')
+        self._lock = threading.Lock()
+        os.makedirs(out_dir, exist_ok=True)
+
+    def _append(self, path: str, record: dict):
+        with self._lock, open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def run_one(self, spec: dict) -> dict:
+        started = datetime.now(timezone.utc).isoformat()
+        t0 = perf_counter()
+        logger.info(f"starting task {spec['id']}")
+        try:
+            result = run_task(spec['description'],
+                              next_step_hint=spec.get('next_step_hint') or DEFAULT_NEXT_STEP_HINT,
+                              model=spec.get('model') or self.model,
+                              root=spec.get('root'),
+                              policy=self.policy,
+                              max_steps=spec.get('max_steps', self.max_steps),
+                              resume=self.resume)
+            record = result.dict()
+        except Exception as e:
+            logger.exception(f"task {spec['id']} failed")
+            record = {'status': 'error', 'error': f"{type(e).__name__}: {e}"}
+        record = {'id': spec['id'], 'started': started, 'seconds': perf_counter() - t0, **record}
+        for question in record.get('questions', []):
+            self._append(self.questions_path, {'id': spec['id'], 'question': question})
+        self._append(self.results_path, record)
+        logger.info(f"task {spec['id']} {record['status']} in {record['seconds']:.1f}s")
+        return record
+
+    def run(self, tasks: List[dict]) -> List[dict]:
+        records = []
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='task') as executor:
+            futures = [executor.submit(self.run_one, spec) for spec in tasks]
+            for future in as_completed(futures):
+                records.append(future.result())
+        return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run pairwise tasks from a jsonl file without a terminal")
+    parser.add_argument("tasks", help="jsonl file of tasks")
+    parser.add_argument("--out", default="pair-batch-results", help="directory for results.jsonl and questions.jsonl")
+    parser.add_argument("--concurrency", type=int, default=4, help="tasks run at once")
+    parser.add_argument("--rpm", type=float, default=60, help="model requests per minute across all tasks")
+    parser.add_argument("--burst", type=int, default=None, help="requests allowed at once before --rpm applies")
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="create",
+                        help="read-only stops a task that wants to create a file, overwrite allows replacing files")
+    parser.add_argument("--model", default=os.getenv("PAIR_MODEL", "gpt-4"))
+    parser.add_argument("--max-steps", type=int, default=30)
+    parser.add_argument("--skip-done", action="store_true", help="skip tasks recorded as done in results.jsonl")
+    parser.add_argument("--resume", action="store_true", help="continue unfinished tasks from their last saved step")
+    args = parser.parse_args(argv)
+
+    tasks = load_tasks(args.tasks)
+    runner = BatchRunner(args.out, POLICIES[args.policy], args.concurrency, args.model, args.max_steps, args.resume)
+    if args.skip_done:
+        done = done_ids(runner.results_path)
+        tasks = [t for t in tasks if t['id'] not in done]
+    set_backend(RateLimitedBackend(get_backend(), RateLimiter(args.rpm, burst=args.burst)))
+    records = runner.run(tasks)
+    by_status = {}
+    for r in records:
+        by_status[r['status']] = by_status.get(r['status'], 0) + 1
+    print(f"{len(records)} tasks: " + ", ".join(f"{n} {status}" for status, n in sorted(by_status.items())))
+    print(f"results in {runner.results_path}")
+
+
+if __name__ == "__main__":
+    main()
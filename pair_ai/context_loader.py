@@ -1,34 +1,117 @@
 import os
 import re
-from .extract import url_to_text
-from chatstack import UserMessage
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import time
+from .file_registry import file_message
+from .context_packer import FILE, URL
+
+MAX_LOAD_WORKERS = 8
 
 def is_url(string):
     url_pattern = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
     return bool(url_pattern.match(string))
 
-def load_files_and_urls(chat_ctx, items):
-    for item in items:
-        if is_url(item):
+
+def load_item(item):
+    """
+    fetch a single file or url and return its content
+    """
+    if is_url(item):
+        from .extract import url_to_text    # defer the extraction stack until a url is loaded
+        content, title, language = url_to_text(item)
+    else:
+        with open(item, 'r') as file:
+            content = file.read()
+    return content
+
+
+def describe_document(name, chunks):
+    return f"Indexed {name} as {chunks} chunks; the parts relevant to each question are sent with it"
+
+
+def _describe_error(item, e):
+    if is_url(item):
+        return f"Error fetching URL: {e}"
+    if isinstance(e, FileNotFoundError):
+        return f"File not found: {item}"
+    if isinstance(e, IsADirectoryError):
+        return f"Path is a directory, not a file: {item}"
+    return f"Unexpected error: {e}"
+
+
+def load_file_sets(chat_ctx, specs, registry, max_tokens=None, confirm=None):
+    """
+    load globs and directories, each as one message of at most max_tokens.
+    confirm(prompt) is asked before adding files that were cut to the cap or are over the
+    confirmation threshold, and the files are skipped if it returns False.
+    """
+    from . import workspace
+    max_tokens = max_tokens or workspace.default_max_tokens(chat_ctx)
+    for spec in specs:
+        file_set, dropped, documents = workspace.prepare(chat_ctx, registry, spec, max_tokens)
+        print(workspace.describe_file_set(file_set))
+        if confirm and workspace.needs_confirmation(file_set, dropped) and not confirm(workspace.confirm_prompt(file_set, dropped)):
+            workspace.discard(chat_ctx, documents)
+            print(f"Not loaded: {spec}")
+            continue
+        results = registry.add_bundle(spec, file_set.files, documents)
+        for line in workspace.describe_added(registry, spec, results, dropped):
+            print(line)
+
+
+def load_files_and_urls(chat_ctx, items, registry=None, max_tokens=None, confirm=None):
+    """
+    load the files and urls concurrently, reporting progress as each item finishes.
+    messages are added to the chat context in the order the items were given.
+    files are tracked in the FileRegistry registry if one is given, and globs and
+    directories are then loaded as one message each, of at most max_tokens,
+    with confirm as in load_file_sets.
+    """
+    if registry:
+        from .workspace import is_multi
+        specs = [item for item in items if not is_url(item) and is_multi(item)]
+        if specs:
+            load_file_sets(chat_ctx, specs, registry, max_tokens, confirm)
+            items = [item for item in items if item not in specs]
+    if not items:
+        return
+    results = [None] * len(items)
+    t0 = time()
+
+    def timed_load(item):
+        """
+        returns (FileSnapshot, chunks) for a tracked file, a UserMessage, or the number of chunks
+        for a large document
+        """
+        t_item = time()
+        if registry and not is_url(item):
+            snap = registry.read(item)
+            return (snap, registry.index(snap)), time() - t_item
+        text = load_item(item)
+        chunks = chat_ctx.add_document(item, text)
+        return (chunks if chunks is not None else file_message(item, text)), time() - t_item
+
+    with ThreadPoolExecutor(max_workers=min(MAX_LOAD_WORKERS, len(items))) as executor:
+        futures = {executor.submit(timed_load, item): i for i, item in enumerate(items)}
+        for done, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            item = items[i]
             try:
-                content, title, language = url_to_text(item)
-                user_input = f'{item}:\n{content}\n'
-                msg = UserMessage(text=user_input)
-                chat_ctx.add_message(msg)
-                print(f"Loaded {item} into context ({msg.tokens} tokens)")
+                result, dt = future.result()
+                results[i] = result
+                print(f"[{done}/{len(items)}] Fetched {item} ({dt:.2f}s)")
             except Exception as e:
-                print(f"Error fetching URL: {e}")
+                print(f"[{done}/{len(items)}] {_describe_error(item, e)}")
+
+    for item, result in zip(items, results):
+        if result is None:
+            continue
+        if isinstance(result, int):
+            print(describe_document(item, result))
+        elif isinstance(result, tuple):
+            status, msg = registry.add(*result)
+            print(registry.describe(item, status, msg))
         else:
-            try:
-                with open(item, 'r') as file:
-                    user_code = file.read()
-                    user_input = f'{item}:\n{user_code}\n'
-                    msg = UserMessage(text=user_input)
-                    chat_ctx.add_message(msg)
-                    print(f"Loaded {item} into context ({msg.tokens} tokens)")
-            except FileNotFoundError:
-                print(f"File not found: {item}")
-            except IsADirectoryError:
-                print(f"Path is a directory, not a file: {item}")
-            except Exception as e:
-                print(f"Unexpected error: {e}")
+            chat_ctx.add_message(result, kind=URL if is_url(item) else FILE, name=item)
+            print(f"Loaded {item} into context ({result.tokens} tokens)")
+    print(f"Loaded {sum(result is not None for result in results)}/{len(items)} items in {time() - t0:.2f}s")
@@ -0,0 +1,321 @@
+"""
+token budgeted context packing
+
+PackedChatContext replaces chatstack's fixed window of recent messages
+with a packer that fills a token budget by priority:
+
+  1. the current user message
+  2. pinned files and urls
+  3. loaded files and urls referenced by the current user message
+  4. everything else, newest first
+
+large documents are kept out of the message list in a retrieval
+DocumentStore; the chunks most relevant to the current question are
+packed first, up to retrieval_tokens.
+
+packed messages are sent in an order that keeps the start of the prompt
+byte-identical from turn to turn so provider prompt caching can reuse it:
+the system prompt, pinned files and urls, the other files and urls in the
+order they were loaded, the earlier turns, then the volatile retrieved
+excerpts and the current question.
+
+transient api errors are retried with retry.call_with_retry; a streamed
+completion is retried until its first token arrives, as a retry after that
+would repeat text already shown.
+
+messages that do not fit are skipped so that smaller ones later in the
+order can still be packed.  token counts are computed once by chatstack
+when a message is created and reused on every turn.
+"""
+
+import itertools
+import os
+import threading
+import urllib.parse
+from time import perf_counter
+from dataclasses import dataclass
+from typing import List, Optional
+
+from chatstack import ChatContext, ChatRoleMessage, AssistantMessage, ContextMessage, UserMessage
+from chatstack.chatstack import ChatResponse, encoder
+from chatstack.pricing import price
+
+from .backend import api_host, get_backend
+from .instrument import count, record, timed
+from . import prompt_cache
+from .retry import call_with_retry
+
+LARGE_DOC_TOKENS = int(os.environ.get("PAIR_LARGE_DOC_TOKENS", 4000))   # larger files and urls are chunked for retrieval
+MODEL_TRIES = 5             # attempts per completion for transient api errors
+MODEL_DEADLINE = 120        # seconds allowed for those attempts
+
+TURN = 'turn'
+FILE = 'file'
+URL = 'url'
+
+
+@dataclass
+class ContextItem:
+    kind    : str                   # TURN, FILE or URL
+    name    : Optional[str] = None  # path or url for loaded content
+    pinned  : bool = False
+
+    def aliases(self) -> List[str]:
+        """
+        strings that refer to this item when they appear in a question
+        """
+        if not self.name:
+            return []
+        aliases = [self.name]
+        if self.kind == URL:
+            last = urllib.parse.urlparse(self.name).path.rstrip('/').split('/')[-1]
+        else:
+            last = os.path.basename(self.name)
+        if last:
+            aliases.append(last)
+        return aliases
+
+
+@dataclass
+class PackedMessage:
+    msg       : ChatRoleMessage
+    item      : ContextItem
+    included  : bool
+    reason    : str     # why the message was or was not packed
+
+
+class PackedChatContext(ChatContext):
+
+    def __init__(self, *args, token_budget : Optional[int] = None, retrieval_tokens : Optional[int] = None, **kwargs):
+        """
+        token_budget limits the input tokens sent to the model; by default the whole
+        model context less min_response_tokens is used.
+        retrieval_tokens limits the chunks of large documents sent per turn.
+        """
+        super().__init__(*args, **kwargs)
+        self.token_budget = token_budget
+        self.retrieval_tokens = retrieval_tokens
+        self.last_retrieved = []    # list of retrieval.Retrieved from the last completion
+        self._documents = None
+        self._documents_lock = threading.Lock()     # documents are added from loader threads
+        self.items = {}             # id(msg) -> (msg, ContextItem)
+        self.last_pack = []         # list of PackedMessage from the last completion
+        self._excluded = set()      # ids of messages left out of the last completion
+
+    def add_message(self, msg : ChatRoleMessage, kind : str = TURN, name : Optional[str] = None, pinned : bool = False):
+        super().add_message(msg)
+        self.items[id(msg)] = (msg, ContextItem(kind, name, pinned))
+
+    def item(self, msg) -> ContextItem:
+        entry = self.items.get(id(msg))
+        if entry and entry[0] is msg:
+            return entry[1]
+        return ContextItem(TURN)
+
+    def in_window(self, msg) -> bool:
+        """
+        True unless msg was left out of the last completion
+        """
+        return id(msg) not in self._excluded
+
+    def set_pinned(self, name : str, pinned : bool = True) -> int:
+        """
+        pin or unpin the loaded files and urls matching name; returns the number of messages changed
+        """
+        count = 0
+        for msg in self.messages:
+            item = self.item(msg)
+            if item.kind != TURN and name in item.aliases():
+                item.pinned = pinned
+                count += 1
+        return count
+
+    @property
+    def documents(self):
+        """
+        the retrieval.DocumentStore of large documents, created when first used
+        """
+        if self._documents is None:
+            with self._documents_lock:
+                if self._documents is None:
+                    from .retrieval import DocumentStore    # numpy is only imported once a large document is loaded
+                    self._documents = DocumentStore()
+        return self._documents
+
+    def add_document(self, name : str, text : str) -> Optional[int]:
+        """
+        index text for retrieval if it is over LARGE_DOC_TOKENS and return its number of chunks.
+        returns None if the text is small enough to be added as a message.
+        """
+        if len(text) < LARGE_DOC_TOKENS or len(encoder.encode(text)) < LARGE_DOC_TOKENS:
+            if self._documents is not None:
+                self._documents.remove(name)
+            return None
+        return len(self.documents.add(name, text).chunks)
+
+    def retrieve(self, question : str) -> list:
+        """
+        the chunks of large documents to send with question, in document order
+        """
+        if self._documents is None or not self._documents.docs:
+            return []
+        from .retrieval import RETRIEVAL_TOKENS
+        budget = min(self.retrieval_tokens or RETRIEVAL_TOKENS, self.budget() // 2)
+        return sorted(self._documents.search(question, budget), key=lambda r: (r.name, r.chunk))
+
+    def budget(self) -> int:
+        budget = self.max_model_context - self.min_response_tokens
+        if self.token_budget:
+            budget = min(budget, self.token_budget)
+        return budget - self.base_system_msg.tokens
+
+    def pack(self, question : Optional[str] = None, reserved : int = 0) -> List[PackedMessage]:
+        """
+        decide which messages fit the token budget, less reserved tokens, for question,
+        the text of the newest user message if not given.
+        returns a PackedMessage for every message in chronological order.
+        """
+        # forget metadata for messages no longer in the context
+        live = {id(msg) for msg in self.messages}
+        self.items = {k: v for k, v in self.items.items() if k in live}
+
+        if question is None and self.messages and self.messages[0].role == 'user':
+            question = self.messages[0].text
+        question = question or ""
+
+        candidates = []
+        for age, msg in enumerate(self.messages):   # newest first
+            item = self.item(msg)
+            if age == 0 and item.kind == TURN and msg.role == 'user':
+                rank, reason = 0, 'current message'
+            elif item.pinned:
+                rank, reason = 1, 'pinned'
+            elif item.kind != TURN and any(alias in question for alias in item.aliases()):
+                rank, reason = 2, 'referenced'
+            else:
+                rank, reason = 3, 'recent'
+            candidates.append((rank, age, msg, item, reason))
+        candidates.sort(key=lambda c: (c[0], c[1]))
+
+        remaining = self.budget() - reserved
+        packed = {}
+        for rank, age, msg, item, reason in candidates:
+            if msg.tokens <= remaining:
+                remaining -= msg.tokens
+                packed[age] = PackedMessage(msg, item, True, reason)
+            else:
+                packed[age] = PackedMessage(msg, item, False, 'over budget')
+        return [packed[age] for age in sorted(packed, reverse=True)]
+
+    @timed("chat.assemble")
+    def _assemble_completion_msgs(self, dynamic_context) -> List[ChatRoleMessage]:
+        question = self.messages[0].text if self.messages and self.messages[0].role == 'user' else ""
+        self.last_retrieved = self.retrieve(question)
+        retrieved_messages = [ContextMessage(prefix=f"{r.name} (excerpt {r.chunk + 1})", text=r.text)
+                              for r in self.last_retrieved]
+        reserved = sum(msg.tokens for msg in retrieved_messages)
+        self.last_pack = self.pack(reserved=reserved)
+        self._excluded = {id(p.msg) for p in self.last_pack if not p.included}
+        included = [p for p in self.last_pack if p.included]
+        remaining = self.budget() - reserved - sum(p.msg.tokens for p in included)
+
+        dynamic_context_messages = []
+        for msg in dynamic_context or []:
+            if msg.tokens > remaining:
+                break
+            dynamic_context_messages.append(msg)
+            remaining -= msg.tokens
+
+        # stable content first: pinned then other loaded content in load order, then the turns
+        loaded = sorted((p for p in included if p.item.kind != TURN), key=lambda p: not p.item.pinned)
+        turns = [p.msg for p in included if p.item.kind == TURN]
+        current = turns[-1:] if turns and turns[-1] is self.messages[0] and turns[-1].role == 'user' else []
+        history = turns[:len(turns) - len(current)]
+        return ([self.base_system_msg] + [p.msg for p in loaded] + history +
+                retrieved_messages + dynamic_context_messages + current)
+
+    def message_stream(self, msg : UserMessage, dynamic_context : Optional[list[ContextMessage]] = None):
+        """
+        user_message_stream for a UserMessage the caller made, so the caller can find the
+        question again, e.g. to remove it if the response is cancelled
+        """
+        self.add_message(msg)
+        yield from self._completion_stream(self._assemble_completion_msgs(dynamic_context))
+
+    def _completion(self, msgs : List[ChatRoleMessage]) -> str:
+        messages = [{"role": msg.role, "content": msg.content()} for msg in msgs]
+        prompt_cache.observe("chat", messages)
+        return call_with_retry(lambda: get_backend().complete(messages, model=self.model, temperature=self.temperature,
+                                                              max_tokens=self.max_response_tokens),
+                               tries=MODEL_TRIES, deadline=MODEL_DEADLINE, host=api_host())
+
+    def _start_stream(self, messages : List[dict]):
+        """
+        start streaming a completion and wait for its first delta; returns (first delta, stream)
+        """
+        stream = get_backend().stream(messages, model=self.model, temperature=self.temperature,
+                                      max_tokens=self.max_response_tokens)
+        try:
+            return next(stream), stream
+        except StopIteration:
+            return None, stream
+
+    def _completion_stream(self, msgs : List[ChatRoleMessage]):
+        """
+        stream the completion through the model backend, yielding a ChatResponse per delta
+        and a final ChatResponse with the token counts and price
+        """
+        cr = ChatResponse(text="",
+                          delta="",
+                          model=self.model,
+                          temperature=self.temperature,
+                          inputs=msgs,
+                          input_tokens=sum([msg.tokens for msg in msgs]) + 2,
+                          response_tokens=0,
+                          price=0)
+        messages = [{"role": msg.role, "content": msg.content()} for msg in msgs]
+        prompt_cache.observe("chat", messages)
+        t0 = perf_counter()
+        delta, stream = call_with_retry(self._start_stream, (messages,), tries=MODEL_TRIES,
+                                        deadline=MODEL_DEADLINE, host=api_host())
+        record("chat.first_token", perf_counter() - t0)
+        try:
+            for delta in itertools.chain([delta] if delta is not None else [], stream):
+                cr.delta = delta
+                cr.text += delta
+                yield cr
+        finally:
+            stream.close()
+        record("chat.stream", perf_counter() - t0)
+        resp_msg = AssistantMessage(text=cr.text)
+        self.messages.insert(0, resp_msg)  # add response to context
+        cr.response_tokens = resp_msg.tokens
+        cr.price = price(self.model, cr.input_tokens, resp_msg.tokens)
+        count("chat.input_tokens", cr.input_tokens)
+        count("chat.response_tokens", cr.response_tokens)
+        yield cr
+
+    def describe_pack(self, pack : Optional[List[PackedMessage]] = None, question : Optional[str] = None) -> str:
+        """
+        return a table of the document chunks and messages in pack, by default a preview
+        of the next completion for question
+        """
+        if pack is None:
+            retrieved = self.retrieve(question or "")
+            pack = self.pack(question or "", reserved=sum(r.tokens for r in retrieved))
+        else:
+            retrieved = self.last_retrieved
+        lines = [f"{'':2}{'kind':10}{'tokens':>8}  {'reason':16}content"]
+        used = 0
+        for r in retrieved:
+            used += r.tokens
+            lines.append(f"{'+':2}{'chunk':10}{r.tokens:8d}  {f'score {r.score:.2f}':16}{r.name} excerpt {r.chunk + 1}")
+        for p in pack:
+            if p.included:
+                used += p.msg.tokens
+            label = p.item.name or p.msg.text.strip().replace('\n', ' ')[:50]
+            lines.append(f"{'+' if p.included else '-':2}{p.item.kind if p.item.kind != TURN else p.msg.role:10}"
+                         f"{p.msg.tokens:8d}  {p.reason:16}{label}")
+        lines.append(f"{used} of {self.budget()} tokens packed, "
+                     f"{sum(not p.included for p in pack)} messages left out")
+        return "\n".join(lines)
@@ -0,0 +1,331 @@
+"""
+apply unified diffs from model responses in process
+
+every ```diff block in a response is parsed into per-file patches.  hunks
+are located by exact match at the stated line, then by searching outward
+from it, then ignoring whitespace differences, then with leading and
+trailing context lines dropped (patch style fuzz).  hunk line counts from
+the model are not trusted; a hunk runs until the next hunk or file header.
+
+a diff naming an absolute path, or a path that resolves outside the
+working directory, is refused before anything is read.  all files are
+patched in memory first, so a failed hunk leaves the tree untouched.  the new contents are then written with os.replace and the
+original contents are kept so the change can be rolled back.
+"""
+
+import difflib
+import os
+import re
+import tempfile
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+DIFF_BLOCK_RE = re.compile(r'```diff[^\n]*\n(.*?)```', re.DOTALL)
+HUNK_HEADER_RE = re.compile(r'^@@\s*-(\d+)(?:,(\d+))?\s+\+(\d+)(?:,(\d+))?\s*@@')
+MAX_FUZZ = 2         # context lines that may be dropped from each end of a hunk
+
+
+class PatchError(Exception):
+    """
+    A patch could not be parsed or applied.
+    """
+
+
+@dataclass
+class Hunk:
+    old_start  : Optional[int]                      # 1-based line in the original file, None if unknown
+    lines      : List[Tuple[str, str]] = field(default_factory=list)   # (' ' | '-' | '+', text)
+
+    def old_lines(self, fuzz: int = 0) -> List[str]:
+        return [t for tag, t in self.trimmed(fuzz) if tag != '+']
+
+    def trimmed(self, fuzz: int = 0) -> List[Tuple[str, str]]:
+        """
+        the hunk lines with up to fuzz context lines dropped from each end
+        """
+        lines = self.lines
+        for _ in range(fuzz):
+            if lines and lines[0][0] == ' ':
+                lines = lines[1:]
+            if lines and lines[-1][0] == ' ':
+                lines = lines[:-1]
+        return lines
+
+
+@dataclass
+class FilePatch:
+    old_path  : Optional[str]        # None for a new file
+    new_path  : Optional[str]        # None for a deleted file
+    hunks     : List[Hunk] = field(default_factory=list)
+
+    @property
+    def path(self) -> str:
+        return self.new_path or self.old_path
+
+
+def diff_blocks(text: str) -> List[str]:
+    """
+    return the body of every ```diff block in text
+    """
+    return [m.group(1) for m in DIFF_BLOCK_RE.finditer(text)]
+
+
+def _resolve_path(path: str) -> Optional[str]:
+    path = path.split('\t')[0].strip()
+    if path == '/dev/null':
+        return None
+    if not os.path.exists(path) and path[:2] in ('a/', 'b/'):
+        return path[2:]
+    return path
+
+
+def check_path(path: str):
+    """
+    raise PatchError unless path is relative and resolves, following symlinks, inside the working directory
+    """
+    cwd = os.path.realpath(os.getcwd())
+    if os.path.isabs(path) or os.path.commonpath([cwd, os.path.realpath(path)]) != cwd:
+        raise PatchError(f"{path} is outside the working directory")
+
+
+def parse_patch(diff: str) -> List[FilePatch]:
+    """
+    parse unified diff text into FilePatches
+    """
+    patches = []
+    hunk = None
+    lines = diff.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith('--- ') and i + 1 < len(lines) and lines[i+1].startswith('+++ '):
+            patches.append(FilePatch(_resolve_path(line[4:]), _resolve_path(lines[i+1][4:])))
+            hunk = None
+            i += 2
+            continue
+        if line.startswith('@@'):
+            if not patches:
+                raise PatchError("hunk found before a file header")
+            m = HUNK_HEADER_RE.match(line)
+            hunk = Hunk(int(m.group(1)) if m else None)
+            patches[-1].hunks.append(hunk)
+        elif hunk is not None and line[:1] in (' ', '-', '+'):
+            hunk.lines.append((line[0], line[1:]))
+        elif hunk is not None and line == '':
+            hunk.lines.append((' ', ''))     # blank context line with its leading space stripped
+        elif line.startswith('\\'):
+            pass                             # "\ No newline at end of file"
+        i += 1
+    for p in patches:
+        for h in p.hunks:
+            while h.lines and h.lines[-1] == (' ', ''):
+                h.lines.pop()                # trailing blank lines are usually block formatting
+    if not patches:
+        raise PatchError("no file headers found in diff")
+    return patches
+
+
+def _normalize(line: str) -> str:
+    return ' '.join(line.split())
+
+
+def _find(lines: List[str], block: List[str], hint: int, normalize: bool) -> Optional[int]:
+    """
+    return the index in lines where block starts, searching outward from hint
+    """
+    if not block:
+        return min(max(hint, 0), len(lines))
+    if normalize:
+        lines = [_normalize(l) for l in lines]
+        block = [_normalize(l) for l in block]
+    last = len(lines) - len(block)
+    if last < 0:
+        return None
+    hint = min(max(hint, 0), last)
+    for offset in range(0, max(hint, last - hint) + 1):
+        for start in (hint - offset, hint + offset):
+            if 0 <= start <= last and lines[start:start+len(block)] == block:
+                return start
+    return None
+
+
+def apply_hunks(lines: List[str], hunks: List[Hunk]) -> Tuple[List[str], List[str]]:
+    """
+    apply hunks to lines, returning the new lines and a note for each hunk that needed
+    an offset, whitespace tolerance or fuzz
+    """
+    notes = []
+    delta = 0
+    for n, hunk in enumerate(hunks, 1):
+        hint = (hunk.old_start - 1 + delta) if hunk.old_start else 0
+        for fuzz in range(MAX_FUZZ + 1):
+            old = hunk.old_lines(fuzz)
+            if fuzz and old == hunk.old_lines(fuzz - 1):
+                continue
+            start = _find(lines, old, hint, normalize=False)
+            how = "exact"
+            if start is None:
+                start = _find(lines, old, hint, normalize=True)
+                how = "ignoring whitespace"
+            if start is not None:
+                break
+        else:
+            raise PatchError(f"hunk {n} does not match:\n" + "\n".join(hunk.old_lines()))
+        if hunk.old_start and start != hint:
+            notes.append(f"hunk {n} applied at offset {start - hint:+d}")
+        if how != "exact":
+            notes.append(f"hunk {n} applied {how}")
+        if fuzz:
+            notes.append(f"hunk {n} applied with fuzz {fuzz}")
+        # context lines keep the file's text, which may differ in whitespace from the hunk
+        matched = iter(lines[start:start+len(old)])
+        new = []
+        for tag, text in hunk.trimmed(fuzz):
+            if tag == ' ':
+                new.append(next(matched))
+            elif tag == '-':
+                next(matched)
+            else:
+                new.append(text)
+        lines = lines[:start] + new + lines[start+len(old):]
+        delta += len(new) - len(old)
+    return lines, notes
+
+
+@dataclass
+class FileChange:
+    path      : str
+    original  : Optional[str]     # None if the file did not exist
+    updated   : Optional[str]     # None if the file is deleted
+    notes     : List[str] = field(default_factory=list)
+    source    : Optional[str] = None   # the file original was read from, if not path
+
+    def preview(self) -> str:
+        return ''.join(difflib.unified_diff((self.original or '').splitlines(keepends=True),
+                                            (self.updated or '').splitlines(keepends=True),
+                                            fromfile=f'a/{self.path}', tofile=f'b/{self.path}'))
+
+
+class PatchSet:
+    """
+    the changes from all the diffs in a response, computed in memory
+    """
+
+    def __init__(self, changes: List[FileChange]):
+        self.changes = changes
+        self.applied = False
+
+    @classmethod
+    def from_text(cls, text: str) -> 'PatchSet':
+        """
+        parse every diff block in text (or text itself if it has none) and compute the changes.
+        raises PatchError if any hunk cannot be applied.
+        """
+        return cls.from_blocks(diff_blocks(text) or [text])
+
+    @classmethod
+    def from_blocks(cls, blocks: List[str]) -> 'PatchSet':
+        """
+        compute the changes of the diff block bodies, in order; raises PatchError if any hunk cannot be applied
+        """
+        patches = [fp for block in blocks for fp in parse_patch(block)]
+        for fp in patches:
+            for path in (fp.old_path, fp.new_path):
+                if path is not None:
+                    check_path(path)
+        contents = {}                        # path -> (original, current)
+        notes = {}
+        sources = {}
+        for fp in patches:
+            path = fp.path
+            if path not in contents:
+                original = None
+                if fp.old_path and os.path.exists(fp.old_path):
+                    with open(fp.old_path) as f:
+                        original = f.read()
+                elif fp.old_path:
+                    raise PatchError(f"file not found: {fp.old_path}")
+                contents[path] = (original, original)
+                sources[path] = fp.old_path
+            original, current = contents[path]
+            lines = (current or '').splitlines()
+            try:
+                lines, file_notes = apply_hunks(lines, fp.hunks)
+            except PatchError as e:
+                raise PatchError(f"{path}: {e}")
+            notes.setdefault(path, []).extend(file_notes)
+            trailing_newline = '\n' if lines and (not current or current.endswith('\n')) else ''
+            updated = None if fp.new_path is None else '\n'.join(lines) + trailing_newline
+            contents[path] = (original, updated)
+        return cls([FileChange(path, original, updated, notes.get(path, []), sources[path])
+                    for path, (original, updated) in contents.items()])
+
+    def preview(self) -> str:
+        """
+        dry run: the unified diff of what apply() would change, with any matching notes
+        """
+        out = []
+        for change in self.changes:
+            out.extend(f"# {note}\n" for note in change.notes)
+            out.append(change.preview())
+        return ''.join(out)
+
+    def check_unchanged(self):
+        """
+        raise PatchError if a file has changed on disk since the changes were computed
+        """
+        for change in self.changes:
+            source = change.source or change.path
+            current = None
+            if os.path.exists(source):
+                with open(source) as f:
+                    current = f.read()
+            if current != change.original:
+                raise PatchError(f"{change.path} has changed since the diff was checked")
+
+    def apply(self):
+        """
+        write every changed file, restoring any already written if one fails.
+        raises PatchError, writing nothing, if a file changed since the diff was computed.
+        """
+        self.check_unchanged()
+        written = []
+        try:
+            for change in self.changes:
+                _write(change.path, change.updated)
+                written.append(change)
+        except Exception:
+            for change in reversed(written):
+                _write(change.path, change.original)
+            raise
+        self.applied = True
+
+    def rollback(self):
+        """
+        restore the files changed by apply()
+        """
+        if not self.applied:
+            return
+        for change in reversed(self.changes):
+            _write(change.path, change.original)
+        self.applied = False
+
+
+def _write(path: str, content: Optional[str]):
+    if content is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.pair-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -33,9 +33,19 @@ class EmptyText(ExtractException):
     """
 
 
+class ContentTooLarge(ExtractException):
+    """
+    The content exceeds the configured size limit.
+    """
+
+
 class NetworkError(ExtractException):
     """
     Unable to access the content.
     """
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
 
     
@@ -3,80 +3,239 @@ Extract readable text from a URL via various hacks
 """
 
 from loguru import logger
-from bs4 import BeautifulSoup, NavigableString, Tag
 from readability import Document    # https://github.com/buriy/python-readability
-import requests
+import lxml.html
+import lxml.etree
 import urllib.parse
 import json
+import os
+import re
+import codecs
 
-from .github_api import github_readme_text
-from .pdf_text import pdf_text
 from .exceptions import *
 from .retry import retry
+from . import http_pool
+from . import url_cache
+from .instrument import timer, timed
     
 user_agent = "Mozilla/5.0 (Windows NT 10.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36"
 
 headers = {'User-Agent': user_agent}
 
-def extract_text_from_html(content):
-    soup = BeautifulSoup(content, 'html.parser')
+# byte limits per kind of content; pdfs are limited by pdf_text.MAX_PDF_BYTES
+MAX_BYTES = {'html': 16 * 2**20, 'json': 8 * 2**20, 'text': 8 * 2**20}
+# readable text kept per url, about 100k tokens; reading stops once this much is available
+MAX_TEXT_CHARS = int(os.environ.get("PAIR_URL_MAX_CHARS", 400_000))
+# html is read until its text, tags stripped, is this many times MAX_TEXT_CHARS,
+# since readability keeps only part of the page text
+HTML_TEXT_FACTOR = 4
+STREAM_CHUNK_SIZE = 2**16
+TAG_RE = re.compile(rb'<[^>]*>')
 
-    blacklist = ['[document]','noscript','header','html','meta','head','input','script', "style"]
-    # there may be more elements we don't want
+# text under these elements is not readable content
+BLACKLIST = {'noscript','header','html','meta','head','input','script', "style"}
+# there may be more elements we don't want
 
-    output =  ""      
-    for t in soup.find_all(text=True):
-        if t.parent.name not in blacklist:
-            output += '{} '.format(t)
-    return output
 
-def get_language(html):
-    soup = BeautifulSoup(html, 'html.parser')
+def parse_html(html):
+    """
+    parse html text into an lxml tree
+    """
     try:
-        return soup.html["lang"]
-    except:
+        return lxml.html.document_fromstring(html)
+    except ValueError:
+        # lxml refuses unicode strings that carry an xml encoding declaration
+        return lxml.html.document_fromstring(html.encode('utf-8'))
+    except lxml.etree.ParserError:
+        raise EmptyText("Unable to parse html")
+
+
+def extract_text_from_html(content):
+    """
+    return the readable text of content, an html string or lxml tree.
+    each text node not under a BLACKLIST element is followed by a space.
+    """
+    root = parse_html(content) if isinstance(content, (str, bytes)) else content
+    parts = []
+    for el in root.iter():
+        if isinstance(el.tag, str) and el.text and el.tag not in BLACKLIST:
+            parts.append(el.text)
+        parent = el.getparent()
+        if el.tail and parent is not None and parent.tag not in BLACKLIST:
+            parts.append(el.tail)
+    if not parts:
         return ""
+    return ' '.join(parts) + ' '
+
 
-@retry(tries=5)    
-def get_url_text(url):
+def get_language(content):
+    """
+    return the lang attribute of the html element of content, an html string or lxml tree
+    """
+    root = parse_html(content) if isinstance(content, (str, bytes)) else content
+    return root.get("lang", "")
+
+
+def html_text(html):
+    """
+    extract the readable text, title, and language from html, a string or lxml tree.
+    the page is parsed once and the tree is shared with readability.
+    """
+    with timer("extract.parse_html"):
+        tree = parse_html(html) if isinstance(html, (str, bytes)) else html
+    language = get_language(tree)
+    with timer("extract.readability"):
+        doc = Document(tree)
+        title = doc.title()
+        summary = doc.summary()
+    with timer("extract.html_to_text"):
+        text = extract_text_from_html(summary)
+    return text, title, language
+
+
+@timed("extract.get_url_text")
+@retry(tries=5, deadline=30, host=lambda url, *args, **kwargs: urllib.parse.urlparse(url).netloc)
+def get_url_text(url, use_cache=True):
     """
     get url content and extract readable text
-    returns the text
+    returns the text, title, and language
+    results are cached on disk and revalidated with a conditional GET once stale;
+    use_cache=False (or PAIR_NO_CACHE in the environment) bypasses the cache.
     """
-    resp = requests.get(url, headers=headers, timeout=30)
+    entry = url_cache.lookup(url) if use_cache else None
+    if entry and entry.is_fresh():
+        logger.info(f"url cache hit: {url}")
+        return entry.result()
+
+    request_headers = dict(headers)
+    if entry:
+        request_headers.update(entry.validators())
+    with http_pool.get(url, headers=request_headers, timeout=30, stream=True) as resp:
+        if entry and resp.status_code == 304:
+            logger.info(f"url cache revalidated: {url}")
+            url_cache.refresh(entry)
+            return entry.result()
+
+        text, title, language = extract_response_text(url, resp)
+    if use_cache:
+        url_cache.store(url_cache.CacheEntry(url, text, title, language,
+                                             etag=resp.headers.get('ETag'),
+                                             last_modified=resp.headers.get('Last-Modified')))
+    return text, title, language
 
+
+def content_kind(content_type):
+    """
+    classify a Content-Type header as 'json', 'pdf', 'html' or 'text', or None if unsupported
+    """
+    content_type = content_type.lower()
+    if 'json' in content_type:
+        return 'json'
+    if 'pdf' in content_type:
+        return 'pdf'
+    if 'html' in content_type:
+        return 'html'
+    if content_type.startswith('text/'):
+        return 'text'
+    return None
+
+
+def check_length(resp, max_bytes):
+    """
+    refuse a response whose Content-Length is over max_bytes before reading the body
+    """
+    length = resp.headers.get('Content-Length')
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise ContentTooLarge(f"Content is {int(length)} bytes, limit is {max_bytes} bytes")
+
+
+def _charset(resp):
+    """
+    the charset given in the Content-Type header, if any
+    """
+    return resp.encoding if 'charset' in resp.headers.get('Content-Type', '').lower() else None
+
+
+def stream_text(resp, max_bytes, max_chars):
+    """
+    read and incrementally decode a text body, stopping after max_bytes or once max_chars are decoded
+    """
+    decoder = codecs.getincrementaldecoder(_charset(resp) or 'utf-8')(errors='replace')
+    parts = []
+    size = chars = 0
+    for chunk in resp.iter_content(STREAM_CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_bytes:
+            logger.warning(f"stopped reading {resp.url} at the {max_bytes} byte limit")
+            chunk = chunk[:max_bytes - (size - len(chunk))]
+        parts.append(decoder.decode(chunk))
+        chars += len(parts[-1])
+        if chars >= max_chars or size >= max_bytes:
+            break
+    else:
+        parts.append(decoder.decode(b'', final=True))
+    return ''.join(parts)[:max_chars]
+
+
+def stream_html(resp, max_bytes, max_chars):
+    """
+    feed an html body to lxml as it arrives and return the tree, stopping after max_bytes
+    or once the page holds HTML_TEXT_FACTOR * max_chars of text
+    """
+    parser = lxml.html.HTMLParser(encoding=_charset(resp))
+    size = text_size = 0
+    for chunk in resp.iter_content(STREAM_CHUNK_SIZE):
+        size += len(chunk)
+        parser.feed(chunk)
+        text_size += len(TAG_RE.sub(b'', chunk).strip())
+        if size >= max_bytes:
+            logger.warning(f"stopped reading {resp.url} at the {max_bytes} byte limit")
+            break
+        if text_size >= HTML_TEXT_FACTOR * max_chars:
+            logger.info(f"stopped reading {resp.url} after {size} bytes, enough text for the context")
+            break
+    try:
+        return parser.close()
+    except lxml.etree.XMLSyntaxError:
+        raise EmptyText("Unable to parse html")
+
+
+def extract_response_text(url, resp, max_chars=MAX_TEXT_CHARS):
+    """
+    extract the readable text, title, and language from a requests response requested with stream=True.
+    the content type and length are checked before the body is read, and the body is only
+    read as far as needed for max_chars of text.
+    """
     if resp.status_code != 200:
         logger.warning(url)
-        raise NetworkError(f"Unable to get URL ({resp.status_code})")
-
-    CONTENT_TYPE = resp.headers['Content-Type']
+        raise NetworkError(f"Unable to get URL ({resp.status_code})", resp.status_code,
+                           resp.headers.get('Retry-After'))
 
-    if 'json' in CONTENT_TYPE:
-        return str(resp.content), "", ""
-    
-    if 'pdf' in CONTENT_TYPE:
-        text, title, language = pdf_text(resp.content)
-        return text, title, language    
-    
-    if "html" not in CONTENT_TYPE:
+    CONTENT_TYPE = resp.headers.get('Content-Type', '')
+    kind = content_kind(CONTENT_TYPE)
+    if kind is None:
         logger.warning(url)
-        raise UnsupportedContentType(f"Unsupported content type: {resp.headers['Content-Type']}")
+        raise UnsupportedContentType(f"Unsupported content type: {CONTENT_TYPE}")
+
+    if kind == 'pdf':
+        from .pdf_text import pdf_text_from_response   # pdfminer is only imported for pdfs
+        return pdf_text_from_response(resp, max_chars=max_chars)
 
-    language = get_language(resp.text)
+    check_length(resp, MAX_BYTES[kind])
+    if kind in ('json', 'text'):
+        return stream_text(resp, MAX_BYTES[kind], max_chars), "", ""
+
+    text, title, language = html_text(stream_html(resp, MAX_BYTES[kind], max_chars))
     logger.info(f"language: {language}")
-        
-    doc = Document(resp.text)
-    title = doc.title()
-    text = extract_text_from_html(doc.summary())
 
     if not len(text) or text.isspace():
         logger.warning(url)
         raise EmptyText("Unable to extract text data from url")
-    return text, title, language
-
+    return text[:max_chars], title, language
 
 
-def url_to_text(url):
+@timed("extract.url_to_text")
+def url_to_text(url, use_cache=True):
     #logger.info("url_to_text: "+url)
     HOPELESS = ["youtube.com",
                 "www.youtube.com"]
@@ -84,12 +243,16 @@ def url_to_text(url):
         logger.warning(url)        
         raise UnsupportedHostException("Unsupported host: {urllib.parse.urlparse(url).netloc}")
 
-    if urllib.parse.urlparse(url).netloc == 'github.com':
-        # for github repos use api to attempt to find a readme file
-        text, title = github_readme_text(url)
+    result = None
+    if urllib.parse.urlparse(url).netloc in ('github.com', 'www.github.com', 'raw.githubusercontent.com'):
+        # for github repos, files and directories use the api; other github pages are extracted from html
+        from .github_api import github_text
+        result = github_text(url, MAX_TEXT_CHARS, ttl=url_cache.DEFAULT_TTL if use_cache else 0)
+    if result is not None:
+        text, title = result
         language = 'en'  # XXX  dynamically determine language
     else:
-        text, title, language = get_url_text(url)
+        text, title, language = get_url_text(url, use_cache=use_cache)
 
     #logger.debug("url_to_text: "+text)
     return text, title, language
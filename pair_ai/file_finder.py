@@ -0,0 +1,229 @@
+"""
+gitignore aware file discovery with an incremental cache
+
+FileFinder walks a tree with os.scandir, skipping the default excludes
+(.git, node_modules, virtualenvs, ...), anything listed in PAIR_EXCLUDE
+and anything matched by the .gitignore files in the tree.  the entries of
+each directory are cached along with the directory mtime, so a refresh
+only rescans the directories whose contents have changed.
+"""
+
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+# gitignore style patterns that are always excluded
+DEFAULT_EXCLUDES = ['.git/', '.hg/', '.svn/', 'node_modules/', '.venv/', 'venv/', 'env/',
+                    '__pycache__/', '.tox/', '.nox/', '.mypy_cache/', '.pytest_cache/',
+                    '.ruff_cache/', '*.egg-info/', 'build/', 'dist/']
+
+
+def configured_excludes() -> List[str]:
+    """
+    the default excludes plus any comma separated patterns in PAIR_EXCLUDE
+    """
+    extra = [p.strip() for p in os.environ.get("PAIR_EXCLUDE", "").split(",") if p.strip()]
+    return DEFAULT_EXCLUDES + extra
+
+
+@dataclass
+class IgnoreRule:
+    base      : str          # directory containing the rule, relative to the root ('' for the root)
+    regex     : re.Pattern
+    negate    : bool
+    dir_only  : bool
+
+
+def _translate(pattern: str) -> str:
+    out = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == len(pattern):
+            out.append('(?:/.*)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            out.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            out.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i+1:]:
+            j = pattern.index(']', i + 1)
+            chars = pattern[i+1:j]
+            out.append('[' + ('^' + chars[1:] if chars.startswith('!') else chars) + ']')
+            i = j + 1
+        elif pattern[i] == '\\' and i + 1 < len(pattern):
+            out.append(re.escape(pattern[i+1]))
+            i += 2
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return ''.join(out)
+
+
+def parse_ignore_patterns(lines, base: str = '') -> List[IgnoreRule]:
+    """
+    compile gitignore lines into IgnoreRules relative to the directory base
+    """
+    rules = []
+    for line in lines:
+        line = line.rstrip('\n').rstrip()
+        if not line or line.startswith('#'):
+            continue
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if not line:
+            continue
+        anchored = '/' in line
+        line = line.lstrip('/')
+        regex = _translate(line)
+        regex = f'^{regex}$' if anchored else f'^(?:.*/)?{regex}$'
+        rules.append(IgnoreRule(base, re.compile(regex), negate, dir_only))
+    return rules
+
+
+def is_ignored(rules: List[IgnoreRule], relpath: str, is_dir: bool) -> bool:
+    """
+    the last matching rule decides whether relpath is ignored
+    """
+    ignored = False
+    for rule in rules:
+        if rule.dir_only and not is_dir:
+            continue
+        if rule.base:
+            if not relpath.startswith(rule.base + '/'):
+                continue
+            path = relpath[len(rule.base) + 1:]
+        else:
+            path = relpath
+        if rule.regex.match(path):
+            ignored = not rule.negate
+    return ignored
+
+
+@dataclass
+class _CachedDir:
+    mtime_ns         : int
+    gitignore_mtime  : Optional[int]
+    files            : List[str] = field(default_factory=list)
+    subdirs          : List[str] = field(default_factory=list)
+    rules            : List[IgnoreRule] = field(default_factory=list)
+
+
+class FileFinder:
+
+    def __init__(self, root: Optional[str] = None, excludes: Optional[List[str]] = None):
+        self.root = os.path.abspath(root or os.getcwd())
+        self.rules = parse_ignore_patterns(configured_excludes() if excludes is None else excludes)
+        self._dirs = {}
+        self.rescanned = 0        # directories rescanned by the last refresh
+
+    def _scan(self, rel: str, st: os.stat_result, gitignore_mtime: Optional[int]) -> _CachedDir:
+        entry = _CachedDir(st.st_mtime_ns, gitignore_mtime)
+        with os.scandir(os.path.join(self.root, rel)) as it:
+            for e in it:
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        entry.subdirs.append(e.name)
+                    elif e.is_file():
+                        entry.files.append(e.name)
+                except OSError:
+                    continue
+        entry.files.sort()
+        entry.subdirs.sort()
+        if gitignore_mtime is not None:
+            try:
+                with open(os.path.join(self.root, rel, '.gitignore'), errors='replace') as f:
+                    entry.rules = parse_ignore_patterns(f, rel)
+            except OSError:
+                pass
+        self.rescanned += 1
+        return entry
+
+    def _dir(self, rel: str) -> Optional[_CachedDir]:
+        path = os.path.join(self.root, rel)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        try:
+            gitignore_mtime = os.stat(os.path.join(path, '.gitignore')).st_mtime_ns
+        except OSError:
+            gitignore_mtime = None
+        cached = self._dirs.get(rel)
+        if cached is None or (cached.mtime_ns, cached.gitignore_mtime) != (st.st_mtime_ns, gitignore_mtime):
+            try:
+                cached = self._scan(rel, st, gitignore_mtime)
+            except OSError:
+                return None
+        return cached
+
+    def refresh(self, file_extensions: Optional[Tuple[str, ...]] = ('.py', '.md', '.txt'), under: str = '') -> List[str]:
+        """
+        return the relative paths of the non-ignored files ending in file_extensions (None for all files),
+        rescanning only the directories that changed since the last refresh.
+        under limits the walk to a subdirectory; the .gitignore files above it still apply.
+        """
+        self.rescanned = 0
+        found = []
+        visited = {}
+        rules = self.rules
+        rel = ''
+        for part in [p for p in under.replace(os.sep, '/').split('/') if p]:
+            cached = self._dir(rel)
+            if cached is None:
+                return []
+            visited[rel] = cached
+            rules = rules + cached.rules
+            rel = f"{rel}/{part}" if rel else part
+            if is_ignored(rules, rel, True):
+                return []
+        stack = [(rel, rules)]
+        while stack:
+            rel, rules = stack.pop()
+            cached = self._dir(rel)
+            if cached is None:
+                continue
+            visited[rel] = cached
+            rules = rules + cached.rules
+            prefix = rel + '/' if rel else ''
+            for name in cached.files:
+                if (file_extensions is None or name.endswith(file_extensions)) and not is_ignored(rules, prefix + name, False):
+                    found.append(prefix + name)
+            for name in reversed(cached.subdirs):
+                if not is_ignored(rules, prefix + name, True):
+                    stack.append((prefix + name, rules))
+        if rel:
+            self._dirs.update(visited)     # the rest of the tree was not walked
+        else:
+            self._dirs = visited
+        return [p.replace('/', os.sep) for p in found]
+
+
+_finders = {}
+_finders_lock = threading.Lock()
+
+
+def find_files(file_extensions: Optional[Tuple[str, ...]] = ('.py', '.md', '.txt'), root: Optional[str] = None,
+               under: str = '') -> List[str]:
+    """
+    return the files under root (default the current directory) ending in file_extensions
+    (None for all files), using a cached FileFinder per root.  under limits the search to
+    a subdirectory of root.
+    """
+    root = os.path.abspath(root or os.getcwd())
+    with _finders_lock:
+        if root not in _finders:
+            _finders[root] = FileFinder(root)
+        return _finders[root].refresh(file_extensions, under)
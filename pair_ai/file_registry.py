@@ -0,0 +1,225 @@
+"""
+track files loaded into the chat context so that reloading a file only
+sends what changed
+
+each loaded file is remembered with its mtime, size and content hash.
+re-adding an unchanged file is a no-op; a changed file is sent as a
+compact unified diff against the last version the model saw, or replaces
+the earlier message when a diff would not be smaller or the earlier
+message has already left the chat window.  files loaded together from a
+glob or directory share one message.  when one of them is replaced, the
+shared message is rebuilt with the others at their current text, so the
+context never holds two versions of a file.  files over LARGE_DOC_TOKENS
+are indexed for retrieval instead of sent as a message, tracked the same
+way and indexed again when they change.
+"""
+
+import difflib
+import hashlib
+import os
+from dataclasses import dataclass, field
+from typing import Optional
+
+from chatstack import UserMessage
+
+from .context_packer import FILE
+from .instrument import timed, timer
+
+UNCHANGED = 'unchanged'
+ADDED = 'added'
+REPLACED = 'replaced'
+DIFF = 'diff'
+INDEXED = 'indexed'
+
+# send a diff only when it is at most this fraction of the full file size
+MAX_DIFF_RATIO = 0.5
+
+
+@dataclass
+class FileSnapshot:
+    path      : str               # path as given by the user
+    key       : str               # absolute path used to identify the file
+    mtime_ns  : int
+    size      : int
+    text      : Optional[str]     # None when the file is known to be unchanged
+    digest    : Optional[str]
+
+
+@dataclass
+class FileEntry:
+    path      : str
+    mtime_ns  : int
+    size      : int
+    digest    : str
+    text      : str                                  # the last version the model saw
+    messages  : list = field(default_factory=list)   # base message followed by any diff messages
+    indexed   : bool = False                         # in the retrieval index rather than sent as messages
+
+
+def file_section(path, text):
+    return f'{path}:\n{text}\n'
+
+
+@timed("message.build")
+def file_message(path, text):
+    return UserMessage(text=file_section(path, text))
+
+
+def bundle_message(sections, tokens):
+    """
+    one message holding several files, with the token count already taken per section
+    """
+    return UserMessage.construct(role='user', text=''.join(sections), tokens=tokens + 4)
+
+
+class FileRegistry:
+
+    def __init__(self, chat_ctx):
+        self.chat_ctx = chat_ctx
+        self.files = {}
+
+    def read(self, path) -> FileSnapshot:
+        """
+        read path unless its mtime and size show it is unchanged since it was last added.
+        does not modify the registry, so it is safe to call from worker threads.
+        """
+        key = os.path.abspath(os.path.expanduser(path))
+        st = os.stat(key)
+        entry = self.files.get(key)
+        if entry and (entry.mtime_ns, entry.size) == (st.st_mtime_ns, st.st_size):
+            return FileSnapshot(path, key, st.st_mtime_ns, st.st_size, None, None)
+        with open(key, 'r') as f:
+            text = f.read()
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        return FileSnapshot(path, key, st.st_mtime_ns, st.st_size, text, digest)
+
+    def index(self, snap: FileSnapshot) -> Optional[int]:
+        """
+        index a changed snapshot for retrieval if it is large, returning its number of chunks for add,
+        or None if it is sent as a message.  safe to call from worker threads.
+        """
+        if snap.text is None:
+            return None
+        return self.chat_ctx.add_document(snap.path, snap.text)
+
+    def _in_window(self, msg) -> bool:
+        return self.chat_ctx.in_window(msg)
+
+    def _remove_messages(self, entry):
+        remove = {id(m) for m in entry.messages}
+        base = entry.messages[0] if entry.messages else None
+        others = [e for e in self.files.values() if e is not entry and e.messages and e.messages[0] is base]
+        if others:
+            # rebuild the message shared with files loaded together without this file;
+            # it holds the others at their current text, replacing any diffs sent for them
+            with timer("message.build"):
+                msg = UserMessage(text=''.join(file_section(e.path, e.text) for e in others))
+            for e in others:
+                remove.update(id(m) for m in e.messages)
+                e.messages = [msg]
+            self.chat_ctx.items[id(msg)] = (msg, self.chat_ctx.item(base))
+            self.chat_ctx.messages = [msg if m is base else m for m in self.chat_ctx.messages]
+        self.chat_ctx.messages = [m for m in self.chat_ctx.messages if id(m) not in remove]
+        entry.messages = []
+
+    def add(self, snap: FileSnapshot, chunks: Optional[int] = None):
+        """
+        add a snapshot to the chat context, or record it as indexed if index returned chunks for it.
+        returns (status, msg) where msg is the message added, the number of chunks if indexed,
+        or None if unchanged
+        """
+        entry = self.files.get(snap.key)
+        if entry and (snap.text is None or snap.digest == entry.digest):
+            entry.mtime_ns, entry.size = snap.mtime_ns, snap.size
+            return UNCHANGED, None
+
+        if chunks is not None:
+            if entry:
+                self._remove_messages(entry)        # the file grew past the size sent as a message
+            self.files[snap.key] = FileEntry(snap.path, snap.mtime_ns, snap.size, snap.digest, snap.text, [], True)
+            return INDEXED, chunks
+
+        if entry is None:
+            msg = file_message(snap.path, snap.text)
+            self.files[snap.key] = FileEntry(snap.path, snap.mtime_ns, snap.size, snap.digest, snap.text, [msg])
+            self.chat_ctx.add_message(msg, kind=FILE, name=snap.path)
+            return ADDED, msg
+
+        pinned = bool(entry.messages) and self.chat_ctx.item(entry.messages[0]).pinned
+        diff = ''.join(difflib.unified_diff(entry.text.splitlines(keepends=True),
+                                            snap.text.splitlines(keepends=True),
+                                            fromfile=f'a/{snap.path}',
+                                            tofile=f'b/{snap.path}'))
+        if entry.messages and self._in_window(entry.messages[0]) and len(diff) <= MAX_DIFF_RATIO * len(snap.text):
+            status = DIFF
+            with timer("message.build"):
+                msg = UserMessage(text=f'{snap.path} changed since it was last loaded:\n```diff\n{diff.rstrip()}\n```\n')
+            entry.messages.append(msg)
+        else:
+            status = REPLACED
+            self._remove_messages(entry)
+            msg = file_message(snap.path, snap.text)
+            entry.messages = [msg]
+        self.chat_ctx.add_message(msg, kind=FILE, name=snap.path, pinned=pinned)
+        entry.path, entry.mtime_ns, entry.size = snap.path, snap.mtime_ns, snap.size
+        entry.digest, entry.text, entry.indexed = snap.digest, snap.text, False
+        return status, msg
+
+    def add_bundle(self, name, files, documents=()):
+        """
+        add several snapshots, given as (snapshot, tokens), in one message named name.
+        files that are already loaded are added one by one as with add, as are documents,
+        given as (snapshot, chunks) from index.
+        returns a list of (path, status, msg)
+        """
+        results = [(snap.path, *self.add(snap, chunks)) for snap, chunks in documents]
+        new = []
+        for snap, tokens in files:
+            if snap.key in self.files or snap.text is None:
+                results.append((snap.path, *self.add(snap)))
+            else:
+                new.append((snap, tokens))
+        if not new:
+            return results
+        with timer("message.build"):
+            msg = bundle_message([file_section(snap.path, snap.text) for snap, _ in new],
+                                 sum(tokens for _, tokens in new))
+        for snap, _ in new:
+            self.files[snap.key] = FileEntry(snap.path, snap.mtime_ns, snap.size, snap.digest, snap.text, [msg])
+        self.chat_ctx.add_message(msg, kind=FILE, name=name)
+        return results + [(snap.path, ADDED, msg) for snap, _ in new]
+
+    def load(self, path):
+        snap = self.read(path)
+        return self.add(snap, self.index(snap))
+
+    def describe(self, path, status, msg) -> str:
+        """
+        return a one line description of the result of adding path
+        """
+        if status == UNCHANGED:
+            return f"{path} is unchanged, already in context"
+        if status == DIFF:
+            return f"Sent changes to {path} as a diff ({msg.tokens} tokens)"
+        if status == REPLACED:
+            return f"Reloaded {path} into context ({msg.tokens} tokens)"
+        if status == INDEXED:
+            from .context_loader import describe_document
+            return describe_document(path, msg)
+        return f"Loaded {path} into context ({msg.tokens} tokens)"
+
+    def reload(self):
+        """
+        refresh every tracked file
+        returns a list of (path, status, msg) with status None and msg the exception for files that failed
+        """
+        results = []
+        for key, entry in list(self.files.items()):
+            try:
+                snap = self.read(key)
+                snap.path = entry.path
+                status, msg = self.add(snap, self.index(snap))
+            except Exception as e:
+                status, msg = None, e
+            results.append((entry.path, status, msg))
+        return results
@@ -1,34 +1,338 @@
-# wrangle text out of github repo readme via api
-# only works for repo readme, not other github pages like issues, discussions, etc
+"""
+text from github repositories, directories and files via the github api
+
+a github url is parsed into the repository, ref and path it names:
+  https://github.com/owner/repo                           the README
+  https://github.com/owner/repo/blob/ref/path             one file
+  https://raw.githubusercontent.com/owner/repo/ref/path   one file
+  https://github.com/owner/repo/tree/ref/path             the text files under path
+a directory's file list comes from one recursive git-trees api call and its
+files are downloaded concurrently from raw.githubusercontent.com through the
+shared keep-alive session.  bodies are streamed and read only up to the
+byte and character limits.  responses are kept in the url cache with their
+ETags, except files cut short at a limit, and revalidated with conditional
+requests, which github does not count against the rate limit.  the rate limit reported with each api response is
+tracked; once it is used up, cached responses are used as they are and other
+api requests fail fast until it resets.  set GITHUB_TOKEN for the higher
+authenticated limit and for private repositories.
+
+other github pages, such as issues, are not handled here and are extracted
+from their html.  a ref containing a slash is not supported in blob and tree
+urls, as the url does not say where the ref ends.
+"""
+
+import base64
+import codecs
+import itertools
+import json
+import os
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from time import time
+from typing import List, Optional, Tuple
 
 from loguru import logger
-import requests
-import markdown 
-from bs4 import BeautifulSoup 
+import markdown
+from bs4 import BeautifulSoup
+
+from . import http_pool
+from . import url_cache
+from .exceptions import ContentTooLarge, NetworkError
+from .extract import MAX_BYTES, STREAM_CHUNK_SIZE, check_length
+from .file_finder import configured_excludes, is_ignored, parse_ignore_patterns
+from .file_registry import file_section
+from .instrument import count, timed
+from .retry import retry
+from .workspace import MAX_FILE_BYTES, SNIFF_BYTES, is_binary
+
+API_URL = os.environ.get("PAIR_GITHUB_API", "https://api.github.com").rstrip('/')
+RAW_URL = os.environ.get("PAIR_GITHUB_RAW", "https://raw.githubusercontent.com").rstrip('/')
+MAX_FILES = int(os.environ.get("PAIR_GITHUB_MAX_FILES", 200))      # files downloaded for one directory
+MAX_API_BYTES = MAX_BYTES['json']                                   # larger api responses are refused
+DOWNLOAD_WORKERS = http_pool.PER_HOST_LIMIT
+
+HOSTS = ('github.com', 'www.github.com', 'raw.githubusercontent.com')
+REPO = 'repo'
+BLOB = 'blob'
+TREE = 'tree'
+
+
+@dataclass
+class GithubRef:
+    owner  : str
+    repo   : str
+    kind   : str             # REPO, BLOB or TREE
+    ref    : str = 'HEAD'    # branch, tag or commit; HEAD is the default branch
+    path   : str = ''
+
+    @property
+    def name(self) -> str:
+        name = f"{self.owner}/{self.repo}"
+        if self.path:
+            name += f"/{self.path}"
+        if self.ref != 'HEAD':
+            name += f"@{self.ref}"
+        return name
+
+
+def parse_github_url(url: str) -> Optional[GithubRef]:
+    """
+    the repository, ref and path a github url names, or None if it is not a repository, file or directory url
+    """
+    parsed = urllib.parse.urlparse(url)
+    parts = [urllib.parse.unquote(p) for p in parsed.path.split('/') if p]
+    host = parsed.netloc.lower()
+    if host == 'raw.githubusercontent.com':
+        if len(parts) < 4:
+            return None
+        return GithubRef(parts[0], parts[1], BLOB, parts[2], '/'.join(parts[3:]))
+    if host not in HOSTS or len(parts) < 2:
+        return None
+    owner, repo = parts[0], parts[1]
+    if repo.endswith('.git'):
+        repo = repo[:-4]
+    if len(parts) == 2:
+        return GithubRef(owner, repo, REPO)
+    if parts[2] in ('blob', 'raw') and len(parts) >= 5:
+        return GithubRef(owner, repo, BLOB, parts[3], '/'.join(parts[4:]))
+    if parts[2] == 'tree' and len(parts) >= 4:
+        return GithubRef(owner, repo, TREE, parts[3], '/'.join(parts[4:]))
+    return None
+
+
+class RateLimit:
+    """
+    the api rate limit as last reported by github
+    """
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = 0.0          # epoch seconds when the limit resets
+        self._lock = threading.Lock()
+
+    def update(self, headers):
+        remaining = headers.get('X-RateLimit-Remaining')
+        if remaining is None:
+            return
+        with self._lock:
+            self.remaining = int(remaining)
+            self.limit = int(headers.get('X-RateLimit-Limit', 0)) or self.limit
+            self.reset = float(headers.get('X-RateLimit-Reset', 0))
+        if self.remaining == 0:
+            logger.warning(f"github api rate limit used up, resets in {self.wait():.0f}s")
+
+    def exhausted(self) -> bool:
+        return self.remaining == 0 and time() < self.reset
+
+    def wait(self) -> float:
+        return max(self.reset - time(), 0.0)
+
+    def error(self) -> NetworkError:
+        return NetworkError(f"GitHub API rate limit exceeded, resets in {self.wait():.0f}s; "
+                            "set GITHUB_TOKEN for a higher limit", 429, self.wait())
+
+
+rate_limit = RateLimit()
+
 
+def _headers(api: bool) -> dict:
+    headers = {'User-Agent': 'pair_ai'}
+    if api:
+        headers['Accept'] = 'application/vnd.github+json'
+    token = os.environ.get("GITHUB_TOKEN")
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    return headers
 
+
+def _read(resp, max_bytes: int, max_chars: Optional[int] = None) -> Tuple[Optional[str], bool]:
+    """
+    read a body requested with stream=True as text, stopping after max_bytes or once max_chars are decoded.
+    returns (text, complete), with text None if the body is binary.
+    """
+    chunks = resp.iter_content(STREAM_CHUNK_SIZE)
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= SNIFF_BYTES:
+            break
+    if is_binary(head[:SNIFF_BYTES]):
+        return None, True
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    parts = []
+    size = chars = 0
+    for chunk in itertools.chain([head], chunks):
+        chunk = chunk[:max_bytes - size]
+        size += len(chunk)
+        parts.append(decoder.decode(chunk))
+        chars += len(parts[-1])
+        if size >= max_bytes or (max_chars and chars >= max_chars):
+            logger.info(f"stopped reading {resp.url} after {size} bytes")
+            return ''.join(parts), False
+    parts.append(decoder.decode(b'', final=True))
+    return ''.join(parts), True
+
+
+@retry(tries=3, deadline=30, host=lambda url, *args, **kwargs: urllib.parse.urlparse(url).netloc)
+def _get(url: str, api: bool = True, ttl: float = url_cache.DEFAULT_TTL,
+         max_bytes: int = MAX_API_BYTES, max_chars: Optional[int] = None) -> Optional[str]:
+    """
+    the body of url as text, or None if it is binary.  the response is cached and
+    revalidated with a conditional GET once it is older than ttl.
+    the body is streamed and read only as far as max_bytes and max_chars; an api response over
+    max_bytes is refused, and a file cut short is returned but not cached.
+    """
+    entry = url_cache.lookup(url)
+    if entry and entry.is_fresh(ttl):
+        count("github.cache_hits")
+        return entry.text
+    if api and rate_limit.exhausted():
+        if entry:
+            return entry.text
+        raise rate_limit.error()
+
+    headers = _headers(api)
+    if entry:
+        headers.update(entry.validators())
+    count("github.api_requests" if api else "github.raw_requests")
+    with http_pool.get(url, headers=headers, timeout=30, stream=True) as resp:
+        if api:
+            rate_limit.update(resp.headers)
+        if entry and resp.status_code == 304:
+            count("github.not_modified")
+            url_cache.refresh(entry)
+            return entry.text
+        if resp.status_code in (403, 429) and (rate_limit.exhausted() or 'Retry-After' in resp.headers):
+            if entry:
+                return entry.text
+            raise rate_limit.error() if rate_limit.exhausted() else \
+                NetworkError("GitHub API rate limit exceeded", 429, resp.headers.get('Retry-After'))
+        if resp.status_code != 200:
+            raise NetworkError(f"Unable to get {url} ({resp.status_code})", resp.status_code,
+                               resp.headers.get('Retry-After'))
+        if api:
+            check_length(resp, max_bytes)
+        text, complete = _read(resp, max_bytes, max_chars)
+    if not complete:
+        if api:
+            raise ContentTooLarge(f"GitHub API response for {url} is over {max_bytes} bytes")
+        return text
+    url_cache.store(url_cache.CacheEntry(url, text, '', '', etag=resp.headers.get('ETag'),
+                                         last_modified=resp.headers.get('Last-Modified')))
+    return text
+
+
+def _api(path: str, ttl: float = url_cache.DEFAULT_TTL):
+    return json.loads(_get(f"{API_URL}{path}", ttl=ttl))
+
+
+def raw_url(ref: GithubRef, path: str) -> str:
+    return f"{RAW_URL}/{ref.owner}/{ref.repo}/{urllib.parse.quote(ref.ref, safe='')}/{urllib.parse.quote(path)}"
+
+
+@timed("extract.markdown_to_text")
 def md_to_text(md):
     html = markdown.markdown(md)
     soup = BeautifulSoup(html, features='html.parser')
     return soup.get_text()
 
 
-def github_readme_text(github_repo_url):
-    # split a github url into the owner and repo components
-    # use the github api to try to find the readme text
-    # ['https:', '', 'github.com', 'jiggy-ai', 'hn_summary']
-    spliturl = github_repo_url.rstrip('/').split('/')
-    if len(spliturl) != 5:
+@timed("extract.github_readme_text")
+def github_readme_text(github_repo_url, ttl=url_cache.DEFAULT_TTL):
+    """
+    the README text of a repository url and the owner/repo name
+    """
+    ref = parse_github_url(github_repo_url)
+    if ref is None:
         logger.warning(github_repo_url)
         raise Exception(f"Unable to process github url {github_repo_url}")
-    owner = spliturl[3]
-    repo = spliturl[4]
-    contenturl = f'https://api.github.com/repos/{owner}/{repo}/readme'
-    resp  = requests.get(contenturl)
-    if resp.status_code != 200:
-        logger.warning(f"{github_repo_url} {resp.content}")
-        raise Exception(f"Unable to get readme for {github_repo_url}")
-    item = resp.json()
-    md = requests.get(item['download_url']).text
-    return md_to_text(md), f'{owner}/{repo}'
+    item = _api(f'/repos/{ref.owner}/{ref.repo}/readme', ttl)
+    md = base64.b64decode(item['content']).decode('utf-8', errors='replace')
+    return md_to_text(md), f'{ref.owner}/{ref.repo}'
+
+
+def _excluded(rules, path: str) -> bool:
+    parts = path.split('/')
+    return (any(is_ignored(rules, '/'.join(parts[:i]), True) for i in range(1, len(parts)))
+            or is_ignored(rules, path, False))
+
+
+def tree_files(ref: GithubRef, ttl: float = url_cache.DEFAULT_TTL) -> List[Tuple[str, int]]:
+    """
+    the (path, size) of the files under ref.path that are not excluded, from one git-trees call
+    """
+    tree = _api(f"/repos/{ref.owner}/{ref.repo}/git/trees/{urllib.parse.quote(ref.ref, safe='')}?recursive=1", ttl)
+    if tree.get('truncated'):
+        logger.warning(f"github truncated the file list of {ref.name}")
+    prefix = ref.path.strip('/') + '/' if ref.path.strip('/') else ''
+    rules = parse_ignore_patterns(configured_excludes())
+    return [(item['path'], item.get('size', 0)) for item in tree.get('tree', [])
+            if item.get('type') == 'blob' and item['path'].startswith(prefix)
+            and not _excluded(rules, item['path'])]
+
+
+def download(ref: GithubRef, paths: List[str], ttl: float = url_cache.DEFAULT_TTL) -> List[Tuple[str, Optional[str], str]]:
+    """
+    download files concurrently; returns (path, text, '') or (path, None, reason) in the order given
+    """
+    def fetch(path):
+        try:
+            text = _get(raw_url(ref, path), api=False, ttl=ttl, max_bytes=MAX_FILE_BYTES)
+        except Exception as e:
+            logger.warning(f"unable to download {path} from {ref.name}: {e}")
+            return path, None, str(e)
+        return path, text, '' if text is not None else 'binary'
+
+    if not paths:
+        return []
+    with ThreadPoolExecutor(max_workers=min(DOWNLOAD_WORKERS, len(paths))) as executor:
+        return list(executor.map(fetch, paths))
+
+
+def tree_text(ref: GithubRef, max_chars: int, ttl: float = url_cache.DEFAULT_TTL) -> str:
+    """
+    the text files under a directory, each as a file section, up to max_chars in path order
+    """
+    selected, omitted = [], []
+    remaining = max_chars
+    for path, size in tree_files(ref, ttl):
+        if size > MAX_FILE_BYTES or size > remaining or len(selected) >= MAX_FILES:
+            omitted.append(path)
+            continue
+        selected.append(path)
+        remaining -= size
+    sections = []
+    skipped = []
+    for path, text, reason in download(ref, selected, ttl):
+        if text is None:
+            skipped.append(f"{path} ({reason})")
+        else:
+            sections.append(file_section(path, text))
+    if not sections:
+        raise NetworkError(f"No text files found in {ref.name}")
+    if omitted:
+        sections.append(f"Files not included, over the size limit: {', '.join(omitted)}\n")
+    if skipped:
+        sections.append(f"Files skipped: {', '.join(skipped)}\n")
+    return '\n'.join(sections)[:max_chars]
+
 
+@timed("extract.github_text")
+def github_text(url: str, max_chars: int, ttl: float = url_cache.DEFAULT_TTL) -> Optional[Tuple[str, str]]:
+    """
+    the text and title for a github repository, file or directory url, or None for other github pages
+    """
+    ref = parse_github_url(url)
+    if ref is None:
+        return None
+    if ref.kind == REPO:
+        return github_readme_text(url, ttl)
+    if ref.kind == BLOB:
+        text = _get(raw_url(ref, ref.path), api=False, ttl=ttl, max_bytes=MAX_BYTES['text'], max_chars=max_chars)
+        if text is None:
+            raise NetworkError(f"{ref.name} is a binary file")
+        return text[:max_chars], ref.name
+    return tree_text(ref, max_chars, ttl), ref.name
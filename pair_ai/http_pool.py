@@ -0,0 +1,87 @@
+"""
+shared keep-alive http session and per-host concurrency limits
+
+a request holds one of its host's PER_HOST_LIMIT slots until its body is
+read; a streamed response holds it until it is closed.
+"""
+
+import threading
+import urllib.parse
+import weakref
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+POOL_MAXSIZE = 16         # keep-alive connections kept per host
+PER_HOST_LIMIT = 4        # concurrent requests allowed against a single host
+
+_lock = threading.Lock()
+_session = None
+_host_semaphores = {}
+
+
+def get_session() -> requests.Session:
+    """
+    return the process wide pooled requests session, creating it on first use
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_MAXSIZE, pool_maxsize=POOL_MAXSIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def _host_semaphore(host: str) -> threading.BoundedSemaphore:
+    with _lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(PER_HOST_LIMIT)
+        return _host_semaphores[host]
+
+
+@contextmanager
+def host_slot(url: str):
+    """
+    limit the number of concurrent requests against the host of url to PER_HOST_LIMIT
+    """
+    sem = _host_semaphore(urllib.parse.urlparse(url).netloc)
+    with sem:
+        yield
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """
+    requests.get via the shared session, subject to the per-host concurrency limit.
+    with stream=True the host's slot is held until the body is read and the response is
+    closed, so use the response in a with block.
+    """
+    sem = _host_semaphore(urllib.parse.urlparse(url).netloc)
+    sem.acquire()
+    try:
+        resp = get_session().get(url, **kwargs)
+    except BaseException:
+        sem.release()
+        raise
+    if not kwargs.get('stream'):
+        sem.release()       # the body has been read
+        return resp
+
+    released = threading.Lock()
+
+    def release():
+        if released.acquire(blocking=False):
+            sem.release()
+    close = resp.close
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            release()
+    resp.close = close_and_release
+    weakref.finalize(resp, release)     # a response dropped without being closed
+    return resp
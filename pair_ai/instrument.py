@@ -0,0 +1,202 @@
+"""
+lightweight timers and counters for the stages of a turn
+
+  with timer("extract.readability"): ...      or      @timed("extract.url_to_text")
+  count("chat.response_tokens", n)
+
+stats are kept per process and shown by the /profile command, together
+with the structured output, retry and prompt prefix counters.  setting PAIR_METRICS_JSONL
+to a file appends an event line for every timing and count as it happens.
+export() writes a snapshot as jsonl or, for a .prom or .txt file, in the
+OpenMetrics text format; PAIR_METRICS_FILE exports one at exit.
+"""
+
+import atexit
+import json
+import os
+import re
+import sys
+import threading
+from contextlib import ContextDecorator
+from time import perf_counter, time
+
+MAX_SAMPLES = 1000      # recent timings kept per stage for percentiles
+EVENTS_PATH = os.environ.get("PAIR_METRICS_JSONL")
+EXPORT_PATH = os.environ.get("PAIR_METRICS_FILE")
+
+_lock = threading.Lock()
+_timings = {}           # name -> Timing
+_counters = {}          # name -> number
+
+
+class Timing:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.samples) == MAX_SAMPLES:
+            self.samples.pop(0)
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> float:
+        samples = sorted(self.samples)
+        return samples[min(int(p * len(samples)), len(samples) - 1)] if samples else 0.0
+
+
+def _event(record: dict):
+    if not EVENTS_PATH:
+        return
+    try:
+        with open(EVENTS_PATH, 'a') as f:
+            f.write(json.dumps({'ts': time(), 'pid': os.getpid(), **record}) + '\n')
+    except OSError:
+        pass
+
+
+def record(name: str, seconds: float):
+    with _lock:
+        _timings.setdefault(name, Timing()).add(seconds)
+    _event({'timer': name, 'seconds': seconds})
+
+
+def count(name: str, n: float = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+    _event({'counter': name, 'value': n})
+
+
+class timer(ContextDecorator):
+    """
+    time a block or, as a decorator, every call of a function under name
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._local = threading.local()
+
+    def __enter__(self):
+        starts = getattr(self._local, 'starts', None)
+        if starts is None:
+            starts = self._local.starts = []
+        starts.append(perf_counter())
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, perf_counter() - self._local.starts.pop())
+        return False
+
+
+timed = timer
+
+
+# modules keeping their own counters, with the functions that snapshot and reset them
+COUNTER_MODULES = (('structured', 'metrics'), ('retry', 'counters'), ('prompt_cache', 'counters'))
+
+
+def _loaded_modules():
+    for module, getter in COUNTER_MODULES:
+        m = sys.modules.get(f"{__package__}.{module}")
+        if m is not None:
+            yield module, m, getter
+
+
+def reset():
+    """
+    clear the timings and counters, including those of the modules in COUNTER_MODULES
+    """
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+    for _, m, _ in _loaded_modules():
+        m.reset()
+
+
+def _module_counters() -> dict:
+    """
+    the counters kept by the structured output, retry and prompt cache modules, if they are in use
+    """
+    counters = {}
+    for module, m, getter in _loaded_modules():
+        counters.update({f"{module}.{k}": v for k, v in getattr(m, getter)().items()})
+    return counters
+
+
+def snapshot() -> dict:
+    with _lock:
+        timers = {name: {'count': t.count, 'total': t.total, 'mean': t.total / t.count,
+                         'p50': t.percentile(0.5), 'p95': t.percentile(0.95), 'max': t.max}
+                  for name, t in _timings.items()}
+        counters = dict(_counters)
+    return {'timers': timers, 'counters': {**counters, **_module_counters()}}
+
+
+def report() -> str:
+    """
+    a table of the stage timings and counters for this session
+    """
+    snap = snapshot()
+    lines = [f"{'stage':28}{'count':>7}{'total s':>10}{'mean ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+    for name, t in sorted(snap['timers'].items()):
+        lines.append(f"{name:28}{t['count']:7d}{t['total']:10.2f}{t['mean']*1000:10.1f}"
+                     f"{t['p95']*1000:10.1f}{t['max']*1000:10.1f}")
+    if len(lines) == 1:
+        lines.append("no timings recorded yet")
+    if snap['counters']:
+        lines.append("")
+        lines.extend(f"{name:28}{value:>10g}" for name, value in sorted(snap['counters'].items()))
+    return "\n".join(lines)
+
+
+def _metric_name(name: str) -> str:
+    return "pair_" + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def openmetrics() -> str:
+    """
+    the current stats in the OpenMetrics text format
+    """
+    snap = snapshot()
+    out = []
+    for name, t in sorted(snap['timers'].items()):
+        metric = _metric_name(name) + "_seconds"
+        out.append(f"# TYPE {metric} summary")
+        out.append(f'{metric}{{quantile="0.5"}} {t["p50"]}')
+        out.append(f'{metric}{{quantile="0.95"}} {t["p95"]}')
+        out.append(f"{metric}_sum {t['total']}")
+        out.append(f"{metric}_count {t['count']}")
+    for name, value in sorted(snap['counters'].items()):
+        metric = _metric_name(name)
+        out.append(f"# TYPE {metric} counter")
+        out.append(f"{metric}_total {value}")
+    out.append("# EOF")
+    return "\n".join(out) + "\n"
+
+
+def export(path: str):
+    """
+    write the current stats to path, in OpenMetrics format for .prom and .txt files and jsonl otherwise
+    """
+    if path.endswith(('.prom', '.txt')):
+        with open(path, 'w') as f:
+            f.write(openmetrics())
+        return
+    with open(path, 'a') as f:
+        f.write(json.dumps({'ts': time(), 'pid': os.getpid(), **snapshot()}) + '\n')
+
+
+def _export_at_exit():
+    try:
+        export(EXPORT_PATH)
+    except OSError as e:
+        print(f"unable to export metrics to {EXPORT_PATH}: {e}", file=sys.stderr)
+
+
+if EXPORT_PATH:
+    atexit.register(_export_at_exit)
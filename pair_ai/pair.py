@@ -1,21 +1,19 @@
-import openai
+import asyncio
 import os
-import sys
-from chatstack import ChatContext, UserMessage
+import threading
 from prompt_toolkit import PromptSession
 from prompt_toolkit.completion import Completer, Completion, PathCompleter, NestedCompleter, WordCompleter
 from prompt_toolkit.key_binding import KeyBindings
 from prompt_toolkit.keys import Keys
 from prompt_toolkit.formatted_text import FormattedText
 from prompt_toolkit import print_formatted_text
-import re
-import subprocess
+from prompt_toolkit.patch_stdout import patch_stdout
 import argparse
-from .context_loader import load_files_and_urls
-from .extract import url_to_text
-
-openai.api_key = os.getenv("OPENAI_API_KEY")
+from .diff_apply import PatchError
+from .response_parser import DIFF_LANGUAGES, DiffValidator, ResponseParser, render
 
+# the model backend, chatstack and the url/pdf extraction stack are slow to import, so they are
+# imported in repl() or when first needed rather than at module load
 
 
 BASE_PROMPT = "You are a programming assistant. "
@@ -26,83 +24,408 @@ BASE_PROMPT += "then ask for the definition of the code and it will be provided.
 
 
 PAIR_MODEL = os.environ.get("PAIR_MODEL", "gpt-4")
-print("PAIR_MODEL =", PAIR_MODEL)
-
-chat_ctx = ChatContext(min_response_tokens=800,  # leave room for at least this much
-                       max_response_tokens=None, # don't limit the model's responses
-                       chat_context_messages=20,
-                       model=PAIR_MODEL,
-                       temperature=0.1,
-                       base_system_msg_text=BASE_PROMPT)
-    
+
+
 def print_help():
     print("Available commands:")
-    print("/file <path> - Load a file into the context")
+    print("/file <path, glob or directory> [...] [--max-tokens N] - Load files into the context")
+    print("      quote paths with spaces when loading several; large loads are confirmed first")
     print("/cd <path> - Change the current working directory")
     print("/url <url> - Load the content of a URL into the context")
+    print("/cancel - Cancel the response being streamed (or press Ctrl-C)")
+    print("/undo - Restore the files changed by the last accepted diff")
+    print("/reload - Reload all loaded files that have changed")
+    print("/context [question] - Show which messages would be packed into the model context")
+    print("/pin <path or url> - Always include a loaded file or URL in the context")
+    print("/unpin <path or url> - Stop pinning a loaded file or URL")
+    print("/save [name] - Save the loaded files, URLs and conversation (default name: last)")
+    print("/load [name] - Restore a saved session, re-reading only files that have changed")
+    print("/profile [reset | export <file>] - Show where time and tokens went this session")
     print("/status - Show the status of the OPENAI_API_KEY and the model being used")
     print("/help - Display this help message")
-    
 
-parser = argparse.ArgumentParser(description="Load files and URLs into the context")
-parser.add_argument("items", nargs="*", help="List of files and URLs to load into the context")
-args = parser.parse_args()
-load_files_and_urls(chat_ctx, args.items)
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load files and URLs into the context")
+    parser.add_argument("items", nargs="*", help="Files, globs, directories and URLs to load into the context")
+    parser.add_argument("--max-tokens", type=int, default=None,
+                        help="Token cap for the files loaded from each glob or directory")
+    parser.add_argument("--context-tokens", type=int, default=os.environ.get("PAIR_CONTEXT_TOKENS"),
+                        help="Maximum number of input tokens to send to the model (default: the model context less the response reserve)")
+    parser.add_argument("--resume", nargs="?", const="last", metavar="NAME",
+                        help="Restore a saved session, by default the one saved when pair last exited")
+    return parser.parse_args(argv)
 
-def repl():
-    path_completer = PathCompleter(only_directories=False, expanduser=True)
-    custom_completer = NestedCompleter.from_nested_dict({
-        '/file': path_completer,
-        '/cd': path_completer,
-        '/url': WordCompleter(['http://', 'https://']),
-    })
 
-    # Create custom key bindings
-    bindings = KeyBindings()
+def create_chat_context(args):
+    from .context_packer import PackedChatContext
+    return PackedChatContext(min_response_tokens=800,  # leave room for at least this much
+                             max_response_tokens=None, # don't limit the model's responses
+                             token_budget=args.context_tokens,
+                             model=PAIR_MODEL,
+                             temperature=0.1,
+                             base_system_msg_text=BASE_PROMPT)
 
-    @bindings.add(Keys.Tab)
-    def _(event):
-        b = event.app.current_buffer
-        if b.complete_state:
-            b.complete_next()
-        else:
-            b.start_completion(select_first=True)
 
+PROMPT = "Enter your code, questions, or /file <path>,  or /help to see all commands:  \n"
+ACCEPT_DIFF_PROMPT = "Do you accept the diff? (yes/no): "
 
-    @bindings.add(Keys.Right)
-    def _(event):
-        event.app.current_buffer.complete_next()
 
-    session = PromptSession(completer=custom_completer, key_bindings=bindings)
-    print_formatted_text(FormattedText([("fg:violet", "Pair AI Programming REPL  ")]))
-    while True:
-        # Read user input with custom autocompletion
-        user_input = session.prompt("Enter your code, questions, or /file <path>,  or /help to see all commands:  \n")
+def confirm(prompt):
+    return input(prompt).strip().lower() == 'yes'
 
-        if user_input.strip() == '':
-            continue
 
-        # Check for the special /file command
-        if user_input.startswith('/file'):
-            file_path = user_input[6:].strip()
+def apply_patch(patch):
+    """
+    write the files changed by a PatchSet; returns True on success
+    """
+    try:
+        patch.apply()
+        print(f"Diff applied successfully to {', '.join(c.path for c in patch.changes)}.")
+        return True
+    except Exception as e:
+        print(f"Error applying diff: {e}")
+        return False
+
+
+def run_daemon(fn, name):
+    """
+    run fn in a daemon thread and return a future for its result.  unlike asyncio.to_thread,
+    the caller can stop waiting for a call that stalls, and it does not hold up exit.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(result, error):
+        if not future.done():
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def target():
+        try:
+            result, error = fn(), None
+        except Exception as e:
+            result, error = None, e
+        try:
+            loop.call_soon_threadsafe(resolve, result, error)
+        except RuntimeError:
+            pass    # the event loop has closed
+    threading.Thread(target=target, name=name, daemon=True).start()
+    return future
+
+
+class Repl:
+    """
+    asyncio REPL: the prompt stays usable while a response streams and while
+    files and urls load in the background
+    """
+
+    def __init__(self, session, chat_ctx, file_registry):
+        self.session = session
+        self.chat_ctx = chat_ctx
+        self.file_registry = file_registry
+        self.generation = None          # task streaming the current response
+        self.cancel_event = None        # set to stop the current response
+        self.cancelled = None           # asyncio.Event set with cancel_event, to stop waiting on a stalled response
+        self.pending_patch = None       # PatchSet awaiting the user's accept/reject answer
+        self.pending_files = []         # (spec, file_set, dropped, documents) awaiting confirmation, in turn
+        self.last_patch = None          # the last PatchSet applied, for /undo
+        self.background = set()         # running file and url loads
+
+    def prompt_message(self):
+        if self.pending_patch:
+            return ACCEPT_DIFF_PROMPT
+        if self.pending_files:
+            from .workspace import confirm_prompt
+            return confirm_prompt(*self.pending_files[0][1:3])
+        return PROMPT
+
+    def generating(self):
+        return self.generation is not None and not self.generation.done()
+
+    def stop_generation(self):
+        self.cancel_event.set()
+        self.cancelled.set()
+
+    def cancel(self):
+        if self.generating():
+            self.stop_generation()
+            print_formatted_text(FormattedText([("fg:red", "\nCancelling response...")]))
+        else:
+            print("No response in progress")
+
+    def run_in_background(self, description, fn, on_done, on_error):
+        """
+        run fn in a worker thread, then on_done(result) or on_error(exception) on the event loop
+        """
+        async def run():
             try:
-                with open(file_path, 'r') as file:
-                    user_code =  file.read()
-                    user_input = f'{file_path}:\n{user_code}\n'
-                    msg = UserMessage(text=user_input)
-                    chat_ctx.add_message(msg)
-                    print(f"Loaded {file_path} into context ({msg.tokens} tokens)")
-                    continue
-            except FileNotFoundError:
+                result = await asyncio.to_thread(fn)
+            except Exception as e:
+                on_error(e)
+                return
+            on_done(result)
+        task = asyncio.create_task(run(), name=description)
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
+        print(f"Loading {description} in the background")
+
+    def load_file(self, file_path):
+        def read():
+            snap = self.file_registry.read(file_path)
+            return snap, self.file_registry.index(snap)
+
+        def on_done(result):
+            snap, chunks = result
+            status, msg = self.file_registry.add(snap, chunks)
+            print(self.file_registry.describe(file_path, status, msg))
+
+        def on_error(e):
+            if isinstance(e, FileNotFoundError):
                 print(f"File not found: {file_path}")
-                continue
-            except IsADirectoryError:
+            elif isinstance(e, IsADirectoryError):
                 print(f"Path is a directory, not a file: {file_path}")
-                continue
-            except Exception as e:
+            else:
                 print(f"Unexpected error: {e}")
-                continue
+
+        self.run_in_background(file_path, read, on_done, on_error)
+
+    def load_file_set(self, spec, max_tokens):
+        from . import workspace
+
+        def read():
+            return workspace.prepare(self.chat_ctx, self.file_registry, spec, max_tokens)
+
+        def on_done(result):
+            file_set, dropped, documents = result
+            print(workspace.describe_file_set(file_set))
+            if workspace.needs_confirmation(file_set, dropped):
+                # the next input answers whether to add the files
+                self.pending_files.append((spec, file_set, dropped, documents))
+                if self.session.app.is_running:
+                    self.session.app.invalidate()
+                return
+            self.add_file_set(spec, file_set, dropped, documents)
+
+        def on_error(e):
+            print(f"Unexpected error loading {spec}: {e}")
+
+        self.run_in_background(spec, read, on_done, on_error)
+
+    def add_file_set(self, spec, file_set, dropped, documents):
+        from . import workspace
+        results = self.file_registry.add_bundle(spec, file_set.files, documents)
+        for line in workspace.describe_added(self.file_registry, spec, results, dropped):
+            print(line)
+
+    def load_files(self, args):
+        """
+        /file arguments: paths, globs and directories, optionally with --max-tokens N for each glob or directory
+        """
+        from .workspace import default_max_tokens, is_multi, split_file_args
+        specs, max_tokens = split_file_args(args)
+        if max_tokens is None:
+            max_tokens = default_max_tokens(self.chat_ctx)
+        elif not max_tokens.isdigit():
+            print("--max-tokens needs a number of tokens")
+            return
+        max_tokens = int(max_tokens)
+        if not specs:
+            print("Usage: /file <path, glob or directory> [...] [--max-tokens N]")
+        for spec in specs:
+            if is_multi(spec):
+                self.load_file_set(spec, max_tokens)
+            else:
+                self.load_file(spec)
+
+    def save(self, name):
+        from .session import save_session
+        try:
+            path = save_session(name, self.chat_ctx, self.file_registry)
+            print(f"Saved session to {path}")
+        except OSError as e:
+            print(f"Unable to save session: {e}")
+
+    def restore(self, name):
+        from .session import load_session
+        try:
+            restored = load_session(name, self.chat_ctx, self.file_registry)
+        except FileNotFoundError:
+            print(f"No saved session named {name}")
+            return
+        except Exception as e:
+            print(f"Unable to load session {name}: {e}")
+            return
+        print(f"Restored {restored.messages} messages, {restored.files} files and "
+              f"{restored.documents} indexed documents from {restored.path}")
+        if restored.cwd:
+            print(f"Changed directory to the session's: {restored.cwd}")
+        for path, status, msg in restored.changed:
+            if status is None:
+                print(f"Error reloading {path}: {msg}")
+            else:
+                print(self.file_registry.describe(path, status, msg))
+        for name in restored.missing:
+            print(f"Not restored, load it again if needed: {name}")
+
+    def load_url(self, url):
+        def fetch():
+            from .extract import url_to_text
+            from .file_registry import file_message
+            content, title, language = url_to_text(url)
+            chunks = self.chat_ctx.add_document(url, content)
+            return content, None if chunks is not None else file_message(url, content), chunks
+
+        def on_done(result):
+            from .context_packer import URL
+            from .context_loader import describe_document
+            content, msg, chunks = result
+            if msg is None:
+                print(describe_document(url, chunks))
+                return
+            self.chat_ctx.add_message(msg, kind=URL, name=url)
+            print(content)
+            print(f"Loaded {url} into context ({msg.tokens} tokens)")
+
+        self.run_in_background(url, fetch, on_done, lambda e: print(f"Error fetching URL: {e}"))
+
+    async def stream_response(self, user_input):
+        validator = DiffValidator()
+        try:
+            await self._stream_response(user_input, validator)
+        finally:
+            validator.close()
+
+    async def _stream_response(self, user_input, validator):
+        from chatstack import UserMessage
+        cancel_event = self.cancel_event
+        parser = ResponseParser()
+        question = UserMessage(text=user_input)
+
+        def drop_question():
+            # drop the unanswered question, and the response if it finished as it was cancelled,
+            # so the context stays consistent
+            messages = self.chat_ctx.messages
+            i = next((i for i, m in enumerate(messages) if m is question), None)
+            if i is not None:
+                self.chat_ctx.messages = [m for j, m in enumerate(messages)
+                                          if j != i and not (j < i and m.role == 'assistant')]
+
+        def show(lines):
+            for line in lines:
+                print_formatted_text(render(line), end='\n' if line.end else '', flush=True)
+                if line.closed is not None and line.closed.lang in DIFF_LANGUAGES:
+                    validator.submit(parser.diff_blocks())     # dry run the diff while the rest streams
+
+        def run():
+            # prose is printed as it streams above the prompt, code blocks a line at a time, highlighted
+            cr = None
+            stream = self.chat_ctx.message_stream(question)
+            try:
+                for cr in stream:
+                    if cancel_event.is_set():
+                        return None
+                    if cr.response_tokens:   # the final response repeats the last delta
+                        continue
+                    show(parser.feed(cr.delta))
+            finally:
+                stream.close()
+                if cancel_event.is_set():
+                    drop_question()     # the event loop may have stopped waiting already
+                else:
+                    show(parser.close())
+            return cr
+
+        print_formatted_text("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~  ")
+        # a request that stalls, before its first token or mid-stream, is abandoned when cancelled;
+        # its thread ends when the request does, without showing anything more
+        response = run_daemon(run, "response")
+        cancelled = asyncio.ensure_future(self.cancelled.wait())
+        await asyncio.wait({response, cancelled}, return_when=asyncio.FIRST_COMPLETED)
+        cancelled.cancel()
+        response.cancel()       # stop waiting if it has not finished
+        try:
+            cr = None if response.cancelled() else response.result()
+        except Exception as e:
+            print_formatted_text(FormattedText([("fg:red", f"\nError from model: {e}")]))
+            cr = None
+        if cr is None or not cr.response_tokens:
+            drop_question()
+            if cancel_event.is_set():
+                print_formatted_text(FormattedText([("fg:red", "\nResponse cancelled.")]))
+            return
+
+        print_formatted_text(FormattedText([("fg:olive", f"({cr.input_tokens} + {cr.response_tokens} tokens = ${cr.price:.4f})  ")]))
+        print_formatted_text("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~  ")
+        # the diffs in the response, dry run against the files on disk as their blocks closed
+        blocks = parser.diff_blocks()
+        if blocks:
+            try:
+                patch = await asyncio.to_thread(validator.result, blocks)
+            except PatchError as e:
+                print_formatted_text(FormattedText([("fg:red", f"Found diff in model output that does not apply: {e}")]))
+                return
+            print_formatted_text(FormattedText([("fg:violet", "Found diff in model output:\n")]))
+            print_formatted_text(FormattedText([("fg:darkred", patch.preview())]))
+            # the next input answers whether to accept the diff
+            self.pending_patch = patch
+            if self.session.app.is_running:
+                self.session.app.invalidate()
+        else:
+            print_formatted_text(FormattedText([("fg:red", "No diff found in the response.")]))
+
+    async def handle(self, user_input):
+        """
+        handle one line of input
+        """
+        if self.pending_patch is not None:
+            patch, self.pending_patch = self.pending_patch, None
+            if user_input.strip().lower() == 'yes':
+                if apply_patch(patch):
+                    self.last_patch = patch
+            else:
+                print_formatted_text(FormattedText([("fg:red", "Diff not applied.")]))
+            return
+        if self.pending_files:
+            spec, file_set, dropped, documents = self.pending_files.pop(0)
+            if user_input.strip().lower() == 'yes':
+                self.add_file_set(spec, file_set, dropped, documents)
+            else:
+                from .workspace import discard
+                discard(self.chat_ctx, documents)
+                print(f"Not loaded: {spec}")
+            return
+
+        if user_input.strip() == '':
+            return True
+
+        # Check for the special /file command
+        if user_input.startswith('/file'):
+            self.load_files(user_input[6:].strip())
+        # Check for the special /reload command
+        elif user_input.startswith('/reload'):
+            if not self.file_registry.files:
+                print("No files loaded")
+            for path, status, msg in self.file_registry.reload():
+                if status is None:
+                    print(f"Error reloading {path}: {msg}")
+                else:
+                    print(self.file_registry.describe(path, status, msg))
+        # Check for the special /context command
+        elif user_input.startswith('/context'):
+            question = user_input[9:].strip()
+            print(self.chat_ctx.describe_pack(question=question))
+        # Check for the special /pin and /unpin commands
+        elif user_input.startswith('/pin') or user_input.startswith('/unpin'):
+            command, _, name = user_input.partition(' ')
+            pinned = command == '/pin'
+            count = self.chat_ctx.set_pinned(name.strip(), pinned)
+            if count:
+                print(f"{'Pinned' if pinned else 'Unpinned'} {name.strip()}")
+            else:
+                print(f"Not loaded: {name.strip()}")
         # Check for the special /cd command
         elif user_input.startswith('/cd'):
             dir_path = user_input[4:].strip()
@@ -111,79 +434,145 @@ def repl():
                 print(f"Changed directory to: {os.getcwd()}")
             except FileNotFoundError:
                 print(f"Directory not found: {dir_path}")
-                continue
             except NotADirectoryError:
                 print(f"Not a directory: {dir_path}")
-                continue
-            continue  # Add this line to skip processing the /cd command as a user input for assistance         
         # Check for the special /url command
         elif user_input.startswith('/url'):
-             url = user_input[5:].strip()
-             try:
-                 content, title, language = url_to_text(url)
-                 user_input = f'{url}:\n{content}\n'
-                 msg = UserMessage(text=user_input)
-                 chat_ctx.add_message(msg)
-                 print(content)
-                 print(f"Loaded {url} into context ({msg.tokens} tokens)")
-                 continue
-             except Exception as e:
-                 print(f"Error fetching URL: {e}")
-                 continue
+            self.load_url(user_input[5:].strip())
+        # Check for the special /undo command
+        elif user_input.startswith('/undo'):
+            if self.last_patch is None:
+                print("No applied diff to undo")
+            else:
+                try:
+                    self.last_patch.rollback()
+                    print(f"Restored {', '.join(c.path for c in self.last_patch.changes)}")
+                    self.last_patch = None
+                except Exception as e:
+                    print(f"Error undoing diff: {e}")
+        # Check for the special /cancel command
+        elif user_input.startswith('/cancel'):
+            self.cancel()
         # Check for the special /status command
         elif user_input.startswith('/status'):
-            api_key_status = "set" if openai.api_key else "not set"
-            model_name = chat_ctx.model
-            try:
-                openai.Model.retrieve(model_name)
-                model_status = "available"
-            except Exception as e:
-                model_status = f"unavailable ({e})"
+            from .backend import get_backend
+            api_key_status = "set" if os.getenv("OPENAI_API_KEY") else "not set"
+            model_name = self.chat_ctx.model
+            model_status = await asyncio.to_thread(get_backend().model_status, model_name)
 
             print(f"OPENAI_API_KEY: {api_key_status}")
+            if os.getenv("PAIR_API_BASE"):
+                print(f"API base: {os.getenv('PAIR_API_BASE')}")
             print(f"Model: {model_name} ({model_status})")
-            continue  # Add this line to skip processing the /status command as a user input for assistance
+        # Check for the special /save and /load commands
+        elif user_input.startswith('/save'):
+            self.save(user_input[6:].strip() or "last")
+        elif user_input.startswith('/load'):
+            if self.generating() or self.background:
+                print("Wait for the response and background loads to finish before loading a session")
+            else:
+                self.restore(user_input[6:].strip() or "last")
+        # Check for the special /profile command
+        elif user_input.startswith('/profile'):
+            from . import instrument
+            args = user_input.split()[1:]
+            if args[:1] == ['reset']:
+                instrument.reset()
+                print("Profile reset")
+            elif args[:1] == ['export'] and len(args) == 2:
+                try:
+                    instrument.export(args[1])
+                    print(f"Exported profile to {args[1]}")
+                except OSError as e:
+                    print(f"Unable to export profile: {e}")
+            elif args:
+                print("Usage: /profile [reset | export <file>]")
+            else:
+                from .prompt_cache import tracker
+                print(instrument.report())
+                print(tracker.describe())
         # Check for the special /help command
         elif user_input.startswith('/help'):
             print_help()
-            continue  # Add this line to skip processing the /help command as a user input for assistance            
-        
-        print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~  ")
-        for cr in chat_ctx.user_message_stream(user_input):
-            sys.stdout.write(cr.delta)
-            sys.stdout.flush()
-        
-        print_formatted_text(FormattedText([("fg:olive", f"\n({cr.input_tokens} + {cr.response_tokens} tokens = ${cr.price:.4f})  ")]))
-        print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~  ")
-        # check response text for a diff 
-        diff_match = re.search(r'```diff(.*?)```', cr.text, re.DOTALL)
-        if diff_match:
-            diff = diff_match.group(1).strip()
-            print_formatted_text(FormattedText([("fg:violet", "Found diff in model output:\n")]))
-            print_formatted_text(FormattedText([("fg:darkred", diff)]))
+        elif self.generating():
+            print("A response is still streaming, wait for it or /cancel it first")
+        else:
+            self.cancel_event = threading.Event()
+            self.cancelled = asyncio.Event()
+            self.generation = asyncio.create_task(self.stream_response(user_input))
 
-            # Ask the user if they accept the diff
-            accept_diff = input("Do you accept the diff? (yes/no): ").lower()
-            if accept_diff == 'yes':
+    async def run(self):
+        print_formatted_text(FormattedText([("fg:violet", "Pair AI Programming REPL  ")]))
+        with patch_stdout():
+            while True:
                 try:
-                    with open("temp_diff.patch", "w") as temp_diff_file:
-                        temp_diff_file.write(diff)
+                    # Read user input with custom autocompletion
+                    user_input = await self.session.prompt_async(self.prompt_message)
+                except KeyboardInterrupt:
+                    # Ctrl-C cancels a streaming response rather than exiting
+                    if self.generating():
+                        self.cancel()
+                    continue
+                except EOFError:
+                    break
+                await self.handle(user_input)
+            if self.generating():
+                self.stop_generation()
+                await self.generation
+        if self.chat_ctx.messages:
+            self.save("last")
 
-                    subprocess.run(["patch", "-p1", "-i", "temp_diff.patch"], check=True)
-                    os.remove("temp_diff.patch")
 
-                    print("Diff applied successfully.")
-                except Exception as e:
-                    print(f"Error applying diff: {e}")
-            else:
-                print_formatted_text(FormattedText([("fg:red", "Diff not applied.")]))
+def repl():
+    path_completer = PathCompleter(only_directories=False, expanduser=True)
+    custom_completer = NestedCompleter.from_nested_dict({
+        '/file': path_completer,
+        '/cd': path_completer,
+        '/url': WordCompleter(['http://', 'https://']),
+        '/reload': None,
+        '/context': None,
+        '/pin': path_completer,
+        '/unpin': path_completer,
+        '/cancel': None,
+        '/undo': None,
+        '/profile': WordCompleter(['reset', 'export']),
+        '/save': None,
+        '/load': None,
+    })
+
+    # Create custom key bindings
+    bindings = KeyBindings()
+
+    @bindings.add(Keys.Tab)
+    def _(event):
+        b = event.app.current_buffer
+        if b.complete_state:
+            b.complete_next()
         else:
-            print_formatted_text(FormattedText([("fg:red", "No diff found in the response.")]))
+            b.start_completion(select_first=True)
 
-                
 
+    @bindings.add(Keys.Right)
+    def _(event):
+        event.app.current_buffer.complete_next()
+
+    args = parse_args()
+    print("PAIR_MODEL =", PAIR_MODEL)
+    from .file_registry import FileRegistry
+    chat_ctx = create_chat_context(args)
+    file_registry = FileRegistry(chat_ctx)
+    pair_repl = Repl(PromptSession(completer=custom_completer, key_bindings=bindings), chat_ctx, file_registry)
+    if args.resume:
+        # the items were typed relative to this directory, not the session's
+        from .context_loader import is_url
+        args.items = [item if is_url(item) else os.path.abspath(os.path.expanduser(item)) for item in args.items]
+        pair_repl.restore(args.resume)
+    if args.items:
+        from .context_loader import load_files_and_urls
+        load_files_and_urls(chat_ctx, args.items, registry=file_registry, max_tokens=args.max_tokens, confirm=confirm)
+
+    asyncio.run(pair_repl.run())
 
 
 if __name__ == "__main__":
     repl()
-
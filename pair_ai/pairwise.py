@@ -1,22 +1,32 @@
 #!/usr/bin/env python3
 
 from loguru import logger
-from pydantic import BaseModel, Field, ValidationError
+from pydantic import BaseModel, Field
 from typing import Any, Optional, List
 import os
-import openai
-import json 
+import hashlib
+from time import perf_counter
 from prompt_toolkit.formatted_text import FormattedText
 from prompt_toolkit import print_formatted_text
 
+from .repo_index import RepoIndex
+from .file_finder import find_files
+from .structured import MODEL_DEADLINE, MODEL_TRIES, create, schema_json
+from .backend import api_host, get_backend
+from .prefetch import Prefetcher, files_mentioned
+from . import instrument
+from .retry import call_with_retry
+from .url_cache import CACHE_DIR
+
 
 class Task(BaseModel):
     description      : str                       = Field(description="The detailed description of the task we are performing.")
-    filenames        : list[str]                 = Field(description="The full list of existing file names with relevant content that are available to read to help accomplish the task.")
-    work_summary     : str                       = Field(description="A summary of the work we have done so far to try to accomplish the task.")
+    repo_outline     : str                       = Field(description="A compact outline of the existing files that are available to read, with the classes, functions and sections they contain and their line ranges.")
+    work_summary     : str                       = Field(description="A summary of the earlier work we have done to try to accomplish the task, rolled up from older work log entries.")
+    work_log         : list[str]                 = Field(default_factory=list, description="What was done in each recent step, oldest first.")
     notes            : Optional[str]             = Field(None, description="Any notes about the task that might be helpful to remember.")
     next_step_hint   : Optional[str]             = Field(None, description="A description of a possible next step to take to accomplish the task.")
-    read_files       : Optional[dict[str, str]]  = Field(None, description="A dictionary of filenames and their content that were just read to help accomplish the next step.")
+    read_files       : Optional[dict[str, str]]  = Field(None, description="A dictionary of filenames, symbols or line ranges and their content that were just read to help accomplish the next step. Content identical to another entry of the same step is given only once.")
     coworker_message : Optional[str]             = Field(None, description="A message from a coworker to help accomplish the task.")
     step             : int                       = Field(description="The number of steps we have taken so far to try to accomplish the task.")
 
@@ -24,6 +34,8 @@ class Task(BaseModel):
         outstr = "\nPairWise Task State:\n\n"
         outstr += f"Description:  {self.description}\n"
         outstr += f"Work Summary: {self.work_summary}\n"
+        for entry in self.work_log:
+            outstr += f"Work Log:     {entry}\n"
         if self.notes:
             outstr += f"Notes:        {self.notes}\n"
         if self.next_step_hint:
@@ -32,7 +44,7 @@ class Task(BaseModel):
             outstr += f"Read Files:   {self.read_files.keys()}\n"
         if self.coworker_message:
             outstr += f"Coworker Msg: {self.coworker_message}\n"
-        outstr += f"Filenames:    {len(self.filenames)} files\n"
+        outstr += f"Outline:      {len(self.repo_outline.splitlines())} lines\n"
         outstr += f"Step:         {self.step}\n"
         return outstr
     
@@ -40,12 +52,25 @@ class CreateFile(BaseModel):
     filename  : str  = Field(..., description="The name of a file to create to help accomplish the task. Must not be an existing filename.")
     content   : str  = Field(..., description="The content to write to the filename to help accomplish the task.")        
 
+
+class ReadPart(BaseModel):
+    filename   : str            = Field(..., description="The name of the file to read from.")
+    symbol     : Optional[str]  = Field(None, description="The qualified name of a class, function or section from the outline to read, e.g. Task.__str__.")
+    start_line : Optional[int]  = Field(None, description="The first line to read if not reading a symbol.")
+    end_line   : Optional[int]  = Field(None, description="The last line to read if not reading a symbol.")
+
+    def key(self) -> str:
+        if self.symbol:
+            return f"{self.filename}::{self.symbol}"
+        return f"{self.filename}:{self.start_line or 1}-{self.end_line or 'end'}"
+
     
 class NextStep(BaseModel):
     create_file      : Optional[CreateFile] = Field(None, description="An optional file to create to help accomplish the task.")    
-    work_summary     : str                  = Field(description="The updated summary of the work we have done so far to accomplish the task, not including files we have read.")    
+    work_done        : str                  = Field(description="A short description of only the work done in this step, not including files we have read. It is appended to the work log, so do not repeat earlier work.")
     notes            : Optional[str]        = Field(None, description="Any notes about the task that might be helpful to remember.")    
-    read_filenames   : Optional[list[str]]  = Field(None, description="A list of filenames to read to help perform the next step.")    
+    read_filenames   : Optional[list[str]]  = Field(None, description="A list of whole files to read to help perform the next step.")    
+    read_parts       : Optional[list[ReadPart]] = Field(None, description="Specific symbols or line ranges from the outline to read to help perform the next step. Prefer this to reading whole files.")
     ask_question     : Optional[str]        = Field(None, description="An optional question to ask a coworker to help accomplish the task. Use this option if you are not sure what the next step is.")
     next_step_hint   : Optional[str]        = Field(None, description="A description of the anticipated next step to take to accomplish the task.")
     task_done        : Optional[bool]       = Field(None, description="true if the task is complete")
@@ -57,7 +82,7 @@ class NextStep(BaseModel):
             outstr += f"===============  File Content ===============\n"
             outstr += self.create_file.content
             outstr += f"\n===============  End  Content ===============\n"
-        outstr += f"Work Summary: {self.work_summary}\n"
+        outstr += f"Work Done: {self.work_done}\n"
         if self.notes:
             outstr += f"Notes: {self.notes}\n"
         if self.next_step_hint:
@@ -66,6 +91,8 @@ class NextStep(BaseModel):
             outstr += f"Ask Question:   {self.ask_question}\n"
         if self.read_filenames:
             outstr += f"Read Filenames: {self.read_filenames}\n"
+        if self.read_parts:
+            outstr += f"Read Parts:     {[part.key() for part in self.read_parts]}\n"
         if  self.task_done:
             outstr += f"Task Done:      {self.task_done}\n"
         return outstr
@@ -74,125 +101,326 @@ class NextStep(BaseModel):
 
 SYSTEM_PROMPT = f"""
 You are a capable assistant that is working to accomplish a complex multi-step task.
-The full task is provided below in json form.  The json_schema of the task description is: {Task.schema_json()}.
+The full task is provided below in json form.  The json_schema of the task description is: {schema_json(Task)}.
 You will output in json form the next step of the task as described below.
 As a next step you have options to read files, create files, and ask questions to help accomplish the task.
 Please set the task_done field to true when the task is complete.
 The task description follows in json.
+""".strip()
+
+def task_prompt(task: Task) -> list[dict]:
+    """
+    the fixed system prompt (PROMPT_PREFIX messages, the same on every step) followed by the task state
+    """
+    return [{"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "system", "content": task.json(exclude_none=True)}]
+
+PROMPT_PREFIX = 1
+
+
+
+WORK_LOG_TOKENS = int(os.environ.get("PAIR_TASK_LOG_TOKENS", 1000))   # work log size before it is rolled up
+KEEP_LOG_ENTRIES = 2                                                 # recent entries kept out of a roll up
+
+ROLLUP_PROMPT = """
+Condense the summary and work log entries below into a single concise summary of the work done so far on the task.
+Keep filenames, decisions and open issues.  Respond with only the summary.
 """
 
-def find_files(file_extensions = ('.py', '.md', '.txt')):  
-    path = os.getcwd()    
-    file_paths = []
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            if file.endswith(file_extensions):
-                rel_path = os.path.relpath(os.path.join(root, file), path)
-                file_paths.append(rel_path)
-    return file_paths
 
+def count_tokens(text: str) -> int:
+    from chatstack.chatstack import encoder
+    return len(encoder.encode(text))
 
 
-def task_prompt(task: Task) -> list[dict]:
-    return [{"role": "system", "content": SYSTEM_PROMPT.strip()},
-            {"role": "system", "content": task.json()}]
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
 
-    
 
-def create(messages : List[dict], model_class: BaseModel, retry=2, temperature=0, **kwargs) -> BaseModel:
-
-    messages.append({"role"   : "system",
-                     "content": f"Please respond ONLY with valid json that conforms to this pydantic json_schema: {model_class.schema_json()}. Do not include additional text other than the object json as we will load this object with json.loads() and pydantic."})
-
-    last_exception = None
-    for i in range(retry+1):
-        response = openai.ChatCompletion.create(messages=messages, temperature=temperature, **kwargs)
-        assistant_message= response['choices'][0]['message']
-        content = assistant_message['content']
-        try:
-            json_content = json.loads(content.strip())
-        except Exception as e:
-            last_exception = e
-            error_msg = f"json.loads exception: {e}"
-            logger.error(error_msg)
-            logger.error(content)
-            messages.append(assistant_message)
-            messages.append({"role"   : "system",
-                            "content": error_msg})
-            continue
-        try:
-            return model_class(**json_content)
-        except ValidationError as e:
-            last_exception = e
-            error_msg = f"pydantic exception: {e}"
-            logger.error(error_msg)
-            messages.append(assistant_message)
-            messages.append({"role"   : "system",
-                            "content": error_msg})    
-    raise last_exception
+def compact_read_files(read_files: dict[str, str]) -> dict[str, str]:
+    """
+    replace content repeated within one step's reads with a reference to the entry that holds it.
+    every step's prompt stands alone, so content read in earlier steps is always given again.
+    """
+    compact = {}
+    first = {}      # content hash -> key of the entry holding the content
+    for key, content in read_files.items():
+        h = content_hash(content)
+        if h in first:
+            compact[key] = f"[same content as {first[h]}]"
+        else:
+            first[h] = key
+            compact[key] = content
+    return compact
+
+
+@instrument.timed("pairwise.roll_up")
+def roll_up(task: Task, model: str) -> tuple[int, int]:
+    """
+    fold older work log entries into the work summary once the log is over WORK_LOG_TOKENS.
+    returns the (prompt, response) tokens of the roll up, (0, 0) if none was needed.
+    """
+    if len(task.work_log) <= KEEP_LOG_ENTRIES or count_tokens("\n".join(task.work_log)) <= WORK_LOG_TOKENS:
+        return 0, 0
+    old = task.work_log[:-KEEP_LOG_ENTRIES]
+    entries = "\n".join(f"- {entry}" for entry in old)
+    messages = [{"role": "system", "content": ROLLUP_PROMPT.strip()},
+                {"role": "user", "content": f"Summary:\n{task.work_summary}\n\nWork log:\n{entries}"}]
+    summary = call_with_retry(lambda: get_backend().complete(messages, model=model),
+                              tries=MODEL_TRIES, deadline=MODEL_DEADLINE, host=api_host()).strip()
+    task.work_summary, task.work_log = summary, task.work_log[-KEEP_LOG_ENTRIES:]
+    logger.info(f"rolled {len(old)} work log entries into the work summary ({count_tokens(task.work_summary)} tokens)")
+    return sum(count_tokens(m['content']) for m in messages), count_tokens(summary)
 
 
 DEFAULT_NEXT_STEP_HINT = "Think through how to break the task up into smaller tasks and save the steps in the notes."
-            
-def perform_task(task_description : str,
-                 next_step_hint   : str = DEFAULT_NEXT_STEP_HINT) -> None:
-    
-    task = Task(description=task_description, 
-                next_step_hint=next_step_hint,
-                filenames=find_files(), 
-                work_summary="",
-                step=0)
+CREATE_EXTENSIONS = ('py', 'md', 'txt')
+NO_ANSWER = "No coworker is available to answer right now; the question has been queued. Proceed with your best judgement."
+
+
+class StepPolicy:
+    """
+    decides whether to proceed with each step and how to answer questions; the default asks on the terminal
+    """
+
+    def show(self, text: str, style: Optional[str] = None):
+        if style:
+            print_formatted_text(FormattedText([(style, text)]))
+        else:
+            print(text)
+
+    def approve(self, next_step: NextStep) -> bool:
+        do_continue = input("Proceed? (Y/n): ")
+        return not (do_continue and do_continue.lower()[0] == 'n')
+
+    def overwrite(self, filename: str) -> bool:
+        do_continue = input("Overwrite? (Y/n): ")
+        return not (do_continue and do_continue.lower()[0] == 'n')
+
+    def answer(self, question: str) -> Optional[str]:
+        """
+        return the answer to the model's question, or None if it cannot be answered now
+        """
+        return input(f"{question}\nAnswer: ") or None
+
+
+class AutoApprovePolicy(StepPolicy):
+    """
+    approves every step without a terminal; file creation and overwriting are allowed by flag
+    and questions are queued unanswered
+    """
+
+    def __init__(self, allow_create: bool = True, allow_overwrite: bool = False):
+        self.allow_create = allow_create
+        self.allow_overwrite = allow_overwrite
+
+    def show(self, text, style=None):
+        logger.debug(text)
+
+    def approve(self, next_step):
+        return self.allow_create or not next_step.create_file
+
+    def overwrite(self, filename):
+        return self.allow_overwrite
+
+    def answer(self, question):
+        return None
+
+
+class StepRecord(BaseModel):
+    step             : int
+    seconds          : float
+    prompt_tokens    : int
+    response_tokens  : int
+
+
+class TaskResult(BaseModel):
+    status           : str                       # done, stopped, max_steps or error
+    steps            : list[StepRecord]          = []
+    files_created    : list[str]                 = []
+    questions        : list[str]                 = []
+    work_summary     : str                       = ""
+    error            : Optional[str]             = None
+
+
+TASK_STATE_DIR = os.path.join(CACHE_DIR, "tasks")
+
+
+class TaskState(BaseModel):
+    """
+    a task checkpoint, saved after every completed step
+    """
+    root             : str
+    task             : Task
+    result           : TaskResult
+
+
+def task_state_path(task_description: str, root: str) -> str:
+    key = hashlib.sha1(f"{root}\n{task_description}".encode()).hexdigest()[:16]
+    return os.path.join(TASK_STATE_DIR, f"{key}.json")
+
+
+def save_task_state(path: str, state: TaskState) -> None:
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(state.json())
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"unable to save task state to {path}: {e}")
+
+
+def load_task_state(path: str) -> Optional[TaskState]:
+    try:
+        return TaskState.parse_file(path)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"discarding unreadable task state {path}: {e}")
+        return None
+
+
+def run_task(task_description : str,
+             next_step_hint   : str = DEFAULT_NEXT_STEP_HINT,
+             model            : str = 'gpt-4',
+             root             : Optional[str] = None,
+             policy           : Optional[StepPolicy] = None,
+             max_steps        : Optional[int] = None,
+             resume           : bool = False) -> TaskResult:
+    """
+    run a task to completion under policy, in the repo at root (default the current directory).
+    the task state is saved after every step; with resume a task that stopped before it was
+    done carries on from the step it stopped at.
+    """
+    policy = policy or StepPolicy()
+    root = os.path.abspath(root or os.getcwd())
+    index = RepoIndex(root)
+    filenames = find_files(root=root)
+    index.update(filenames)
+    state_path = task_state_path(task_description, root)
+    state = load_task_state(state_path) if resume else None
+    if state:
+        task, result = state.task, state.result
+        task.repo_outline = index.outline()
+        result.status = "max_steps"
+        policy.show(f"\n[Resuming task at step {task.step}]\n", "fg:MediumVioletRed")
+    else:
+        task = Task(description=task_description,
+                    next_step_hint=next_step_hint,
+                    repo_outline=index.outline(),
+                    work_summary="",
+                    step=0)
+        result = TaskResult(status="max_steps")
     
-    while True:
+    with Prefetcher() as prefetcher:
+        while max_steps is None or task.step < max_steps:
 
-        print(str(task))
+            policy.show(str(task))
        
-        messages = task_prompt(task)
-                            
-        next_step = create(messages, NextStep, retry=4, temperature=.02, model='gpt-4')    
+            messages = task_prompt(task)
+            t0 = perf_counter()
+            next_step = create(messages, NextStep, retry=4, temperature=.02, model=model, prefix=PROMPT_PREFIX)
+            record = StepRecord(step=task.step, seconds=perf_counter() - t0,
+                                prompt_tokens=sum(count_tokens(m['content']) for m in messages),
+                                response_tokens=count_tokens(next_step.json(exclude_none=True)))
+            result.steps.append(record)
+            instrument.record("pairwise.create", record.seconds)
+            instrument.count("pairwise.prompt_tokens", record.prompt_tokens)
+            instrument.count("pairwise.response_tokens", record.response_tokens)
+            logger.info(f"step {task.step}: prompt {record.prompt_tokens} tokens "
+                        f"(task state {count_tokens(messages[-1]['content'])}), "
+                        f"response {record.response_tokens} tokens")
+
+            policy.show(str(next_step), "fg:darkred")
 
-        print_formatted_text(FormattedText([("fg:darkred", str(next_step))]))
+            # load what the step reads and what the hint names while the step is reviewed
+            wanted = (next_step.read_filenames or []) + [part.filename for part in next_step.read_parts or []]
+            prefetcher.prefetch([os.path.join(root, fn) for fn in wanted if fn in filenames] +
+                                [os.path.join(root, fn) for fn in files_mentioned(next_step.next_step_hint, filenames)])
 
-        do_continue = input("Proceed? (Y/n): ")        
-        if do_continue and do_continue.lower()[0] == 'n':
-            break
+            if not policy.approve(next_step):
+                result.status = "stopped"
+                break
+            task.work_log.append(next_step.work_done)
                        
-        # create file if needed
-        if next_step.create_file:
-            print_formatted_text(FormattedText([("fg:MediumVioletRed", f"\n[Creating file {next_step.create_file.filename}]\n")]))
-            if next_step.create_file.filename.split('.')[-1] not in ['py', 'md', 'txt']:
-              raise Exception(f"filename {next_step.create_file.filename} must have a valid file extension") 
-            if next_step.create_file.filename in task.filenames:
-                print_formatted_text(FormattedText([("fg:red", f"WARNING: filename {next_step.create_file.filename} already exists\n")]))
-                do_continue = input(f"Overwrite? (Y/n): ")        
-                if do_continue and do_continue.lower()[0] == 'n':
-                    break                
-            open(next_step.create_file.filename, 'w').write(next_step.create_file.content)            
-
-        if next_step.task_done:
-            print_formatted_text(FormattedText([("fg:MediumVioletRed", "DONE: task_done is set\n")]))
-            break
+            # create file if needed
+            if next_step.create_file:
+                filename = next_step.create_file.filename
+                path = os.path.abspath(os.path.join(root, filename))
+                policy.show(f"\n[Creating file {filename}]\n", "fg:MediumVioletRed")
+                if filename.split('.')[-1] not in CREATE_EXTENSIONS:
+                    raise Exception(f"filename {filename} must have a valid file extension")
+                if not path.startswith(root + os.sep):
+                    raise Exception(f"filename {filename} is outside of {root}")
+                if os.path.exists(path):     # including ignored and excluded files, which are not in filenames
+                    policy.show(f"WARNING: filename {filename} already exists\n", "fg:red")
+                    if not policy.overwrite(filename):
+                        result.status = "stopped"
+                        break
+                with open(path, 'w') as f:
+                    f.write(next_step.create_file.content)
+                result.files_created.append(filename)
+
+            if next_step.task_done:
+                policy.show("DONE: task_done is set\n", "fg:MediumVioletRed")
+                result.status = "done"
+                break
     
-        if next_step.ask_question:
-            print(next_step.ask_question)
-            raise NotImplementedError("need to implement asking a question")
-
-        # update state
-        task.work_summary = next_step.work_summary
-        task.notes        = next_step.notes
-        task.next_step_hint = next_step.next_step_hint
+            task.coworker_message = None
+            if next_step.ask_question:
+                answer = policy.answer(next_step.ask_question)
+                if answer is None:
+                    result.questions.append(next_step.ask_question)
+                task.coworker_message = answer or NO_ANSWER
+
+            # update state
+            rollup_prompt_tokens, rollup_response_tokens = roll_up(task, model)
+            record.prompt_tokens += rollup_prompt_tokens
+            record.response_tokens += rollup_response_tokens
+            instrument.count("pairwise.prompt_tokens", rollup_prompt_tokens)
+            instrument.count("pairwise.response_tokens", rollup_response_tokens)
+            task.notes        = next_step.notes
+            task.next_step_hint = next_step.next_step_hint
         
-        # read the requested files
-        task.filenames = find_files()
-        for fn in next_step.read_filenames:
-            if fn not in task.filenames:
-                raise Exception(f"read filename {fn} not found in filenames")            
-        task.read_files = {fn : open(fn).read() for fn in next_step.read_filenames}
+            # refresh the outline and read the requested files and parts of files
+            filenames = find_files(root=root)
+            index.update(filenames)
+            task.repo_outline = index.outline()
+            read_filenames = next_step.read_filenames or []
+            read_parts = next_step.read_parts or []
+            for fn in read_filenames + [part.filename for part in read_parts]:
+                if fn not in filenames:
+                    raise Exception(f"read filename {fn} not found in filenames")            
+            read_files = {fn : prefetcher.read(os.path.join(root, fn)) for fn in read_filenames}
+            for part in read_parts:
+                try:
+                    text = prefetcher.read(os.path.join(root, part.filename))
+                    if part.symbol:
+                        read_files[part.key()] = index.read_symbol(part.filename, part.symbol, text)
+                    else:
+                        read_files[part.key()] = index.read_lines(part.filename, part.start_line, part.end_line, text)
+                except KeyError as e:
+                    read_files[part.key()] = f"ERROR: {e}"
+
+            task.step += 1
+            task.read_files = compact_read_files(read_files)
+            save_task_state(state_path, TaskState(root=root, task=task, result=result))
+            # check if the context is likely too large and prompt the model to break up the next step
+    if result.status == "done" and os.path.exists(state_path):
+        os.remove(state_path)
+    result.work_summary = "\n".join(filter(None, [task.work_summary] + task.work_log))
+    return result
+
+
+def perform_task(task_description : str,
+                 next_step_hint   : str = DEFAULT_NEXT_STEP_HINT,
+                 model            : str = 'gpt-4',
+                 resume           : bool = False) -> None:
+    run_task(task_description, next_step_hint, model, resume=resume)
 
-        task.step += 1
-        # check if the context is likely too large and prompt the model to break up the next step
 
 if __name__ == "__main__":
     #perform_task("create a file named 'test.txt' with the content 'hello world'")
     #perform_task('create a file name summary.md which a summary of every file here')
-    perform_task("read the available files one at a time and output a final summary of the purpose of this project in summary.txt")
\ No newline at end of file
+    perform_task("read the available files one at a time and output a final summary of the purpose of this project in summary.txt")
@@ -1,16 +1,146 @@
-from io import BytesIO 
+"""
+extract text from pdf documents
+
+pdfs are streamed to a temporary file rather than held in memory and the
+pages are extracted in parallel with a process pool, with page text
+yielded in page order as soon as it is ready.  the pool's processes are
+spawned rather than forked, since extraction is reached from worker threads
+and a fork of a threaded process can deadlock on the locks other threads hold.
+"""
+
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pdfminer.high_level import extract_pages
 from pdfminer.layout import LTTextContainer
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import resolve1
+from pdfminer.utils import decode_text
+
+from .exceptions import ContentTooLarge
+from .instrument import timer
+
+MAX_PDF_BYTES = 64 * 2**20      # refuse to download pdfs larger than this
+PAGES_PER_BATCH = 8             # pages extracted per worker task
+DOWNLOAD_CHUNK_SIZE = 2**16
+
+
+def download_pdf(resp, max_bytes=MAX_PDF_BYTES):
+    """
+    stream the body of a requests response (requested with stream=True) to a temporary file
+    returns the path of the file, which the caller must remove
+    """
+    length = resp.headers.get('Content-Length')
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise ContentTooLarge(f"PDF is {int(length)} bytes, limit is {max_bytes} bytes")
+    fd, path = tempfile.mkstemp(suffix='.pdf')
+    try:
+        size = 0
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in resp.iter_content(DOWNLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ContentTooLarge(f"PDF exceeds limit of {max_bytes} bytes")
+                f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def pdf_info(path):
+    """
+    return the number of pages and the title from the pdf metadata
+    """
+    with open(path, 'rb') as fp:
+        doc = PDFDocument(PDFParser(fp))
+        title = ""
+        for info in doc.info:
+            value = resolve1(info.get('Title'))
+            if isinstance(value, bytes):
+                title = decode_text(value)
+            elif isinstance(value, str):
+                title = value
+            if title:
+                break
+        num_pages = sum(1 for _ in PDFPage.create_pages(doc))
+    return num_pages, title.strip()
+
+
+def _page_text(page_layout):
+    lines = []
+    for element in page_layout:
+        if isinstance(element, LTTextContainer):
+            for text_line in element:
+                lines.append(text_line.get_text().rstrip() + " ")
+    return "".join(lines)
+
+
+def _extract_batch(path, page_numbers):
+    """
+    process pool worker: return the text of each page in page_numbers
+    """
+    return [_page_text(page) for page in extract_pages(path, page_numbers=page_numbers)]
+
+
+def pdf_pages(path, page_range=None, workers=None, num_pages=None):
+    """
+    yield the text of each page of the pdf at path in page order as it becomes available
+    page_range is an optional (first, last) tuple of 0-based inclusive page numbers
+    """
+    if num_pages is None:
+        num_pages, _ = pdf_info(path)
+    first, last = page_range if page_range else (0, num_pages - 1)
+    pages = list(range(max(first, 0), min(last, num_pages - 1) + 1))
+    batches = [pages[i:i+PAGES_PER_BATCH] for i in range(0, len(pages), PAGES_PER_BATCH)]
+    if len(batches) <= 1 or workers == 1:
+        for batch in batches:
+            yield from _extract_batch(path, batch)
+        return
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        futures = [executor.submit(_extract_batch, path, batch) for batch in batches]
+        for future in futures:
+            yield from future.result()
+    finally:
+        executor.shutdown(cancel_futures=True)    # batches not started are dropped if the caller stops early
+
+
+def pdf_text(pdf, page_range=None, workers=None, max_chars=None):
+    """
+    extract text from pdf, either the pdf bytes or the path of a pdf file
+    returns (text, title, language) where the title is taken from the pdf metadata.
+    extraction stops after the page that brings the text to max_chars.
+    """
+    if isinstance(pdf, (bytes, bytearray)):
+        fd, path = tempfile.mkstemp(suffix='.pdf')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pdf)
+        try:
+            return pdf_text(path, page_range=page_range, workers=workers, max_chars=max_chars)
+        finally:
+            os.remove(path)
+    with timer("extract.pdf_text"):
+        num_pages, title = pdf_info(pdf)
+        pages = []
+        size = 0
+        for page in pdf_pages(pdf, page_range=page_range, workers=workers, num_pages=num_pages):
+            pages.append(page)
+            size += len(page)
+            if max_chars and size >= max_chars:
+                break
+    return "".join(pages), title, ""
 
 
-def pdf_text(pdf_bytes):
+def pdf_text_from_response(resp, max_bytes=MAX_PDF_BYTES, page_range=None, workers=None, max_chars=None):
     """
-    extract text from the pdf_bytes and return it as a single string
+    stream a pdf http response to disk and extract (text, title, language) from it
     """
-    text = ""
-    for page_layout in extract_pages(BytesIO(pdf_bytes)):
-        for element in page_layout:
-            if isinstance(element, LTTextContainer):
-                for text_line in element:
-                    text += text_line.get_text().rstrip() + " "
-    return text
+    path = download_pdf(resp, max_bytes=max_bytes)
+    try:
+        return pdf_text(path, page_range=page_range, workers=workers, max_chars=max_chars)
+    finally:
+        os.remove(path)
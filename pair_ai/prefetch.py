@@ -0,0 +1,142 @@
+"""
+speculative file prefetch for the pairwise task loop
+
+while the user reviews a step, the files it asks to read and the files
+named in its next_step_hint are loaded on a thread pool into a bounded
+content cache.  cache entries are checked against the file's mtime and
+size before use, so an edited file is always read again.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional
+
+from loguru import logger
+
+PREFETCH_WORKERS = 4
+CACHE_MAX_BYTES = int(os.environ.get("PAIR_PREFETCH_MAX_BYTES", 64 * 2**20))
+
+
+def read_text(path: str) -> str:
+    """
+    read a text file with universal newlines, as open().read() does
+    """
+    with open(path, encoding='utf-8', errors='replace') as f:
+        return f.read()
+
+
+def files_mentioned(text: Optional[str], filenames: Iterable[str]) -> List[str]:
+    """
+    the filenames whose path, or basename if it is unique, appears in text
+    """
+    if not text:
+        return []
+    filenames = list(filenames)
+    basenames = {}
+    for fn in filenames:
+        basenames.setdefault(os.path.basename(fn), []).append(fn)
+    mentioned = []
+    for fn in filenames:
+        names = [fn]
+        if len(basenames[os.path.basename(fn)]) == 1:
+            names.append(os.path.basename(fn))
+        if any(re.search(rf'(?<![\w./-]){re.escape(name)}(?![\w/-])', text) for name in names):
+            mentioned.append(fn)
+    return mentioned
+
+
+class ContentCache:
+    """
+    thread-safe LRU cache of file contents bounded by total size
+    """
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()    # path -> (mtime_ns, size, text)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> Optional[str]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self.entries.get(path)
+            if entry and entry[:2] == (st.st_mtime_ns, st.st_size):
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            return None
+
+    def put(self, path: str, st: os.stat_result, text: str):
+        with self._lock:
+            old = self.entries.pop(path, None)
+            if old:
+                self.bytes -= old[1]
+            if st.st_size > self.max_bytes:
+                return
+            self.entries[path] = (st.st_mtime_ns, st.st_size, text)
+            self.bytes += st.st_size
+            while self.bytes > self.max_bytes:
+                _, (_, size, _) = self.entries.popitem(last=False)
+                self.bytes -= size
+
+    def load(self, path: str) -> str:
+        """
+        return the content of path from the cache, reading and caching it if needed
+        """
+        text = self.get(path)
+        if text is not None:
+            return text
+        st = os.stat(path)
+        text = read_text(path)
+        self.put(path, st, text)
+        return text
+
+
+class Prefetcher:
+
+    def __init__(self, cache: Optional[ContentCache] = None, workers: int = PREFETCH_WORKERS):
+        self.cache = cache or ContentCache()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self.pending = {}               # path -> Future
+        self._lock = threading.Lock()
+
+    def prefetch(self, paths: Iterable[str]):
+        """
+        start loading paths in the background
+        """
+        with self._lock:
+            for path in paths:
+                future = self.pending.get(path)
+                if future is None or future.done():
+                    self.pending[path] = self.executor.submit(self.cache.load, path)
+
+    def read(self, path: str) -> str:
+        """
+        return the content of path, waiting for a prefetch in progress
+        """
+        with self._lock:
+            future = self.pending.pop(path, None)
+        if future is not None:
+            try:
+                future.result()
+            except OSError as e:
+                logger.warning(f"prefetch of {path} failed: {e}")
+        return self.cache.load(path)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
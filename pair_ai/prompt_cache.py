@@ -0,0 +1,98 @@
+"""
+prompt prefix reuse
+
+providers cache the longest prefix of a prompt they have seen recently, so
+prompts are assembled with the content that does not change between calls
+(system prompt, schemas, pinned files) first and the volatile content
+(task state, retrieved excerpts, the question) last.
+
+PrefixTracker measures how well that works: each prompt is compared with
+the recent prompts and the characters of the longest byte-identical prefix
+are counted as reused.  characters only approximate the token blocks
+providers cache, but the hit rate moves the same way.
+"""
+
+import threading
+from collections import deque
+from typing import List
+
+HISTORY = 8     # recent prompts a new prompt is compared with
+
+
+def serialize(messages: List[dict]) -> str:
+    return ''.join(f"{m['role']}\n{m.get('content') or ''}\n" for m in messages)
+
+
+def common_prefix(a: str, b: str) -> int:
+    """
+    the length of the common prefix of a and b, by binary search over slice comparisons
+    """
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+class PrefixTracker:
+
+    def __init__(self, history: int = HISTORY):
+        self.recent = deque(maxlen=history)
+        self.totals = {}        # kind -> [prompt chars, reused chars]
+        self._lock = threading.Lock()
+
+    def observe(self, kind: str, messages: List[dict]) -> float:
+        """
+        record a prompt of the given kind and return the fraction of it that repeats a recent prompt's prefix
+        """
+        text = serialize(messages)
+        with self._lock:
+            reused = max((common_prefix(text, prev) for prev in self.recent), default=0)
+            self.recent.append(text)
+            totals = self.totals.setdefault(kind, [0, 0])
+            totals[0] += len(text)
+            totals[1] += reused
+        return reused / len(text) if text else 0.0
+
+    def counters(self) -> dict:
+        with self._lock:
+            return {f"{kind}.{name}": value for kind, totals in self.totals.items()
+                    for name, value in zip(('prompt_chars', 'reused_chars'), totals)}
+
+    def reset(self):
+        """
+        clear the totals; the recent prompts are kept so the next prompt's reuse is still measured
+        """
+        with self._lock:
+            self.totals = {}
+
+    def hit_rates(self) -> dict:
+        """
+        kind -> the fraction of prompt characters that were a reused prefix
+        """
+        with self._lock:
+            return {kind: reused / chars for kind, (chars, reused) in self.totals.items() if chars}
+
+    def describe(self) -> str:
+        rates = self.hit_rates()
+        if not rates:
+            return "no prompts sent yet"
+        return "prompt prefix reuse: " + ", ".join(f"{kind} {rate:.0%}" for kind, rate in sorted(rates.items()))
+
+
+tracker = PrefixTracker()
+
+
+def observe(kind: str, messages: List[dict]) -> float:
+    return tracker.observe(kind, messages)
+
+
+def counters() -> dict:
+    return tracker.counters()
+
+
+def reset():
+    tracker.reset()
@@ -0,0 +1,223 @@
+"""
+persistent symbol index of a source tree
+
+python files are indexed with ast into classes and functions with their
+signatures, first docstring line and line ranges.  markdown files are
+split into heading sections and other text files into fixed size line
+chunks.  the index is saved under the pair cache directory and updated
+incrementally by file mtime and size, so only changed files are parsed.
+"""
+
+import ast
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass, asdict, field
+from typing import List, Optional
+
+from loguru import logger
+
+from .url_cache import CACHE_DIR
+
+INDEX_DIR = os.path.join(CACHE_DIR, "index")
+INDEX_VERSION = 1
+TEXT_CHUNK_LINES = 80
+
+
+@dataclass
+class Symbol:
+    name       : str              # qualified name, e.g. Task.__str__
+    kind       : str              # class, function, section or chunk
+    start      : int              # first line, 1-based
+    end        : int              # last line, inclusive
+    signature  : str = ""
+    doc        : str = ""         # first line of the docstring
+
+
+@dataclass
+class FileIndex:
+    path       : str
+    mtime_ns   : int
+    size       : int
+    lines      : int
+    symbols    : List[Symbol] = field(default_factory=list)
+
+
+def _first_line(doc: Optional[str]) -> str:
+    return doc.strip().splitlines()[0] if doc and doc.strip() else ""
+
+
+def _signature(node) -> str:
+    if isinstance(node, ast.ClassDef):
+        bases = ", ".join(ast.unparse(b) for b in node.bases)
+        return f"class {node.name}({bases})" if bases else f"class {node.name}"
+    prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+    returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+    return f"{prefix} {node.name}({ast.unparse(node.args)}){returns}"
+
+
+def python_symbols(source: str) -> List[Symbol]:
+    symbols = []
+
+    def visit(body, prefix):
+        for node in body:
+            if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+                name = f"{prefix}{node.name}"
+                start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+                kind = "class" if isinstance(node, ast.ClassDef) else "function"
+                symbols.append(Symbol(name, kind, start, node.end_lineno,
+                                      _signature(node), _first_line(ast.get_docstring(node))))
+                if isinstance(node, ast.ClassDef):
+                    visit(node.body, f"{name}.")
+
+    visit(ast.parse(source).body, "")
+    return symbols
+
+
+def markdown_symbols(lines: List[str]) -> List[Symbol]:
+    symbols = []
+    in_code = False
+    for i, line in enumerate(lines, 1):
+        if line.startswith("```"):
+            in_code = not in_code
+        if not in_code and line.startswith("#"):
+            if symbols:
+                symbols[-1].end = i - 1
+            symbols.append(Symbol(line.lstrip("#").strip(), "section", i, len(lines)))
+    if not symbols or symbols[0].start > 1:
+        symbols.insert(0, Symbol("(preamble)", "section", 1, symbols[0].start - 1 if symbols else len(lines)))
+    return [s for s in symbols if s.end >= s.start]
+
+
+def text_symbols(lines: List[str]) -> List[Symbol]:
+    return [Symbol(f"lines {start}-{min(start + TEXT_CHUNK_LINES - 1, len(lines))}", "chunk",
+                   start, min(start + TEXT_CHUNK_LINES - 1, len(lines)))
+            for start in range(1, len(lines) + 1, TEXT_CHUNK_LINES)]
+
+
+def index_file(path: str, st: os.stat_result) -> FileIndex:
+    with open(path, 'r', errors='replace') as f:
+        source = f.read()
+    lines = source.splitlines()
+    symbols = None
+    if path.endswith('.py'):
+        try:
+            symbols = python_symbols(source)
+        except (SyntaxError, ValueError) as e:
+            logger.warning(f"unable to parse {path}, indexing as text: {e}")
+    elif path.endswith('.md'):
+        symbols = markdown_symbols(lines)
+    if symbols is None:
+        symbols = text_symbols(lines)
+    return FileIndex(path, st.st_mtime_ns, st.st_size, len(lines), symbols)
+
+
+class RepoIndex:
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = os.path.abspath(root or os.getcwd())
+        digest = hashlib.sha256(self.root.encode()).hexdigest()[:16]
+        self.index_path = os.path.join(INDEX_DIR, f"{digest}.json")
+        self.files = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                data = json.load(f)
+            if data.get('version') != INDEX_VERSION or data.get('root') != self.root:
+                return
+            for fi in data['files']:
+                fi['symbols'] = [Symbol(**s) for s in fi['symbols']]
+                self.files[fi['path']] = FileIndex(**fi)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"discarding unreadable repo index {self.index_path}: {e}")
+
+    def save(self):
+        try:
+            os.makedirs(INDEX_DIR, exist_ok=True)
+            tmp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': INDEX_VERSION,
+                           'root': self.root,
+                           'files': [asdict(fi) for fi in self.files.values()]}, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logger.warning(f"unable to save repo index {self.index_path}: {e}")
+
+    def update(self, filenames: List[str]) -> int:
+        """
+        bring the index up to date with filenames, paths relative to the root.
+        only new or modified files are parsed.  returns the number of files (re)indexed.
+        """
+        updated = 0
+        current = {}
+        for fn in filenames:
+            try:
+                st = os.stat(os.path.join(self.root, fn))
+            except FileNotFoundError:
+                continue
+            fi = self.files.get(fn)
+            if fi is None or (fi.mtime_ns, fi.size) != (st.st_mtime_ns, st.st_size):
+                try:
+                    fi = index_file(os.path.join(self.root, fn), st)
+                except OSError as e:
+                    logger.warning(f"unable to index {fn}: {e}")
+                    continue
+                fi.path = fn
+                updated += 1
+            current[fn] = fi
+        removed = len(self.files.keys() - current.keys())
+        self.files = current
+        if updated or removed:
+            self.save()
+        return updated
+
+    def outline(self) -> str:
+        """
+        return a compact outline of the indexed files and their symbols with line ranges
+        """
+        out = []
+        for fn in sorted(self.files):
+            fi = self.files[fn]
+            out.append(f"{fn} ({fi.lines} lines)")
+            if fi.symbols and fi.symbols[0].kind == "chunk":
+                continue   # plain text chunks add nothing to the outline
+            for s in fi.symbols:
+                depth = s.name.count(".") if s.kind in ("class", "function") else 0
+                label = s.signature or s.name
+                doc = f"  # {s.doc}" if s.doc else ""
+                out.append(f"{'  ' * (depth + 1)}{label} [{s.start}-{s.end}]{doc}")
+        return "\n".join(out)
+
+    def symbol(self, filename: str, name: str) -> Optional[Symbol]:
+        fi = self.files.get(filename)
+        if fi is None:
+            return None
+        for s in fi.symbols:
+            if s.name == name:
+                return s
+        return None
+
+    def read_lines(self, filename: str, start: Optional[int] = None, end: Optional[int] = None,
+                   text: Optional[str] = None) -> str:
+        """
+        return lines start through end (1-based, inclusive) of filename, prefixed with line numbers.
+        text is the content of filename if it has already been read.
+        """
+        if text is None:
+            with open(os.path.join(self.root, filename), 'r', errors='replace') as f:
+                text = f.read()
+        lines = text.splitlines()
+        start = max(start or 1, 1)
+        end = min(end or len(lines), len(lines))
+        return "\n".join(f"{i:5d} {lines[i-1]}" for i in range(start, end + 1))
+
+    def read_symbol(self, filename: str, name: str, text: Optional[str] = None) -> str:
+        s = self.symbol(filename, name)
+        if s is None:
+            raise KeyError(f"symbol {name} not found in {filename}")
+        return self.read_lines(filename, s.start, s.end, text)
@@ -0,0 +1,189 @@
+"""
+incremental parsing and rendering of a streamed model response
+
+ResponseParser is fed the response deltas and returns each complete line
+classified as prose, a fence or a line of a fenced code block, so every
+line can be rendered once, as it arrives, with the block's language
+highlighted by pygments.  prose is returned as it streams once the start
+of its line rules out a fence; only the start of a line and the lines of
+code blocks are held back until they are complete.  when a ```diff block
+closes, DiffValidator starts computing the PatchSet of the diff blocks so
+far on a worker thread, so the dry run against the files on disk is
+usually done by the time the response ends.
+
+lexing a line at a time loses the lexer state between lines, so a construct
+spanning lines, such as a triple quoted string, is only approximately
+highlighted.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from time import perf_counter
+from typing import List, Optional
+
+from prompt_toolkit.formatted_text import FormattedText, PygmentsTokens
+from pygments.lexers import get_lexer_by_name
+from pygments.lexers.special import TextLexer
+from pygments.util import ClassNotFound
+
+from .diff_apply import PatchSet
+from .instrument import record
+
+PROSE = 'prose'
+FENCE = 'fence'         # an opening or closing fence line
+CODE = 'code'
+
+DIFF_LANGUAGES = ('diff', 'patch')
+FENCE_STYLE = "fg:ansibrightblack"
+
+
+@dataclass
+class Block:
+    lang   : str
+    lines  : List[str]
+
+    @property
+    def text(self) -> str:
+        return ''.join(line + '\n' for line in self.lines)
+
+
+@dataclass
+class ParsedLine:
+    text    : str
+    kind    : str                       # PROSE, FENCE or CODE
+    lang    : str = ''                  # the language of the enclosing block
+    closed  : Optional[Block] = None    # the block a closing fence ends
+    end     : bool = True               # False for a piece of a prose line that continues
+
+
+def may_be_fence(start: str) -> bool:
+    """
+    True if a line starting with start may be a fence, so must be held back until it is complete
+    """
+    start = start.lstrip()[:3]
+    return '```'.startswith(start) or '~~~'.startswith(start)
+
+
+class ResponseParser:
+
+    def __init__(self):
+        self.pending = ""
+        self.blocks = []        # closed blocks
+        self.block = None       # the open block
+        self.fence = None       # the characters that close the open block
+        self.prose = False      # the start of the current line was returned as prose
+
+    def _line(self, line: str) -> ParsedLine:
+        stripped = line.strip()
+        if self.block is None:
+            if stripped.startswith(('```', '~~~')):
+                char = stripped[0]
+                self.fence = stripped[:len(stripped) - len(stripped.lstrip(char))]
+                info = stripped[len(self.fence):].split()
+                self.block = Block(info[0].lower() if info else '', [])
+                return ParsedLine(line, FENCE, self.block.lang)
+            return ParsedLine(line, PROSE)
+        if stripped.startswith(self.fence) and not stripped.lstrip(self.fence[0]):
+            block, self.block = self.block, None
+            self.blocks.append(block)
+            return ParsedLine(line, FENCE, block.lang, closed=block)
+        self.block.lines.append(line)
+        return ParsedLine(line, CODE, self.block.lang)
+
+    def feed(self, delta: str) -> List[ParsedLine]:
+        """
+        the lines completed by delta, and any prose delta adds to a line that cannot be a fence.
+        a prose line may come in several pieces, each but the last with end False.
+        """
+        self.pending += delta
+        lines = []
+        while '\n' in self.pending:
+            line, self.pending = self.pending.split('\n', 1)
+            lines.append(ParsedLine(line, PROSE) if self.prose else self._line(line))
+            self.prose = False
+        if self.pending and self.block is None and (self.prose or not may_be_fence(self.pending)):
+            lines.append(ParsedLine(self.pending, PROSE, end=False))
+            self.pending = ""
+            self.prose = True
+        return lines
+
+    def close(self) -> List[ParsedLine]:
+        """
+        the last line, if the response did not end with a newline; an open block is closed
+        """
+        lines = []
+        if self.pending or self.prose:
+            lines.append(ParsedLine(self.pending, PROSE) if self.prose else self._line(self.pending))
+            self.pending = ""
+            self.prose = False
+        if self.block is not None:
+            self.blocks.append(self.block)
+            self.block = None
+        return lines
+
+    def diff_blocks(self) -> List[str]:
+        return [block.text for block in self.blocks if block.lang in DIFF_LANGUAGES]
+
+
+@lru_cache(maxsize=32)
+def lexer_for(lang: str):
+    try:
+        return get_lexer_by_name(lang, stripnl=False, ensurenl=False)
+    except ClassNotFound:
+        return TextLexer()
+
+
+def render(line: ParsedLine):
+    """
+    formatted text for one line; code is highlighted a line at a time
+    """
+    if line.kind == PROSE:
+        return line.text
+    if line.kind == FENCE:
+        return FormattedText([(FENCE_STYLE, line.text)])
+    return PygmentsTokens(list(lexer_for(line.lang).get_tokens(line.text)))
+
+
+class DiffValidator:
+    """
+    dry runs the diff blocks of a response on a worker thread as they close
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='diff')
+        self.future = None
+        self.blocks = 0         # the diff blocks the current future covers
+
+    @staticmethod
+    def _validate(blocks: List[str]) -> PatchSet:
+        t0 = perf_counter()
+        try:
+            return PatchSet.from_blocks(blocks)
+        finally:
+            record("diff.validate", perf_counter() - t0)
+
+    def submit(self, blocks: List[str]):
+        """
+        validate blocks, replacing the validation of an earlier, shorter list of blocks
+        """
+        if self.future is not None:
+            self.future.cancel()
+        self.blocks = len(blocks)
+        self.future = self._executor.submit(self._validate, list(blocks))
+
+    def result(self, blocks: List[str]) -> PatchSet:
+        """
+        the PatchSet for blocks, from the validation already running if it covers them.
+        raises PatchError if the diffs do not apply.
+        """
+        if self.future is None or self.blocks != len(blocks):
+            self.submit(blocks)
+        t0 = perf_counter()
+        try:
+            return self.future.result()
+        finally:
+            record("diff.wait", perf_counter() - t0)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
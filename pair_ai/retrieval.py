@@ -0,0 +1,264 @@
+"""
+chunking and lexical retrieval for large loaded documents
+
+a large document (see context_packer.LARGE_DOC_TOKENS) is not sent as one
+message.  it is split into chunks of about CHUNK_TOKENS along paragraph
+and sentence boundaries (sentences found with pysbd) and indexed for BM25
+with numpy.  each turn
+the chunks most relevant to the question are sent as context messages,
+up to a token budget.
+
+a document index is stored under the pair cache directory named by the
+hash of the document text, so loading the same document again only reads
+the index back.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from .url_cache import CACHE_DIR
+
+RETRIEVAL_DIR = os.path.join(CACHE_DIR, "retrieval")
+INDEX_VERSION = 1
+RETRIEVAL_TOKENS = int(os.environ.get("PAIR_RETRIEVAL_TOKENS", 3000))      # budget for chunks per turn
+CHUNK_TOKENS = 300
+TOP_K = 8
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TERM_RE = re.compile(r'\w+')
+PARAGRAPH_RE = re.compile(r'\n\s*\n')
+
+_segmenter = None
+_segmenter_lock = threading.Lock()
+
+
+def count_tokens(text: str) -> int:
+    from chatstack.chatstack import encoder
+    return len(encoder.encode(text))
+
+
+def terms(text: str) -> List[str]:
+    return TERM_RE.findall(text.lower())
+
+
+def sentences(text: str) -> List[str]:
+    global _segmenter
+    with _segmenter_lock:
+        if _segmenter is None:
+            import pysbd
+            _segmenter = pysbd.Segmenter(language="en", clean=False)
+        return _segmenter.segment(text)
+
+
+def chunk_text(text: str, chunk_tokens: int = CHUNK_TOKENS) -> List[str]:
+    """
+    split text into chunks of about chunk_tokens, keeping paragraphs whole where they fit
+    and otherwise splitting them between sentences
+    """
+    chunk_chars = chunk_tokens * 4      # rough size; exact token counts are taken per chunk
+    pieces = []
+    for paragraph in PARAGRAPH_RE.split(text):
+        if not paragraph.strip():
+            continue
+        if len(paragraph) <= chunk_chars:
+            pieces.append(paragraph.strip())
+        else:
+            pieces.extend(s.strip() for s in sentences(paragraph) if s.strip())
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(piece) > chunk_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{piece}" if current else piece
+        while len(current) > 2 * chunk_chars:    # a sentence without boundaries, e.g. minified text
+            chunks.append(current[:chunk_chars])
+            current = current[chunk_chars:]
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class DocIndex:
+    """
+    BM25 postings for the chunks of one document, stored term by term:
+    the postings of term t are post_chunk/post_tf[term_ptr[t]:term_ptr[t+1]]
+    """
+
+    def __init__(self, digest: str, chunks: List[str], vocab: dict, term_ptr, post_chunk, post_tf, lengths, tokens):
+        self.digest = digest
+        self.chunks = chunks
+        self.vocab = vocab              # term -> id
+        self.term_ptr = term_ptr
+        self.post_chunk = post_chunk
+        self.post_tf = post_tf
+        self.lengths = lengths          # terms per chunk
+        self.tokens = tokens            # model tokens per chunk
+
+    @classmethod
+    def build(cls, text: str, digest: str) -> 'DocIndex':
+        chunks = chunk_text(text)
+        vocab = {}
+        rows = []       # (term id, chunk, count)
+        lengths = np.zeros(len(chunks), dtype=np.int32)
+        for c, chunk in enumerate(chunks):
+            chunk_terms = terms(chunk)
+            lengths[c] = len(chunk_terms)
+            counts = {}
+            for t in chunk_terms:
+                tid = vocab.setdefault(t, len(vocab))
+                counts[tid] = counts.get(tid, 0) + 1
+            rows.extend((tid, c, n) for tid, n in counts.items())
+        postings = np.array(rows, dtype=np.int64).reshape(-1, 3)
+        postings = postings[np.lexsort((postings[:, 1], postings[:, 0]))]
+        term_ptr = np.searchsorted(postings[:, 0], np.arange(len(vocab) + 1)).astype(np.int64)
+        tokens = np.array([count_tokens(chunk) for chunk in chunks], dtype=np.int32)
+        return cls(digest, chunks, vocab, term_ptr, postings[:, 1].astype(np.int32),
+                   postings[:, 2].astype(np.float32), lengths, tokens)
+
+    @staticmethod
+    def _paths(digest: str) -> Tuple[str, str]:
+        base = os.path.join(RETRIEVAL_DIR, digest)
+        return f"{base}.json", f"{base}.npz"
+
+    def save(self):
+        json_path, npz_path = self._paths(self.digest)
+        try:
+            os.makedirs(RETRIEVAL_DIR, exist_ok=True)
+            tmp = f"{npz_path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+            np.savez(tmp, term_ptr=self.term_ptr, post_chunk=self.post_chunk, post_tf=self.post_tf,
+                     lengths=self.lengths, tokens=self.tokens)
+            os.replace(tmp, npz_path)
+            tmp = f"{json_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'chunks': self.chunks, 'vocab': self.vocab}, f)
+            os.replace(tmp, json_path)
+        except OSError as e:
+            logger.warning(f"unable to save retrieval index {self.digest}: {e}")
+
+    @classmethod
+    def load(cls, digest: str) -> Optional['DocIndex']:
+        json_path, npz_path = cls._paths(digest)
+        try:
+            with open(json_path) as f:
+                meta = json.load(f)
+            if meta.get('version') != INDEX_VERSION:
+                return None
+            with np.load(npz_path) as arrays:
+                return cls(digest, meta['chunks'], meta['vocab'], arrays['term_ptr'], arrays['post_chunk'],
+                           arrays['post_tf'], arrays['lengths'], arrays['tokens'])
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"discarding unreadable retrieval index {digest}: {e}")
+            return None
+
+    def postings(self, term: str):
+        tid = self.vocab.get(term)
+        if tid is None:
+            return None
+        lo, hi = self.term_ptr[tid], self.term_ptr[tid + 1]
+        return self.post_chunk[lo:hi], self.post_tf[lo:hi]
+
+
+def index_document(text: str) -> DocIndex:
+    """
+    return the index for text, from disk if the same text was indexed before
+    """
+    digest = hashlib.sha256(text.encode()).hexdigest()
+    index = DocIndex.load(digest)
+    if index is None:
+        index = DocIndex.build(text, digest)
+        index.save()
+    return index
+
+
+@dataclass
+class Retrieved:
+    name   : str        # the document's file or url
+    chunk  : int
+    score  : float
+    tokens : int
+    text   : str
+
+
+class DocumentStore:
+    """
+    the large documents loaded into a chat, searched together with BM25
+    """
+
+    def __init__(self):
+        self.docs = {}          # name -> DocIndex
+        self._lock = threading.Lock()
+
+    def add(self, name: str, text: str) -> DocIndex:
+        index = index_document(text)
+        with self._lock:
+            self.docs[name] = index
+        return index
+
+    def restore(self, name: str, digest: str) -> bool:
+        """
+        add a document from its index on disk; False if the index is no longer there
+        """
+        index = DocIndex.load(digest)
+        if index is None:
+            return False
+        with self._lock:
+            self.docs[name] = index
+        return True
+
+    def remove(self, name: str) -> bool:
+        with self._lock:
+            return self.docs.pop(name, None) is not None
+
+    def __contains__(self, name):
+        return name in self.docs
+
+    def search(self, question: str, token_budget: int = RETRIEVAL_TOKENS, top_k: int = TOP_K) -> List[Retrieved]:
+        """
+        the chunks that best match question, best first, up to top_k and token_budget
+        """
+        with self._lock:
+            docs = list(self.docs.items())
+        query = set(terms(question))
+        if not docs or not query:
+            return []
+        # corpus statistics over every loaded document so scores are comparable between them
+        n_chunks = sum(len(d.chunks) for _, d in docs)
+        avg_length = max(sum(int(d.lengths.sum()) for _, d in docs) / max(n_chunks, 1), 1.0)
+        df = {t: sum(len(p[0]) for _, d in docs if (p := d.postings(t)) is not None) for t in query}
+        idf = {t: np.log(1 + (n_chunks - n + 0.5) / (n + 0.5)) for t, n in df.items() if n}
+
+        results = []
+        for name, doc in docs:
+            scores = np.zeros(len(doc.chunks), dtype=np.float32)
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc.lengths / avg_length)
+            for t, weight in idf.items():
+                p = doc.postings(t)
+                if p is None:
+                    continue
+                chunk_ids, tf = p
+                scores[chunk_ids] += weight * tf * (BM25_K1 + 1) / (tf + norm[chunk_ids])
+            for c in np.flatnonzero(scores):
+                results.append(Retrieved(name, int(c), float(scores[c]), int(doc.tokens[c]), doc.chunks[c]))
+        results.sort(key=lambda r: -r.score)
+
+        chosen = []
+        remaining = token_budget
+        for r in results:
+            if len(chosen) == top_k:
+                break
+            if r.tokens <= remaining:
+                chosen.append(r)
+                remaining -= r.tokens
+        return chosen
@@ -1,11 +1,210 @@
 """
-retry decorator in a wsk style
+retry decorator in a wsk style, with error classification, full jitter
+backoff, Retry-After, a deadline and a per host circuit breaker
+
+errors are classified as retryable (connection failures, timeouts, http
+408/425/429/5xx) or permanent (everything else, e.g. an unsupported content
+type or empty text), and permanent errors are raised at once.  retries
+sleep a random time up to the exponential backoff ("full jitter"), or the
+server's Retry-After if that is longer, and stop once the deadline would be
+passed.  when a host keeps failing its circuit opens and calls to it fail
+fast with CircuitOpen until the reset timeout has passed.
 """
-from loguru import logger
-from time import sleep
+import email.utils
+import random
+import threading
+from collections import Counter
 from functools import wraps
+from time import monotonic, sleep, time
+from typing import Callable, Optional
+
+from loguru import logger
+
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+RETRYABLE_NAMES = {'ConnectionError', 'Timeout', 'ReadTimeout', 'ConnectTimeout', 'ChunkedEncodingError',
+                   'APIConnectionError', 'APITimeoutError', 'RateLimitError', 'ServiceUnavailableError', 'TryAgain'}
+
+COUNTERS = Counter()    # attempts, retries, successes, permanent, exhausted, deadline, circuit_open
+_counters_lock = threading.Lock()
+
+
+def _count(key: str):
+    with _counters_lock:
+        COUNTERS[key] += 1
+
+
+def counters() -> dict:
+    """
+    a snapshot of the retry counters
+    """
+    with _counters_lock:
+        return dict(COUNTERS)
+
+
+def reset():
+    with _counters_lock:
+        COUNTERS.clear()
+
+
+class CircuitOpen(Exception):
+    """
+    Calls to the host are failing fast after repeated errors.
+    """
+
+
+def status_code(e: Exception) -> Optional[int]:
+    """
+    the http status of an error from requests, openai or pair, if it has one
+    """
+    for attr in ('status', 'status_code', 'http_status'):
+        value = getattr(e, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(e, 'response', None)
+    value = getattr(response, 'status_code', None)
+    return value if isinstance(value, int) else None
+
+
+def retry_after(e: Exception) -> Optional[float]:
+    """
+    seconds the server asked us to wait, from the error or its response's Retry-After header
+    """
+    value = getattr(e, 'retry_after', None)
+    if value is None:
+        headers = getattr(e, 'headers', None) or getattr(getattr(e, 'response', None), 'headers', None)
+        value = headers.get('Retry-After') if headers else None
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(e: Exception) -> bool:
+    """
+    True for errors that may succeed if tried again
+    """
+    status = status_code(e)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if any(cls.__name__ in RETRYABLE_NAMES for cls in type(e).__mro__):
+        return True
+    return isinstance(e, (ConnectionError, TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    opens after failure_threshold consecutive retryable failures; after reset_timeout
+    one trial call is let through and closes the circuit again if it succeeds
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if monotonic() - self.opened_at >= self.reset_timeout:
+                self.opened_at = monotonic()    # let one trial call through per reset_timeout
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(host: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker()
+        return _breakers[host]
+
+
+def breaker_states() -> dict:
+    with _breakers_lock:
+        return {host: (b.state, b.failures) for host, b in _breakers.items()}
+
+
+def call_with_retry(f: Callable, args: tuple = (), kwargs: Optional[dict] = None, tries: int = 5,
+                    delay: float = 0.5, backoff: float = 2, cap: float = 30.0, deadline: Optional[float] = None, host: Optional[str] = None,
+                    classify: Callable[[Exception], bool] = is_retryable, ExceptionToCheck=Exception,
+                    ExceptionToRaise=AssertionError):
+    """
+    call f(*args, **kwargs), retrying retryable errors as described in the module docstring.
+    deadline is the total seconds allowed for all tries and sleeps.
+    """
+    circuit = breaker(host) if host else None
+    start = monotonic()
+    for attempt in range(tries):
+        if circuit and not circuit.allow():
+            _count('circuit_open')
+            raise CircuitOpen(f"{host} is failing, not retrying until its circuit resets")
+        _count('attempts')
+        try:
+            result = f(*args, **(kwargs or {}))
+        except ExceptionToRaise:
+            raise
+        except ExceptionToCheck as e:
+            if not classify(e):
+                if circuit:
+                    circuit.success()       # the host answered, the request itself is at fault
+                _count('permanent')
+                raise
+            if circuit:
+                circuit.failure()
+            if attempt == tries - 1:
+                _count('exhausted')
+                logger.exception(f"Exception: {e}")   # only show full stack trace on last try
+                raise
+            wait = random.uniform(0, min(cap, delay * backoff ** attempt))
+            server_wait = retry_after(e)
+            if server_wait is not None:
+                wait = max(wait, server_wait)
+            if deadline is not None and monotonic() - start + wait > deadline:
+                _count('deadline')
+                logger.warning(f"Exception: {e}, not retrying past the {deadline}s deadline")
+                raise
+            _count('retries')
+            logger.warning(f"Exception: {e}")
+            logger.info(f"retrying in {wait:.2f} seconds")
+            sleep(wait)
+            continue
+        if circuit:
+            circuit.success()
+        _count('successes')
+        return result
+
 
-def retry(ExceptionToCheck=Exception, tries=5, delay=0.5, backoff=2, ExceptionToRaise=AssertionError):
+def retry(ExceptionToCheck=Exception, tries=5, delay=0.5, backoff=2, ExceptionToRaise=AssertionError,
+          cap=30.0, deadline=None, host=None, classify=is_retryable):
     """Retry calling the decorated function using an exponential backoff.
 
     http://www.saltycrane.com/blog/2009/11/trying-out-retry-decorator-python/
@@ -22,28 +221,20 @@ def retry(ExceptionToCheck=Exception, tries=5, delay=0.5, backoff=2, ExceptionTo
         each retry
     :type backoff: int
     :param ExceptionToRaise: exceptions that should be raised instead of retried.
-        
+    :param cap: the longest backoff in seconds before jitter
+    :param deadline: total seconds allowed for all tries
+    :param host: a function of the decorated function's arguments that returns
+        the host to circuit break on, or None for no circuit breaking
+    :param classify: returns True for exceptions that are worth retrying
     """
     def deco_retry(f):
 
         @wraps(f)
         def f_retry(*args, **kwargs):
-            mtries, mdelay = tries, delay
-            while mtries > 1:
-                try:
-                    return f(*args, **kwargs)
-                except ExceptionToRaise as e:
-                    raise e
-                except ExceptionToCheck as e:
-                    if mtries == 1: # only show full stack trace on last try
-                        logger.exception(f"Exception: {e}")
-                    logger.warning(f"Exception: {e}")
-                    logger.info(f"retrying in {mdelay} seconds")
-                    sleep(mdelay)
-                    mtries -= 1
-                    mdelay *= backoff
-            return f(*args, **kwargs)
+            return call_with_retry(f, args, kwargs, tries=tries, delay=delay, backoff=backoff, cap=cap,
+                                   deadline=deadline, host=host(*args, **kwargs) if host else None, classify=classify,
+                                   ExceptionToCheck=ExceptionToCheck, ExceptionToRaise=ExceptionToRaise)
 
         return f_retry  # true decorator
 
-    return deco_retry
\ No newline at end of file
+    return deco_retry
@@ -0,0 +1,165 @@
+"""
+save and restore REPL sessions
+
+a session is the chat context (every file, url and turn with its cached
+token count and extracted text, in order, with pinning), the file
+registry's mtimes and digests, the retrieval index digests of large
+documents, and the working directory.  it is written as gzipped json under
+the pair cache directory, ~/.cache/pair_ai/sessions/<name>.json.gz, and the
+REPL saves the session "last" when it exits.
+
+restoring rebuilds the messages without tokenizing them again and only
+re-reads the files whose mtime or size has changed since the save; those
+are sent again as a diff or replaced as with /reload.  large documents are
+restored from their retrieval index on disk.
+"""
+
+import gzip
+import json
+import os
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from chatstack import AssistantMessage, ContextMessage, SystemMessage, UserMessage
+from loguru import logger
+
+from .context_packer import ContextItem
+from .file_registry import FileEntry
+from .url_cache import CACHE_DIR
+
+SESSION_DIR = os.path.join(CACHE_DIR, "sessions")
+SESSION_VERSION = 1
+LAST_SESSION = "last"
+
+MESSAGE_CLASSES = {'user': UserMessage, 'assistant': AssistantMessage, 'system': SystemMessage}
+
+
+def session_path(name: str) -> str:
+    """
+    the file for a session name, or name itself if it is a path
+    """
+    if os.sep in name or name.endswith('.json.gz'):
+        return os.path.expanduser(name)
+    return os.path.join(SESSION_DIR, f"{name}.json.gz")
+
+
+def _message_record(msg) -> dict:
+    record = {'role': msg.role, 'text': msg.text, 'tokens': msg.tokens}
+    if isinstance(msg, ContextMessage):
+        record['prefix'] = msg.prefix
+    return record
+
+
+def _message(record: dict):
+    """
+    rebuild a message with its saved token count, skipping chatstack's tokenizing validator
+    """
+    if 'prefix' in record:
+        return ContextMessage.construct(**record)
+    return MESSAGE_CLASSES[record['role']].construct(**record)
+
+
+def save_session(name: str, chat_ctx, registry) -> str:
+    """
+    write the session to disk and return its path
+    """
+    messages = list(reversed(chat_ctx.messages))        # chronological
+    index = {id(msg): i for i, msg in enumerate(messages)}
+    records = []
+    for msg in messages:
+        record = _message_record(msg)
+        item = chat_ctx.item(msg)
+        record.update(kind=item.kind, name=item.name, pinned=item.pinned)
+        records.append(record)
+    files = [{'key': key, 'path': e.path, 'mtime_ns': e.mtime_ns, 'size': e.size, 'digest': e.digest,
+              'text': e.text, 'messages': [index[id(m)] for m in e.messages if id(m) in index], 'indexed': e.indexed}
+             for key, e in registry.files.items()]
+    documents = {}
+    if chat_ctx._documents is not None:
+        documents = {name: doc.digest for name, doc in chat_ctx._documents.docs.items()}
+    state = {'version': SESSION_VERSION, 'cwd': os.getcwd(), 'model': chat_ctx.model,
+             'messages': records, 'files': files, 'documents': documents}
+
+    path = session_path(name)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp, 'wt', compresslevel=1) as f:      # fast; the text compresses well at any level
+        json.dump(state, f, separators=(',', ':'))
+    os.replace(tmp, path)
+    return path
+
+
+@dataclass
+class Restored:
+    path       : str
+    messages   : int
+    files      : int
+    documents  : int
+    changed    : List[tuple] = field(default_factory=list)   # (path, status, msg) from the registry
+    missing    : List[str] = field(default_factory=list)     # files and documents that could not be restored
+    cwd        : Optional[str] = None                        # the saved working directory, if it was changed to
+
+
+def load_session(name: str, chat_ctx, registry) -> Restored:
+    """
+    replace the chat context and registry contents with a saved session
+    """
+    path = session_path(name)
+    with gzip.open(path, 'rt') as f:
+        state = json.load(f)
+    if state.get('version') != SESSION_VERSION:
+        raise ValueError(f"{path} is from an incompatible version of pair")
+    cwd = None
+    if os.path.isdir(state.get('cwd', '')) and os.path.abspath(state['cwd']) != os.getcwd():
+        os.chdir(state['cwd'])
+        cwd = os.getcwd()
+
+    messages = []
+    items = {}
+    for record in state['messages']:
+        msg = _message({k: record[k] for k in ('role', 'text', 'tokens', 'prefix') if k in record})
+        messages.append(msg)
+        items[id(msg)] = (msg, ContextItem(record['kind'], record.get('name'), record.get('pinned', False)))
+    chat_ctx.messages = list(reversed(messages))        # newest first
+    chat_ctx.items = items
+    chat_ctx._excluded = set()
+
+    registry.files = {f['key']: FileEntry(f['path'], f['mtime_ns'], f['size'], f['digest'], f['text'],
+                                          [messages[i] for i in f['messages']], f.get('indexed', False))
+                      for f in state['files']}
+    restored = Restored(path, len(messages), len(registry.files), 0, cwd=cwd)
+
+    if chat_ctx._documents is not None:
+        chat_ctx._documents.docs.clear()
+    for doc_name, digest in state.get('documents', {}).items():
+        if chat_ctx.documents.restore(doc_name, digest):
+            restored.documents += 1
+        else:
+            restored.missing.append(doc_name)
+
+    # only files changed since the save are read again
+    for key, entry in list(registry.files.items()):
+        try:
+            st = os.stat(key)
+        except OSError:
+            restored.missing.append(entry.path)
+            continue
+        if (st.st_mtime_ns, st.st_size) == (entry.mtime_ns, entry.size):
+            continue
+        try:
+            snap = registry.read(key)
+            snap.path = entry.path
+            status, msg = registry.add(snap, registry.index(snap))
+        except Exception as e:
+            logger.warning(f"unable to refresh {entry.path}: {e}")
+            status, msg = None, e
+        restored.changed.append((entry.path, status, msg))
+    return restored
+
+
+def list_sessions() -> List[str]:
+    try:
+        names = [f[:-len('.json.gz')] for f in os.listdir(SESSION_DIR) if f.endswith('.json.gz')]
+    except FileNotFoundError:
+        return []
+    return sorted(names)
@@ -0,0 +1,287 @@
+"""
+structured (pydantic) output from the model
+
+create() asks the model for an object conforming to a pydantic model in
+one of three modes, chosen with PAIR_STRUCTURED_MODE:
+
+  functions  the schema is sent as a forced function call (default)
+  json       the schema is sent in the prompt and json output is requested
+  text       the schema is sent in the prompt only
+
+in json and text mode the response is streamed through JSONScanner, which
+stops reading as soon as the top level object is closed.  responses are
+repaired locally before parsing (code fences, text around the object,
+trailing commas, truncated output) so that a full retry round trip is only
+needed when the repaired object still fails validation.  a retry resends
+the original prompt plus only the latest bad response and its error, so
+prompts do not grow with each attempt.
+
+transient api errors (rate limits, 5xx, connection failures) are retried
+per request by retry.call_with_retry without counting against retry.
+schema serialization is cached per model class, and the schema instruction
+is placed after the messages the caller marks as a fixed prefix.  counts of parses,
+repairs, retries and failures are kept in METRICS.
+"""
+
+import json
+import os
+import re
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import List, Optional, Type
+
+from loguru import logger
+from pydantic import BaseModel, ValidationError
+
+from .backend import api_host, get_backend
+from . import prompt_cache
+from .retry import call_with_retry, status_code
+
+MODES = ('functions', 'json', 'text')
+DEFAULT_MODE = os.environ.get("PAIR_STRUCTURED_MODE", "functions")
+MODEL_TRIES = 4             # attempts per request for transient api errors
+MODEL_DEADLINE = 120        # seconds allowed for those attempts
+
+FENCE_RE = re.compile(r'```[a-zA-Z]*\s*\n?(.*?)(?:```|$)', re.DOTALL)
+DANGLING_KEY_RE = re.compile(r'([{,])\s*"(?:[^"\\]|\\.)*"\s*:?\s*$')
+PARTIAL_VALUE_RE = re.compile(r'([{\[,:])\s*([-+\w.]+)$')
+TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+
+METRICS = Counter()     # calls, parsed, repaired, retries, failures, mode_fallbacks
+_metrics_lock = threading.Lock()
+
+
+def _count(key: str, n: int = 1):
+    with _metrics_lock:
+        METRICS[key] += n
+
+
+def metrics() -> dict:
+    """
+    a snapshot of the structured output counters
+    """
+    with _metrics_lock:
+        return dict(METRICS)
+
+
+def reset():
+    with _metrics_lock:
+        METRICS.clear()
+
+
+@lru_cache(maxsize=None)
+def schema(model_class: Type[BaseModel]) -> dict:
+    return model_class.schema()
+
+
+@lru_cache(maxsize=None)
+def schema_json(model_class: Type[BaseModel]) -> str:
+    return model_class.schema_json()
+
+
+@lru_cache(maxsize=None)
+def schema_instruction(model_class: Type[BaseModel]) -> str:
+    return (f"Please respond ONLY with valid json that conforms to this pydantic json_schema: {schema_json(model_class)}. "
+            "Do not include additional text other than the object json as we will load this object with json.loads() and pydantic.")
+
+
+class JSONScanner:
+    """
+    incrementally track the structure of the first json object or array in a stream of text
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.start = None         # index of the opening bracket
+        self.end = None           # index just past the closing bracket once complete
+        self.stack = []           # open brackets
+        self.in_string = False
+        self.escape = False
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def feed(self, text: str) -> bool:
+        """
+        scan text and return True once the top level value is complete
+        """
+        pos = len(self.buffer)
+        self.buffer += text
+        if self.complete:
+            return True
+        for i in range(pos, len(self.buffer)):
+            c = self.buffer[i]
+            if self.start is None:
+                if c in '{[':
+                    self.start = i
+                    self.stack.append(c)
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == '\\':
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c in '{[':
+                self.stack.append(c)
+            elif c in '}]':
+                self.stack.pop()
+                if not self.stack:
+                    self.end = i + 1
+                    return True
+        return False
+
+    def text(self) -> Optional[str]:
+        """
+        the scanned object, closed off if the stream was truncated; None if no object was started
+        """
+        if self.start is None:
+            return None
+        if self.complete:
+            return self.buffer[self.start:self.end]
+        body = self.buffer[self.start:]
+        if self.in_string:
+            if self.escape:
+                body = body[:-1]
+            body += '"'
+        body = body.rstrip()
+        # drop an incomplete trailing member: a key without a value or a partial literal
+        if self.stack[-1] == '{':
+            body = DANGLING_KEY_RE.sub(r'\1', body)
+        m = PARTIAL_VALUE_RE.search(body)
+        if m:
+            try:
+                json.loads(m.group(2))
+            except ValueError:
+                body = body[:m.start(2)].rstrip()
+                if body.endswith(':'):
+                    body = DANGLING_KEY_RE.sub(r'\1', body)
+        body = body.rstrip().rstrip(',')
+        closers = {'{': '}', '[': ']'}
+        return body + ''.join(closers[c] for c in reversed(self.stack))
+
+
+def repair_json(text: str):
+    """
+    parse the json object in a model response, repairing common defects.
+    returns (value, repaired) and raises ValueError if nothing can be parsed.
+    """
+    stripped = text.strip()
+    try:
+        return json.loads(stripped), False
+    except ValueError:
+        pass
+    fenced = FENCE_RE.search(stripped)
+    if fenced and fenced.group(1).lstrip()[:1] in ('{', '['):
+        stripped = fenced.group(1)
+    scanner = JSONScanner()
+    scanner.feed(stripped)
+    candidate = scanner.text()
+    if candidate is None:
+        raise ValueError("no json object found in response")
+    try:
+        return json.loads(candidate), True
+    except ValueError:
+        pass
+    # trailing commas are only removed as a last resort since the regex does not respect strings
+    return json.loads(TRAILING_COMMA_RE.sub(r'\1', candidate)), True
+
+
+def _request(messages: List[dict], model_class: Type[BaseModel], mode: str, temperature: float, **kwargs) -> str:
+    backend = get_backend()
+    if mode == 'functions':
+        return backend.complete_function(messages, name=model_class.__name__, parameters=schema(model_class),
+                                         description=(model_class.__doc__ or "").strip(),
+                                         temperature=temperature, **kwargs)
+    if mode == 'json':
+        kwargs['response_format'] = {"type": "json_object"}
+    scanner = JSONScanner()
+    stream = backend.stream(messages, temperature=temperature, **kwargs)
+    try:
+        for delta in stream:
+            if scanner.feed(delta):
+                break           # ignore anything the model adds after the object
+    finally:
+        stream.close()
+    return scanner.buffer
+
+
+def _request_with_retry(messages, model_class, mode, temperature, **kwargs) -> str:
+    """
+    _request with transient api errors retried; permanent ones such as a rejected mode are raised at once
+    """
+    return call_with_retry(_request, (messages, model_class, mode, temperature), kwargs,
+                           tries=MODEL_TRIES, deadline=MODEL_DEADLINE, host=api_host())
+
+
+def _rejected_mode(e: Exception) -> bool:
+    """
+    True if the api rejected the request itself (e.g. the model does not support the mode)
+    """
+    return status_code(e) == 400
+
+
+def _prompt(messages: List[dict], model_class: Type[BaseModel], mode: str, correction: List[dict],
+            prefix: Optional[int] = None) -> List[dict]:
+    """
+    the schema instruction follows the first prefix messages (by default all of them)
+    so that it joins the part of the prompt that is the same on every call
+    """
+    prefix = len(messages) if prefix is None else prefix
+    prompt = list(messages[:prefix])
+    if mode != 'functions':
+        prompt.append({"role": "system", "content": schema_instruction(model_class)})
+    prompt = prompt + list(messages[prefix:]) + correction
+    prompt_cache.observe(model_class.__name__, prompt)
+    return prompt
+
+
+def create(messages: List[dict], model_class: Type[BaseModel], retry: int = 2, temperature: float = 0,
+           mode: Optional[str] = None, prefix: Optional[int] = None, **kwargs) -> BaseModel:
+    """
+    return an instance of model_class from the model's response to messages.
+    prefix is the number of leading messages that do not change between calls.
+    """
+    mode = mode or DEFAULT_MODE
+    if mode not in MODES:
+        raise ValueError(f"unknown structured output mode {mode}, expected one of {MODES}")
+    _count('calls')
+    last_exception = None
+    correction = []
+    for attempt in range(retry+1):
+        try:
+            content = _request_with_retry(_prompt(messages, model_class, mode, correction, prefix), model_class, mode,
+                               temperature, **kwargs)
+        except Exception as e:
+            if mode == 'text' or not _rejected_mode(e):
+                raise
+            logger.warning(f"{mode} mode rejected ({e}), falling back to text mode")
+            _count('mode_fallbacks')
+            mode = 'text'
+            content = _request_with_retry(_prompt(messages, model_class, mode, correction, prefix), model_class, mode,
+                               temperature, **kwargs)
+        try:
+            value, repaired = repair_json(content)
+            result = model_class.parse_obj(value)
+        except (ValueError, ValidationError) as e:
+            last_exception = e
+            kind = "pydantic" if isinstance(e, ValidationError) else "json"
+            logger.error(f"{kind} exception on attempt {attempt+1}: {e}")
+            logger.debug(content)
+            if attempt < retry:
+                _count('retries')
+            correction = [{"role": "assistant", "content": content},
+                          {"role": "system", "content": f"{kind} exception: {e}"}]
+            continue
+        _count('parsed')
+        if repaired:
+            _count('repaired')
+            logger.info(f"repaired malformed json response for {model_class.__name__}")
+        return result
+    _count('failures')
+    raise last_exception
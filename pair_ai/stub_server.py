@@ -0,0 +1,317 @@
+"""
+local stand-in for the OpenAI chat api, for offline benchmarks and tests
+
+serves POST /v1/chat/completions (streamed or not, with forced tool calls
+answered from the same recordings) and GET /v1/models/<id>
+by replaying recorded responses from a jsonl file of
+{"match": "...", "response": "..."} lines as written by PAIR_RECORD.  the
+first recording whose match text occurs in the last user message (or in
+any message, when there is no user message) is used,
+otherwise recordings are replayed in turn.  latency before the first token
+and the token rate are configurable.  files under --pages are served at
+/pages/<name> so url extraction can be exercised without the network.
+GET /stub/stats reports the request count and how much of each prompt
+repeated the prefix of a recent one (see prompt_cache), as a provider
+with prompt caching would see it.
+
+with --github dir, the directory stands in for every github repository:
+/github/api serves the readme and recursive git-trees endpoints of the
+github api and /github/raw serves raw.githubusercontent.com, with ETags,
+304 responses to conditional requests and rate limit headers, for
+PAIR_GITHUB_API=http://127.0.0.1:8089/github/api and
+PAIR_GITHUB_RAW=http://127.0.0.1:8089/github/raw.
+
+usage: python -m pair_ai.stub_server [--port 8089] [--recordings file.jsonl]
+                                     [--latency 0.5] [--tokens-per-second 50] [--pages dir]
+                                     [--github dir] [--github-rate-limit 60]
+then run pair with PAIR_API_BASE=http://127.0.0.1:8089/v1
+"""
+
+import argparse
+import base64
+import hashlib
+import itertools
+import json
+import mimetypes
+import os
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Optional
+
+from .file_finder import find_files
+from .prompt_cache import PrefixTracker
+
+TOKEN_RE = re.compile(r'\s*\S+|\s+')
+DEFAULT_RESPONSE = "This is a stub response."
+
+
+def split_tokens(text: str) -> List[str]:
+    """
+    split text into word sized pieces that join back to the original text
+    """
+    return TOKEN_RE.findall(text)
+
+
+def load_recordings(path: Optional[str]) -> List[dict]:
+    if not path:
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)    # clients that stop reading early are expected
+
+
+class StubServer:
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, recordings: Optional[List[dict]] = None,
+                 latency: float = 0.0, tokens_per_second: float = 0.0, pages_dir: Optional[str] = None,
+                 github_dir: Optional[str] = None, github_rate_limit: int = 60):
+        """
+        latency is the delay before the first token; tokens_per_second of 0 streams without delay.
+        port 0 picks a free port.  github_rate_limit is the number of github api requests
+        answered before the stub reports the rate limit as used up.
+        """
+        self.recordings = recordings or []
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.pages_dir = pages_dir
+        self.github_dir = github_dir
+        self.github_rate_limit = github_rate_limit
+        self.github_reset = int(time.time()) + 3600
+        self.github = {'api': 0, 'raw': 0, 'not_modified': 0, 'rate_limited': 0}
+        self.requests = 0
+        self.prefix = PrefixTracker()
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self.httpd = _Server((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_base(self) -> str:
+        return f"{self.url}/v1"
+
+    def response_for(self, messages: List[dict]) -> str:
+        with self._lock:
+            self.requests += 1
+            turn = next(self._turn)
+        # match against the last user message, or every message if there is none (pairwise)
+        text = next((m.get('content') or '' for m in reversed(messages) if m.get('role') == 'user'),
+                    '\n'.join(m.get('content') or '' for m in messages))
+        for rec in self.recordings:
+            if rec.get('match') and rec['match'] in text:
+                return rec['response']
+        if self.recordings:
+            return self.recordings[turn % len(self.recordings)]['response']
+        return DEFAULT_RESPONSE
+
+    def github_response(self, path: str):
+        """
+        (status, content type, body) for a github api or raw request under github_dir
+        """
+        path = urllib.parse.unquote(path.split('?')[0])
+        parts = [p for p in path.split('/') if p]
+        if parts[:2] == ['github', 'raw'] and len(parts) >= 6:
+            file_path = os.path.join(self.github_dir, *parts[5:])
+            if not os.path.isfile(file_path) or '..' in parts:
+                return 404, 'application/json', b'{"message": "Not Found"}'
+            with open(file_path, 'rb') as f:
+                return 200, 'text/plain; charset=utf-8', f.read()
+        if parts[:3] != ['github', 'api', 'repos'] or len(parts) < 6:
+            return 404, 'application/json', b'{"message": "Not Found"}'
+        endpoint = parts[5:]
+        if endpoint == ['readme']:
+            readme = next((name for name in sorted(os.listdir(self.github_dir)) if name.lower().startswith('readme')), None)
+            if readme is None:
+                return 404, 'application/json', b'{"message": "Not Found"}'
+            with open(os.path.join(self.github_dir, readme), 'rb') as f:
+                content = base64.b64encode(f.read()).decode()
+            return 200, 'application/json', json.dumps({'name': readme, 'path': readme, 'encoding': 'base64',
+                                                        'content': content}).encode()
+        if endpoint[:2] == ['git', 'trees'] and len(endpoint) == 3:
+            tree = [{'path': rel.replace(os.sep, '/'), 'type': 'blob', 'mode': '100644',
+                     'size': os.path.getsize(os.path.join(self.github_dir, rel))}
+                    for rel in find_files(None, root=self.github_dir)]
+            return 200, 'application/json', json.dumps({'sha': endpoint[2], 'tree': tree, 'truncated': False}).encode()
+        return 404, 'application/json', b'{"message": "Not Found"}'
+
+    def start(self) -> 'StubServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, obj):
+                body = json.dumps(obj).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == '/stub/stats':
+                    self._send_json(200, {'requests': server.requests, 'prefix_reuse': server.prefix.hit_rates(),
+                                          'github': server.github})
+                elif self.path.startswith('/github/') and server.github_dir:
+                    self._send_github()
+                elif self.path.startswith('/v1/models/'):
+                    model = self.path[len('/v1/models/'):]
+                    self._send_json(200, {'id': model, 'object': 'model', 'created': 0, 'owned_by': 'stub'})
+                elif self.path.startswith('/pages/') and server.pages_dir:
+                    name = os.path.basename(self.path[len('/pages/'):].split('?')[0])
+                    path = os.path.join(server.pages_dir, name)
+                    if not os.path.isfile(path):
+                        self._send_json(404, {'error': 'not found'})
+                        return
+                    with open(path, 'rb') as f:
+                        body = f.read()
+                    self.send_response(200)
+                    self.send_header('Content-Type', mimetypes.guess_type(path)[0] or 'application/octet-stream')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                else:
+                    self._send_json(404, {'error': 'not found'})
+
+            def _send_github(self):
+                api = self.path.startswith('/github/api/')
+                status, content_type, body = server.github_response(self.path)
+                etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+                with server._lock:
+                    if self.headers.get('If-None-Match') == etag and status == 200:
+                        status = 304        # conditional requests are not counted against the rate limit
+                        server.github['not_modified'] += 1
+                    elif api and server.github['api'] >= server.github_rate_limit:
+                        status, content_type = 403, 'application/json'
+                        body = b'{"message": "API rate limit exceeded"}'
+                        server.github['rate_limited'] += 1
+                    else:
+                        server.github['api' if api else 'raw'] += 1
+                    remaining = max(server.github_rate_limit - server.github['api'], 0)
+                self.send_response(status)
+                if api:
+                    self.send_header('X-RateLimit-Limit', str(server.github_rate_limit))
+                    self.send_header('X-RateLimit-Remaining', str(remaining))
+                    self.send_header('X-RateLimit-Reset', str(server.github_reset))
+                if status == 304:
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if status == 200:
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if not self.path.startswith('/v1/chat/completions'):
+                    self._send_json(404, {'error': 'not found'})
+                    return
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+                model = request.get('model', 'stub')
+                server.prefix.observe('tools' if request.get('tools') else 'chat', request.get('messages', []))
+                text = server.response_for(request.get('messages', []))
+                tokens = split_tokens(text)
+                time.sleep(server.latency)
+                if not request.get('stream'):
+                    if server.tokens_per_second:
+                        time.sleep(len(tokens) / server.tokens_per_second)
+                    message = {'role': 'assistant', 'content': text}
+                    finish_reason = 'stop'
+                    if request.get('tools'):
+                        # a forced function call: the recorded response is the arguments json
+                        name = request['tools'][0]['function']['name']
+                        message = {'role': 'assistant', 'content': None,
+                                   'tool_calls': [{'id': 'call_stub', 'type': 'function',
+                                                   'function': {'name': name, 'arguments': text}}]}
+                        finish_reason = 'tool_calls'
+                    self._send_json(200, {
+                        'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                        'choices': [{'index': 0, 'finish_reason': finish_reason, 'message': message}],
+                        'usage': {'prompt_tokens': 0, 'completion_tokens': len(tokens), 'total_tokens': len(tokens)}})
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+
+                def event(delta, finish_reason=None):
+                    chunk = {'id': 'chatcmpl-stub', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                             'model': model,
+                             'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+
+                event({'role': 'assistant', 'content': ''})
+                for token in tokens:
+                    if server.tokens_per_second:
+                        time.sleep(1 / server.tokens_per_second)
+                    event({'content': token})
+                event({}, 'stop')
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat completions api")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--recordings", help="jsonl file of recorded responses")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="streaming rate, 0 for no delay")
+    parser.add_argument("--pages", help="directory of files to serve at /pages/<name>")
+    parser.add_argument("--github", help="directory to serve as every github repository under /github")
+    parser.add_argument("--github-rate-limit", type=int, default=60, help="github api requests before the limit is used up")
+    args = parser.parse_args()
+    server = StubServer(args.host, args.port, load_recordings(args.recordings),
+                        args.latency, args.tokens_per_second, args.pages, args.github, args.github_rate_limit)
+    print(f"stub model server at {server.api_base}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(server.prefix.describe())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+persistent on-disk cache of extracted url text
+
+entries are json files named by the sha256 of the url and hold the extracted
+(text, title, language) along with the ETag/Last-Modified validators used to
+revalidate the entry with a conditional GET once its ttl has expired.
+the cache is bounded in total size with least recently used eviction.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from time import time
+
+from loguru import logger
+
+CACHE_DIR = os.path.expanduser(os.environ.get("PAIR_CACHE_DIR", "~/.cache/pair_ai"))
+URL_CACHE_DIR = os.path.join(CACHE_DIR, "urls")
+
+DEFAULT_TTL = float(os.environ.get("PAIR_URL_CACHE_TTL", 3600))                 # seconds an entry is used without revalidation
+DEFAULT_MAX_BYTES = int(os.environ.get("PAIR_URL_CACHE_MAX_BYTES", 256 * 2**20))  # total size of the cache on disk
+
+_lock = threading.Lock()
+
+
+def cache_disabled() -> bool:
+    """
+    the cache can be bypassed entirely by setting PAIR_NO_CACHE
+    """
+    return bool(os.environ.get("PAIR_NO_CACHE"))
+
+
+class CacheEntry:
+
+    def __init__(self, url, text, title, language, etag=None, last_modified=None, fetched_at=None):
+        self.url = url
+        self.text = text
+        self.title = title
+        self.language = language
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at if fetched_at is not None else time()
+
+    def is_fresh(self, ttl: float = DEFAULT_TTL) -> bool:
+        return time() - self.fetched_at < ttl
+
+    def validators(self) -> dict:
+        """
+        return the request headers for a conditional GET of this entry
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def result(self):
+        return self.text, self.title, self.language
+
+
+def _path(url: str) -> str:
+    return os.path.join(URL_CACHE_DIR, hashlib.sha256(url.encode()).hexdigest() + '.json')
+
+
+def lookup(url: str):
+    """
+    return the CacheEntry for url or None.  marks the entry as recently used.
+    """
+    if cache_disabled():
+        return None
+    path = _path(url)
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"discarding unreadable url cache entry {path}: {e}")
+        _remove(path)
+        return None
+    if data.get('url') != url:
+        return None
+    return CacheEntry(**data)
+
+
+def store(entry: CacheEntry, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+    if cache_disabled():
+        return
+    path = _path(entry.url)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        os.makedirs(URL_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, 'w') as f:
+            json.dump(vars(entry), f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"unable to write url cache entry {path}: {e}")
+        _remove(tmp_path)
+        return
+    evict(max_bytes)
+
+
+def refresh(entry: CacheEntry) -> None:
+    """
+    the origin confirmed the entry is unchanged (304); restart its ttl
+    """
+    entry.fetched_at = time()
+    store(entry)
+
+
+def evict(max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+    """
+    remove least recently used entries until the cache fits in max_bytes
+    """
+    with _lock:
+        try:
+            entries = [e for e in os.scandir(URL_CACHE_DIR) if e.name.endswith('.json')]
+        except FileNotFoundError:
+            return
+        stats = []
+        for e in entries:
+            try:
+                stats.append((e.stat().st_mtime, e.stat().st_size, e.path))
+            except FileNotFoundError:
+                continue
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in sorted(stats):
+            if total <= max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+
+def clear() -> None:
+    evict(0)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
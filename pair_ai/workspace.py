@@ -0,0 +1,301 @@
+"""
+load many files at once from globs and directories
+
+a spec such as pair_ai/, 'src/**/*.py' or '*.md' is expanded with the
+gitignore aware FileFinder, rooted at the enclosing git repository so its
+.gitignore rules apply.  the files are read and tokenized on a thread pool,
+binary files are skipped by sniffing their first bytes, and the text files
+are added to the context as one message.  when the files would exceed the
+token cap, files mentioned in the conversation are kept first and then the
+smallest files, so as many as possible fit.  the estimate is confirmed
+before the files are added when files were left out for the cap or the
+files exceed PAIR_FILE_CONFIRM_TOKENS.
+"""
+
+import codecs
+import hashlib
+import os
+import re
+import shlex
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional, Tuple
+
+from chatstack.chatstack import encoder
+
+from .file_finder import _translate, find_files
+from .file_registry import FileSnapshot, file_section
+from .prefetch import files_mentioned
+
+READ_WORKERS = 8
+SNIFF_BYTES = 8192
+MAX_FILE_BYTES = int(os.environ.get("PAIR_MAX_FILE_BYTES", 2 * 2**20))     # larger files are skipped
+FILE_MAX_TOKENS = os.environ.get("PAIR_FILE_MAX_TOKENS")                  # cap for one glob or directory
+CONFIRM_TOKENS = int(os.environ.get("PAIR_FILE_CONFIRM_TOKENS", 20000))   # larger loads are confirmed first
+GLOB_CHARS = re.compile(r'[*?\[]')
+MAX_TOKENS_RE = re.compile(r'(?:^|\s)--max-tokens(?:\s+(\S+))?')
+
+
+@dataclass
+class FileSet:
+    spec      : str
+    files     : List[Tuple[FileSnapshot, int]] = field(default_factory=list)   # (snapshot, tokens)
+    skipped   : List[Tuple[str, str]] = field(default_factory=list)           # (path, reason)
+
+    @property
+    def tokens(self) -> int:
+        return sum(tokens for _, tokens in self.files)
+
+
+def is_multi(spec: str) -> bool:
+    """
+    True for a glob or a directory, which load a set of files
+    """
+    return bool(GLOB_CHARS.search(spec)) or os.path.isdir(os.path.expanduser(spec))
+
+
+def split_file_args(args: str) -> Tuple[List[str], Optional[str]]:
+    """
+    the paths, globs and directories in /file arguments and the value of any --max-tokens option.
+    the arguments are one path, which may contain spaces, unless they are quoted or are several
+    globs, directories or existing files.
+    """
+    max_tokens = None
+    m = MAX_TOKENS_RE.search(args)
+    if m:
+        max_tokens = m.group(1) or ''
+        args = args[:m.start()] + args[m.end():]
+    args = args.strip()
+    if not args or os.path.exists(os.path.expanduser(args)):
+        return [args] if args else [], max_tokens
+    try:
+        parts = shlex.split(args)
+    except ValueError:
+        return [args], max_tokens      # an apostrophe in a single path
+    quoted = any(c in args for c in '\'"')
+    if quoted or any(is_multi(p) for p in parts) or all(os.path.exists(os.path.expanduser(p)) for p in parts):
+        return parts, max_tokens
+    return [args], max_tokens
+
+
+def repo_root(path: str) -> str:
+    """
+    the nearest directory at or above path containing .git, or path itself
+    """
+    path = os.path.abspath(path)
+    current = path
+    while True:
+        if os.path.exists(os.path.join(current, '.git')):
+            return current
+        parent = os.path.dirname(current)
+        if parent == current:
+            return path
+        current = parent
+
+
+def expand(spec: str) -> List[str]:
+    """
+    the non-ignored files matched by a glob or under a directory, as paths in the form spec was given
+    """
+    spec = os.path.expanduser(spec)
+    parts = spec.replace(os.sep, '/').split('/')
+    fixed = []
+    for part in parts:
+        if GLOB_CHARS.search(part):
+            break
+        fixed.append(part)
+    base = '/'.join(fixed) or '.'
+    pattern = '/'.join(parts[len(fixed):])
+    if not os.path.isdir(base):
+        return []
+    root = repo_root(base)
+    under = os.path.relpath(os.path.abspath(base), root)
+    under = '' if under == '.' else under
+    regex = re.compile('^' + _translate(pattern) + '$') if pattern else None
+    paths = []
+    for rel in find_files(None, root=root, under=under):
+        rel_base = os.path.relpath(rel, under) if under else rel
+        if regex is None or regex.match(rel_base.replace(os.sep, '/')):
+            paths.append(os.path.normpath(os.path.join(base, rel_base)))
+    return paths
+
+
+def is_binary(head: bytes) -> bool:
+    """
+    True if the first bytes of a file are not utf-8 text
+    """
+    if b'\0' in head:
+        return True
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)   # a character may be cut off at the end
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+def read_file(path: str, registry=None) -> Tuple[Optional[FileSnapshot], Optional[int], str]:
+    """
+    read and tokenize a text file; returns (snapshot, tokens, '') or (None, None, reason) if it is skipped.
+    a file the registry holds unchanged is not read again and has tokens 0.
+    """
+    key = os.path.abspath(path)
+    st = os.stat(key)
+    if st.st_size > MAX_FILE_BYTES:
+        return None, None, f"over {MAX_FILE_BYTES} bytes"
+    entry = registry.files.get(key) if registry else None
+    if entry and (entry.mtime_ns, entry.size) == (st.st_mtime_ns, st.st_size):
+        return FileSnapshot(path, key, st.st_mtime_ns, st.st_size, None, None), 0, ''
+    with open(key, 'rb') as f:
+        data = f.read()
+    if is_binary(data[:SNIFF_BYTES]):
+        return None, None, "binary"
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError:
+        return None, None, "not utf-8 text"
+    digest = hashlib.sha256(data).hexdigest()
+    return FileSnapshot(path, key, st.st_mtime_ns, st.st_size, text, digest), len(encoder.encode(file_section(path, text))), ''
+
+
+def read_file_set(spec: str, registry=None, paths: Optional[List[str]] = None) -> FileSet:
+    """
+    expand spec and read its files in parallel
+    """
+    paths = expand(spec) if paths is None else paths
+    result = FileSet(spec)
+    if not paths:
+        return result
+    with ThreadPoolExecutor(max_workers=min(READ_WORKERS, len(paths))) as executor:
+        futures = [(path, executor.submit(read_file, path, registry)) for path in paths]
+        for path, future in futures:
+            try:
+                snap, tokens, reason = future.result()
+            except OSError as e:
+                snap, tokens, reason = None, None, str(e)
+            if snap is None:
+                result.skipped.append((path, reason))
+            else:
+                result.files.append((snap, tokens))
+    return result
+
+
+def select(file_set: FileSet, max_tokens: int, mentioned: Iterable[str] = ()) -> List[str]:
+    """
+    drop files from file_set until it fits max_tokens, keeping mentioned files and then the
+    smallest files.  returns the paths dropped.
+    """
+    if file_set.tokens <= max_tokens:
+        return []
+    mentioned = set(mentioned)
+    ranked = sorted(file_set.files, key=lambda f: (f[0].path not in mentioned, f[1]))
+    kept, dropped = [], []
+    remaining = max_tokens
+    for snap, tokens in ranked:
+        if tokens <= remaining:
+            kept.append((snap, tokens))
+            remaining -= tokens
+        else:
+            dropped.append(snap.path)
+    order = {id(f[0]): i for i, f in enumerate(file_set.files)}
+    file_set.files = sorted(kept, key=lambda f: order[id(f[0])])
+    return dropped
+
+
+def recent_questions(chat_ctx, turns: int = 3) -> str:
+    """
+    the text of the last few questions asked, newest first
+    """
+    from .context_packer import TURN
+    questions = [m.text for m in chat_ctx.messages if m.role == 'user' and chat_ctx.item(m).kind == TURN]
+    return "\n".join(questions[:turns])
+
+
+def default_max_tokens(chat_ctx) -> int:
+    """
+    PAIR_FILE_MAX_TOKENS, or half the context budget so one load cannot crowd out everything else
+    """
+    return int(FILE_MAX_TOKENS) if FILE_MAX_TOKENS else chat_ctx.budget() // 2
+
+
+def prepare(chat_ctx, registry, spec: str, max_tokens: Optional[int] = None) -> Tuple[FileSet, List[str], List[Tuple[FileSnapshot, int]]]:
+    """
+    read the files of spec, index any large enough for retrieval and fit the rest to max_tokens,
+    preferring files mentioned in the recent questions.
+    returns (file_set, dropped paths, [(snapshot, chunks)] of indexed documents).
+    safe to run in a worker thread; add the files and documents with FileRegistry.add_bundle afterwards.
+    """
+    from .context_packer import LARGE_DOC_TOKENS
+    file_set = read_file_set(spec, registry)
+    documents = []
+    small = []
+    for snap, tokens in file_set.files:
+        if tokens >= LARGE_DOC_TOKENS and (chunks := registry.index(snap)) is not None:
+            documents.append((snap, chunks))
+        else:
+            small.append((snap, tokens))
+    file_set.files = small
+    dropped = []
+    if max_tokens:
+        mentioned = files_mentioned(recent_questions(chat_ctx), [snap.path for snap, _ in small])
+        dropped = select(file_set, max_tokens, mentioned)
+    return file_set, dropped, documents
+
+
+def describe_added(registry, spec: str, results, dropped: List[str]) -> List[str]:
+    """
+    lines describing what FileRegistry.add_bundle did with a file set
+    """
+    from .file_registry import ADDED, UNCHANGED
+    lines = []
+    added = [msg for _, status, msg in results if status == ADDED]
+    if added:
+        lines.append(f"Loaded {len(added)} files from {spec} into context as one message ({added[0].tokens} tokens)")
+    unchanged = sum(1 for _, status, _ in results if status == UNCHANGED)
+    if unchanged:
+        lines.append(f"{unchanged} files from {spec} are unchanged, already in context")
+    lines.extend(registry.describe(path, status, msg) for path, status, msg in results
+                 if status not in (ADDED, UNCHANGED))
+    if dropped:
+        lines.append(f"Left out {len(dropped)} files over the token cap: {', '.join(dropped)}")
+    if not results:
+        lines.append(f"No text files found for {spec}")
+    return lines
+
+
+def needs_confirmation(file_set: FileSet, dropped: List[str]) -> bool:
+    """
+    True if files were left out for the token cap or the files are over CONFIRM_TOKENS
+    """
+    return bool(dropped) or file_set.tokens > CONFIRM_TOKENS
+
+
+def confirm_prompt(file_set: FileSet, dropped: List[str]) -> str:
+    out = f"Add {len(file_set.files)} files from {file_set.spec} (~{file_set.tokens} tokens)"
+    if dropped:
+        out += f", leaving out {len(dropped)} files over the token cap"
+    return out + "? (yes/no): "
+
+
+def discard(chat_ctx, documents: List[Tuple[FileSnapshot, int]]):
+    """
+    remove the documents prepare indexed, when the files are not added after all
+    """
+    for snap, _ in documents:
+        chat_ctx.documents.remove(snap.path)
+
+
+def describe_file_set(file_set: FileSet) -> str:
+    """
+    the estimate shown before the files are added
+    """
+    new = sum(1 for snap, _ in file_set.files if snap.text is not None)
+    out = f"{file_set.spec}: {len(file_set.files)} files"
+    if new != len(file_set.files):
+        out += f" ({len(file_set.files) - new} already loaded and unchanged)"
+    out += f", ~{file_set.tokens} tokens"
+    if file_set.skipped:
+        reasons = {}
+        for _, reason in file_set.skipped:
+            reasons[reason] = reasons.get(reason, 0) + 1
+        out += "; skipped " + ", ".join(f"{n} {reason}" for reason, n in sorted(reasons.items()))
+    return out
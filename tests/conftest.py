@@ -0,0 +1,7 @@
+import os
+import sys
+
+# chatstack loads a tiktoken encoding at import, which needs network access;
+# use the offline stand-in unless PAIR_REAL_TOKENIZER is set
+if not os.environ.get("PAIR_REAL_TOKENIZER"):
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'stubs'))
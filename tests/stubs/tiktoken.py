@@ -0,0 +1,21 @@
+"""
+offline stand-in for tiktoken, which downloads its encodings on first use.
+counts whitespace separated words as tokens, close enough for the tests and benchmarks.
+"""
+
+
+class Encoding:
+
+    def encode(self, text, **kwargs):
+        return text.split()
+
+    def decode(self, tokens):
+        return ' '.join(tokens)
+
+
+def get_encoding(name):
+    return Encoding()
+
+
+def encoding_for_model(model):
+    return Encoding()
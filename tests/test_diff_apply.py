@@ -0,0 +1,90 @@
+import pytest
+
+from pair_ai.diff_apply import PatchError, PatchSet, diff_blocks, parse_patch
+
+ORIGINAL = "def greet(name):\n    print('hello', name)\n\n\ndef main():\n    greet('world')\n"
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    work = tmp_path / 'work'
+    work.mkdir()
+    monkeypatch.chdir(work)
+    (work / 'app.py').write_text(ORIGINAL)
+    return work
+
+
+def test_diff_blocks():
+    text = "Change this:\n```diff\n--- a/x\n+++ b/x\n```\nand\n```python\nprint()\n```\n"
+    assert diff_blocks(text) == ["--- a/x\n+++ b/x\n"]
+
+
+def test_parse_patch(workdir):
+    patches = parse_patch("--- a/app.py\n+++ b/app.py\n@@ -1,2 +1,2 @@\n def greet(name):\n-    print('hello', name)\n+    print('hi', name)\n")
+    assert len(patches) == 1
+    assert patches[0].old_path == patches[0].new_path == 'app.py'      # a/ and b/ prefixes are dropped
+    assert patches[0].hunks[0].old_start == 1
+    assert patches[0].hunks[0].lines == [(' ', 'def greet(name):'), ('-', "    print('hello', name)"),
+                                         ('+', "    print('hi', name)")]
+    with pytest.raises(PatchError):
+        parse_patch("not a diff")
+
+
+def test_apply_and_rollback(workdir):
+    patch = PatchSet.from_text("```diff\n--- a/app.py\n+++ b/app.py\n@@ -5,2 +5,2 @@\n def main():\n-    greet('world')\n+    greet('pair')\n```")
+    assert "+    greet('pair')" in patch.preview()
+    assert (workdir / 'app.py').read_text() == ORIGINAL         # computing the changes writes nothing
+    patch.apply()
+    assert (workdir / 'app.py').read_text() == ORIGINAL.replace("'world'", "'pair'")
+    patch.rollback()
+    assert (workdir / 'app.py').read_text() == ORIGINAL
+
+
+def test_offset_and_whitespace(workdir):
+    # wrong line numbers and different indentation in the context still apply, with notes
+    patch = PatchSet.from_text("--- a/app.py\n+++ b/app.py\n@@ -1,2 +1,2 @@\n def main():\n-  greet('world')\n+    greet('pair')\n")
+    assert patch.changes[0].updated == ORIGINAL.replace("'world'", "'pair'")
+    assert any('offset' in note for note in patch.changes[0].notes)
+    assert any('whitespace' in note for note in patch.changes[0].notes)
+
+
+def test_new_and_deleted_files(workdir):
+    (workdir / 'old.txt').write_text("gone\n")
+    patch = PatchSet.from_text("--- /dev/null\n+++ b/new.txt\n@@ -0,0 +1 @@\n+created\n"
+                               "--- a/old.txt\n+++ /dev/null\n@@ -1 +0,0 @@\n-gone\n")
+    patch.apply()
+    assert (workdir / 'new.txt').read_text() == "created\n"
+    assert not (workdir / 'old.txt').exists()
+    patch.rollback()
+    assert not (workdir / 'new.txt').exists()
+    assert (workdir / 'old.txt').read_text() == "gone\n"
+
+
+def test_hunk_that_does_not_match(workdir):
+    with pytest.raises(PatchError, match='app.py'):
+        PatchSet.from_text("--- a/app.py\n+++ b/app.py\n@@ -1 +1 @@\n-def missing():\n+def found():\n")
+
+
+def test_file_changed_since_checked(workdir):
+    patch = PatchSet.from_text("--- a/app.py\n+++ b/app.py\n@@ -6 +6 @@\n-    greet('world')\n+    greet('pair')\n")
+    (workdir / 'app.py').write_text(ORIGINAL + "main()\n")
+    with pytest.raises(PatchError, match='changed'):
+        patch.apply()
+    assert (workdir / 'app.py').read_text() == ORIGINAL + "main()\n"
+
+
+@pytest.mark.parametrize("old, new", [
+    ('/etc/hosts', '/etc/hosts'),
+    ('a/app.py', 'b/../../outside.py'),
+    ('/dev/null', 'b/../outside.py'),
+    ('a/link/secret.txt', 'b/link/secret.txt'),
+])
+def test_paths_outside_the_working_directory(workdir, old, new):
+    outside = workdir.parent / 'outside'
+    outside.mkdir()
+    (outside / 'secret.txt').write_text("secret\n")
+    (workdir / 'link').symlink_to(outside)
+    with pytest.raises(PatchError, match='outside the working directory'):
+        PatchSet.from_text(f"--- {old}\n+++ {new}\n@@ -1 +1 @@\n-secret\n+changed\n")
+    assert (outside / 'secret.txt').read_text() == "secret\n"
+    assert not (workdir.parent / 'outside.py').exists()
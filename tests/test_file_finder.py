@@ -0,0 +1,55 @@
+import re
+
+import pytest
+
+from pair_ai.file_finder import FileFinder, _translate, is_ignored, parse_ignore_patterns
+
+
+@pytest.mark.parametrize("pattern, path, matches", [
+    ('*.py', 'a.py', True),
+    ('*.py', 'src/a.py', False),            # * does not cross directories
+    ('**/*.py', 'a.py', True),
+    ('**/*.py', 'src/pkg/a.py', True),
+    ('src/**', 'src/pkg/a.py', True),
+    ('a?.txt', 'ab.txt', True),
+    ('a?.txt', 'a/.txt', False),
+    ('[!a]*.md', 'b.md', True),
+    ('[!a]*.md', 'a.md', False),
+    ('\\#notes', '#notes', True),
+    ('a.b', 'axb', False),                  # other characters are literal
+])
+def test_translate(pattern, path, matches):
+    assert bool(re.match('^' + _translate(pattern) + '$', path)) == matches
+
+
+def test_ignore_rules():
+    rules = parse_ignore_patterns(['# comment', '', '*.log', '!keep.log', 'build/', '/top.txt', 'docs/*.tmp'])
+    assert is_ignored(rules, 'debug.log', False)
+    assert is_ignored(rules, 'src/debug.log', False)
+    assert not is_ignored(rules, 'src/keep.log', False)        # the last matching rule wins
+    assert is_ignored(rules, 'src/build', True)
+    assert not is_ignored(rules, 'src/build', False)           # dir-only rules skip files
+    assert is_ignored(rules, 'top.txt', False)
+    assert not is_ignored(rules, 'src/top.txt', False)         # a slash anchors the pattern
+    assert is_ignored(rules, 'docs/a.tmp', False)
+    assert not is_ignored(rules, 'src/docs/a.tmp', False)
+
+
+def test_nested_rules_apply_below_their_directory():
+    rules = parse_ignore_patterns(['*.gen.py'], base='src')
+    assert is_ignored(rules, 'src/pkg/a.gen.py', False)
+    assert not is_ignored(rules, 'a.gen.py', False)
+
+
+def test_file_finder(tmp_path):
+    (tmp_path / '.gitignore').write_text('*.log\nbuild/\n')
+    (tmp_path / 'src' / 'build').mkdir(parents=True)
+    (tmp_path / 'node_modules').mkdir()
+    (tmp_path / 'src' / '.gitignore').write_text('generated.py\n')
+    for name in ('a.py', 'src/b.py', 'src/generated.py', 'src/c.log', 'src/build/d.py', 'node_modules/e.py'):
+        (tmp_path / name).write_text('x\n')
+    finder = FileFinder(str(tmp_path))
+    assert sorted(finder.refresh(None)) == sorted(['.gitignore', 'a.py', 'src/.gitignore', 'src/b.py'])
+    assert finder.refresh(('.py',), under='src') == ['src/b.py']
+    (tmp_path / 'src' / 'f.py').write_text('x\n')
+    assert sorted(finder.refresh(('.py',))) == ['a.py', 'src/b.py', 'src/f.py']
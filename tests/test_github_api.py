@@ -0,0 +1,141 @@
+import pytest
+
+from pair_ai import github_api, url_cache
+from pair_ai.exceptions import NetworkError
+from pair_ai.file_finder import DEFAULT_EXCLUDES
+from pair_ai.github_api import BLOB, REPO, TREE, GithubRef, parse_github_url
+from pair_ai.stub_server import StubServer
+
+
+@pytest.fixture
+def repo_dir(tmp_path):
+    root = tmp_path / 'repo'
+    (root / 'src').mkdir(parents=True)
+    (root / 'docs').mkdir()
+    (root / 'README.md').write_text('# Stub\n\nA stub repository.\n')
+    (root / 'src' / 'a.py').write_text('print("a")\n')
+    (root / 'src' / 'b.py').write_text('print("b")\n' * 100)
+    (root / 'src' / 'debug.log').write_text('log\n')
+    (root / 'src' / 'logo.png').write_bytes(b'\x89PNG\r\n\x1a\n\0\0\0' + bytes(range(40)))
+    (root / 'docs' / 'guide.md').write_text('guide\n')
+    return root
+
+
+def serve(monkeypatch, tmp_path, repo_dir, **kwargs):
+    server = StubServer(github_dir=str(repo_dir), **kwargs).start()
+    monkeypatch.setattr(github_api, 'API_URL', f"{server.url}/github/api")
+    monkeypatch.setattr(github_api, 'RAW_URL', f"{server.url}/github/raw")
+    monkeypatch.setattr(github_api, 'rate_limit', github_api.RateLimit())
+    monkeypatch.setattr(url_cache, 'URL_CACHE_DIR', str(tmp_path / 'cache'))
+    return server
+
+
+@pytest.fixture
+def server(monkeypatch, tmp_path, repo_dir):
+    server = serve(monkeypatch, tmp_path, repo_dir)
+    yield server
+    server.stop()
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://github.com/owner/repo", GithubRef('owner', 'repo', REPO)),
+    ("https://github.com/owner/repo.git", GithubRef('owner', 'repo', REPO)),
+    ("https://github.com/owner/repo/blob/main/src/a.py", GithubRef('owner', 'repo', BLOB, 'main', 'src/a.py')),
+    ("https://github.com/owner/repo/raw/v1.0/a%20b.md", GithubRef('owner', 'repo', BLOB, 'v1.0', 'a b.md')),
+    ("https://raw.githubusercontent.com/owner/repo/main/src/a.py", GithubRef('owner', 'repo', BLOB, 'main', 'src/a.py')),
+    ("https://github.com/owner/repo/tree/main/src", GithubRef('owner', 'repo', TREE, 'main', 'src')),
+    ("https://github.com/owner/repo/tree/main", GithubRef('owner', 'repo', TREE, 'main', '')),
+    ("https://github.com/owner/repo/issues/1", None),
+    ("https://github.com/owner", None),
+    ("https://raw.githubusercontent.com/owner/repo/main", None),
+    ("https://example.com/owner/repo", None),
+])
+def test_parse_github_url(url, expected):
+    assert parse_github_url(url) == expected
+
+
+def test_name():
+    assert GithubRef('o', 'r', TREE, 'main', 'src').name == 'o/r/src@main'
+    assert GithubRef('o', 'r', REPO).name == 'o/r'
+
+
+def test_readme(server):
+    text, title = github_api.github_text("https://github.com/o/r", 1000)
+    assert 'A stub repository.' in text
+    assert title == 'o/r'
+
+
+def test_blob(server):
+    text, title = github_api.github_text("https://github.com/o/r/blob/main/src/b.py", 50)
+    assert text == ('print("b")\n' * 100)[:50]
+    assert title == 'o/r/src/b.py@main'
+    with pytest.raises(NetworkError, match='binary'):
+        github_api.github_text("https://github.com/o/r/blob/main/src/logo.png", 1000)
+
+
+def test_file_cut_short_is_not_cached(server):
+    url = github_api.raw_url(GithubRef('o', 'r', BLOB, 'main'), 'src/b.py')
+    assert github_api._get(url, api=False, max_bytes=100) == ('print("b")\n' * 100)[:100]
+    assert url_cache.lookup(url) is None
+    assert github_api._get(url, api=False) == 'print("b")\n' * 100
+    assert url_cache.lookup(url).text == 'print("b")\n' * 100
+
+
+def test_tree_files(server, monkeypatch, repo_dir):
+    monkeypatch.setattr(github_api, 'configured_excludes', lambda: DEFAULT_EXCLUDES + ['*.log', 'docs/'])
+    ref = GithubRef('o', 'r', TREE, 'main', '')
+    files = dict(github_api.tree_files(ref))
+    assert set(files) == {'README.md', 'src/a.py', 'src/b.py', 'src/logo.png'}
+    assert files['src/b.py'] == (repo_dir / 'src' / 'b.py').stat().st_size
+    ref.path = 'src'
+    assert {path for path, _ in github_api.tree_files(ref)} == {'src/a.py', 'src/b.py', 'src/logo.png'}
+
+
+def test_tree_text_size_limits(server, monkeypatch):
+    monkeypatch.setattr(github_api, 'configured_excludes', lambda: DEFAULT_EXCLUDES + ['*.log'])
+    monkeypatch.setattr(github_api, 'MAX_FILE_BYTES', 100)
+    text, title = github_api.github_text("https://github.com/o/r/tree/main/src", 10_000)
+    assert 'src/a.py:\nprint("a")' in text
+    assert 'Files not included, over the size limit: src/b.py' in text
+    assert 'src/logo.png (binary)' in text
+    assert title == 'o/r/src@main'
+
+
+def test_revalidation(server):
+    url = "https://github.com/o/r/tree/main/src"
+    first, _ = github_api.github_text(url, 10_000)
+    fetched = dict(server.github)
+    cached, _ = github_api.github_text(url, 10_000)
+    assert cached == first
+    assert server.github == fetched            # fresh cache entries make no requests
+    revalidated, _ = github_api.github_text(url, 10_000, ttl=0)
+    assert revalidated == first
+    assert server.github['not_modified'] == fetched['api'] + fetched['raw']
+    assert (server.github['api'], server.github['raw']) == (fetched['api'], fetched['raw'])
+
+
+def test_rate_limit_serves_stale(monkeypatch, tmp_path, repo_dir):
+    server = serve(monkeypatch, tmp_path, repo_dir, github_rate_limit=1)
+    try:
+        text, _ = github_api.github_text("https://github.com/o/r", 1000)
+        assert github_api.rate_limit.exhausted()
+        # a stale response is used as it is, without a request, until the limit resets
+        assert github_api.github_text("https://github.com/o/r", 1000, ttl=0)[0] == text
+        assert server.github['api'] == 1
+        with pytest.raises(NetworkError, match='rate limit') as e:
+            github_api.github_text("https://github.com/o/r/tree/main/src", 1000)
+        assert e.value.status == 429
+        assert server.github['api'] == 1
+    finally:
+        server.stop()
+
+
+def test_rate_limited_response(monkeypatch, tmp_path, repo_dir):
+    server = serve(monkeypatch, tmp_path, repo_dir, github_rate_limit=0)
+    try:
+        with pytest.raises(NetworkError, match='rate limit'):
+            github_api.github_text("https://github.com/o/r", 1000)
+        assert server.github['rate_limited'] == 1
+        assert github_api.rate_limit.exhausted()
+    finally:
+        server.stop()
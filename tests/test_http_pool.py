@@ -0,0 +1,39 @@
+import threading
+
+import pytest
+
+from pair_ai import http_pool
+from pair_ai.stub_server import StubServer
+
+
+@pytest.fixture
+def server(tmp_path):
+    (tmp_path / 'file.txt').write_text('x' * 100_000)
+    server = StubServer(github_dir=str(tmp_path)).start()
+    yield server
+    server.stop()
+
+
+def test_streamed_response_holds_its_host_slot(server):
+    url = f"{server.url}/github/raw/o/r/HEAD/file.txt"
+    responses = [http_pool.get(url, stream=True) for _ in range(http_pool.PER_HOST_LIMIT)]
+    waiting = threading.Thread(target=lambda: http_pool.get(url).close())
+    waiting.start()
+    waiting.join(0.5)
+    assert waiting.is_alive()       # every slot is held by a body still being streamed
+    with responses.pop() as resp:
+        assert len(resp.content) == 100_000
+    waiting.join(5)
+    assert not waiting.is_alive()
+    for resp in responses:
+        resp.close()
+        resp.close()                # closing twice releases the slot once
+    host = url.split('/')[2]
+    assert http_pool._host_semaphore(host)._value == http_pool.PER_HOST_LIMIT
+
+
+def test_failed_request_releases_its_slot():
+    url = "http://127.0.0.1:9/unreachable"
+    with pytest.raises(Exception):
+        http_pool.get(url, timeout=1)
+    assert http_pool._host_semaphore('127.0.0.1:9')._value == http_pool.PER_HOST_LIMIT
@@ -0,0 +1,20 @@
+from pair_ai import instrument, prompt_cache, retry, structured
+
+
+def test_reset_clears_module_counters():
+    instrument.count("test.events")
+    instrument.record("test.stage", 0.1)
+    structured._count('calls')
+    retry._count('attempts')
+    prompt_cache.observe('chat', [{'role': 'user', 'content': 'hello'}])
+    counters = instrument.snapshot()['counters']
+    assert counters['test.events'] == 1
+    assert counters['structured.calls'] >= 1
+    assert counters['retry.attempts'] >= 1
+    assert counters['prompt_cache.chat.prompt_chars'] > 0
+
+    instrument.reset()
+    assert instrument.snapshot() == {'timers': {}, 'counters': {}}
+    assert prompt_cache.tracker.hit_rates() == {}
+    # the recent prompts are kept, so a repeated prompt still counts as reused
+    assert prompt_cache.observe('chat', [{'role': 'user', 'content': 'hello'}]) == 1.0
@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+from pair_ai import backend, pairwise
+from pair_ai.pairwise import AutoApprovePolicy, run_task
+
+
+class ScriptedBackend(backend.ModelBackend):
+    """
+    answers each step with the next of the given NextStep dicts, and roll ups with a fixed summary
+    """
+
+    def __init__(self, steps, summary="rolled up"):
+        self.steps = list(steps)
+        self.summary = summary
+        self.completions = 0
+
+    def complete_function(self, messages, model, name, parameters, description="", temperature=0, **kwargs):
+        return json.dumps(self.steps.pop(0))
+
+    def complete(self, messages, model, temperature=0, **kwargs):
+        self.completions += 1
+        return self.summary
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    monkeypatch.setattr(pairwise, 'TASK_STATE_DIR', str(tmp_path / 'tasks'))
+    root = tmp_path / 'repo'
+    (root / 'build').mkdir(parents=True)
+    (root / '.gitignore').write_text('build/\n')
+    (root / 'build' / 'out.py').write_text('keep me\n')
+    (root / 'main.py').write_text('print("main")\n')
+    return root
+
+
+def use_backend(monkeypatch, scripted):
+    monkeypatch.setattr(backend, '_backend', scripted)
+    return scripted
+
+
+def test_create_does_not_overwrite_ignored_file(repo, monkeypatch):
+    use_backend(monkeypatch, ScriptedBackend([
+        {'work_done': 'wrote out.py', 'create_file': {'filename': 'build/out.py', 'content': 'replaced\n'}},
+    ]))
+    result = run_task("write build/out.py", root=str(repo), policy=AutoApprovePolicy(allow_overwrite=False))
+    assert result.status == 'stopped'
+    assert (repo / 'build' / 'out.py').read_text() == 'keep me\n'
+
+
+def test_create_new_file(repo, monkeypatch):
+    use_backend(monkeypatch, ScriptedBackend([
+        {'work_done': 'wrote notes', 'create_file': {'filename': 'notes.md', 'content': 'notes\n'}, 'task_done': True},
+    ]))
+    result = run_task("write notes", root=str(repo), policy=AutoApprovePolicy())
+    assert result.status == 'done'
+    assert result.files_created == ['notes.md']
+    assert (repo / 'notes.md').read_text() == 'notes\n'
+
+
+class Unavailable(Exception):
+    status_code = 503
+
+
+def test_roll_up_retries_and_counts_tokens(repo, monkeypatch):
+    monkeypatch.setattr(pairwise, 'WORK_LOG_TOKENS', 5)
+    monkeypatch.setattr('pair_ai.retry.sleep', lambda seconds: None)
+    monkeypatch.setattr(pairwise, 'api_host', lambda: 'roll-up-test')
+    scripted = ScriptedBackend([{'work_done': f'step {i} did several things'} for i in range(3)] +
+                               [{'work_done': 'finished', 'task_done': True}])
+    failures = [Unavailable("try again")]
+    complete = scripted.complete
+
+    def flaky(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return complete(*args, **kwargs)
+    scripted.complete = flaky
+    use_backend(monkeypatch, scripted)
+
+    result = run_task("do things", root=str(repo), policy=AutoApprovePolicy())
+    assert result.status == 'done'
+    assert scripted.completions == 1
+    assert result.work_summary.startswith("rolled up")
+    rolled = result.steps[2]
+    assert rolled.prompt_tokens > result.steps[1].prompt_tokens
+    assert rolled.response_tokens > result.steps[1].response_tokens
+
+
+def test_failed_roll_up_keeps_the_work_log(monkeypatch):
+    monkeypatch.setattr(pairwise, 'WORK_LOG_TOKENS', 5)
+    monkeypatch.setattr(pairwise, 'MODEL_TRIES', 1)
+    monkeypatch.setattr(pairwise, 'api_host', lambda: 'roll-up-test-failing')
+
+    class Failing(ScriptedBackend):
+        def complete(self, *args, **kwargs):
+            raise Unavailable("down")
+    use_backend(monkeypatch, Failing([]))
+    task = pairwise.Task(description="d", repo_outline="", work_summary="before", step=3,
+                         work_log=[f"entry {i} with some words" for i in range(4)])
+    with pytest.raises(Unavailable):
+        pairwise.roll_up(task, 'gpt-4')
+    assert task.work_log == [f"entry {i} with some words" for i in range(4)]
+    assert task.work_summary == "before"
@@ -0,0 +1,47 @@
+from pair_ai.response_parser import CODE, FENCE, PROSE, ResponseParser, may_be_fence
+
+
+def feed_all(deltas):
+    parser = ResponseParser()
+    lines = [line for delta in deltas for line in parser.feed(delta)]
+    return parser, lines + parser.close()
+
+
+def test_prose_streams_before_the_line_ends():
+    parser = ResponseParser()
+    pieces = parser.feed("Hello")
+    assert [(p.text, p.kind, p.end) for p in pieces] == [("Hello", PROSE, False)]
+    pieces = parser.feed(" there, a long paragraph")
+    assert [(p.text, p.end) for p in pieces] == [(" there, a long paragraph", False)]
+    pieces = parser.feed(".\nNext")
+    assert [(p.text, p.end) for p in pieces] == [(".", True), ("Next", False)]
+    assert [(p.text, p.end) for p in parser.close()] == [("", True)]
+
+
+def test_fence_start_is_held_back():
+    assert may_be_fence("") and may_be_fence("  `") and may_be_fence("``") and may_be_fence("```py")
+    assert may_be_fence("~~")
+    assert not may_be_fence("`x") and not may_be_fence("Hi")
+    parser = ResponseParser()
+    assert parser.feed("``") == []
+    assert parser.feed("`python") == []
+    assert [(p.text, p.kind, p.lang) for p in parser.feed("\n")] == [("```python", FENCE, "python")]
+
+
+def test_code_lines_are_complete():
+    parser, lines = feed_all(["Intro\n```py", "thon\nx = ", "1\n", "```\nDone"])
+    assert [(l.text, l.kind, l.end) for l in lines] == [
+        ("Intro", PROSE, True), ("```python", FENCE, True), ("x = 1", CODE, True), ("```", FENCE, True),
+        ("Done", PROSE, False), ("", PROSE, True)]
+    assert lines[3].closed.text == "x = 1\n"
+
+
+def test_diff_blocks():
+    parser, _ = feed_all(["```diff\n--- a/x\n+++ b/x\n```\n", "```py\nprint()\n```\n", "~~~patch\n-a\n+b\n~~~"])
+    assert parser.diff_blocks() == ["--- a/x\n+++ b/x\n", "-a\n+b\n"]
+
+
+def test_unclosed_block_is_closed():
+    parser, lines = feed_all(["```diff\n-a\n+b"])
+    assert [l.kind for l in lines] == [FENCE, CODE, CODE]
+    assert parser.diff_blocks() == ["-a\n+b\n"]
@@ -0,0 +1,70 @@
+import pytest
+
+from pair_ai import retrieval
+from pair_ai.retrieval import DocumentStore, chunk_text
+
+TOPICS = ['apples grow on trees in the orchard', 'the compiler emits bytecode for the interpreter',
+          'rivers flow down to the sea', 'tokens are counted before each request']
+
+
+def document(paragraphs_per_topic=20):
+    return '\n\n'.join(f"Paragraph {i} about {topic}. " + "Filler words pad the text. " * 5
+                       for topic in TOPICS for i in range(paragraphs_per_topic))
+
+
+@pytest.fixture(autouse=True)
+def retrieval_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(retrieval, 'RETRIEVAL_DIR', str(tmp_path / 'retrieval'))
+    return tmp_path / 'retrieval'
+
+
+def test_chunk_text_keeps_paragraphs_whole():
+    text = document()
+    chunks = chunk_text(text, chunk_tokens=100)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 2 * 100 * 4 for chunk in chunks)
+    paragraphs = [p.strip() for p in text.split('\n\n')]
+    assert [p for chunk in chunks for p in chunk.split('\n\n')] == paragraphs
+
+
+def test_chunk_text_splits_long_paragraphs():
+    paragraph = ' '.join(f"Sentence number {i} ends here." for i in range(200))
+    chunks = chunk_text(paragraph, chunk_tokens=50)
+    assert len(chunks) > 1
+    assert all(chunk.endswith('here.') for chunk in chunks)
+    assert ' '.join(chunk.replace('\n\n', ' ') for chunk in chunks) == paragraph
+
+
+def test_search_finds_relevant_chunks():
+    store = DocumentStore()
+    store.add('notes.md', document())
+    store.add('other.md', "Nothing relevant here.\n\n" * 3)
+    results = store.search('how does the compiler make bytecode?', token_budget=10_000, top_k=3)
+    assert len(results) == 3
+    assert all(r.name == 'notes.md' and 'compiler' in r.text for r in results)
+    assert results == sorted(results, key=lambda r: -r.score)
+    assert store.search('', token_budget=10_000) == []
+    assert store.search('zebra', token_budget=10_000) == []
+
+
+def test_search_respects_token_budget():
+    store = DocumentStore()
+    store.add('notes.md', document())
+    results = store.search('rivers sea', token_budget=1)
+    assert results == []
+    budget = 2 * store.search('rivers sea', top_k=1)[0].tokens
+    assert sum(r.tokens for r in store.search('rivers sea', token_budget=budget)) <= budget
+
+
+def test_index_is_stored_and_restored(retrieval_dir):
+    text = document()
+    index = DocumentStore().add('notes.md', text)
+    assert any(retrieval_dir.iterdir())
+    store = DocumentStore()
+    assert store.restore('notes.md', index.digest)
+    assert 'notes.md' in store
+    assert store.docs['notes.md'].chunks == index.chunks
+    assert store.search('apples orchard', top_k=1)[0].name == 'notes.md'
+    assert store.remove('notes.md')
+    assert 'notes.md' not in store
+    assert not store.restore('missing.md', '0' * 64)
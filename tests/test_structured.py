@@ -0,0 +1,21 @@
+import pytest
+
+from pair_ai.structured import repair_json
+
+
+@pytest.mark.parametrize("text, expected, repaired", [
+    ('{"a": 1}', {'a': 1}, False),
+    ('Sure:\n```json\n{"a": 1}\n```', {'a': 1}, True),
+    ('{"a": "}", "b": 2} and some trailing text', {'a': '}', 'b': 2}, True),
+    ('{"a": [1, 2', {'a': [1, 2]}, True),                  # cut off mid array
+    ('{"a": 1, "b": "x', {'a': 1, 'b': 'x'}, True),        # cut off mid string
+    ('{"a": 1, "b":', {'a': 1}, True),                     # dangling key
+    ('{"a": [1, 2,],}', {'a': [1, 2]}, True),              # trailing commas
+])
+def test_repair_json(text, expected, repaired):
+    assert repair_json(text) == (expected, repaired)
+
+
+def test_no_json():
+    with pytest.raises(ValueError):
+        repair_json("I cannot answer that")
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from pair_ai import url_cache
+from pair_ai.url_cache import CacheEntry
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(url_cache, 'URL_CACHE_DIR', str(tmp_path / 'urls'))
+    monkeypatch.delenv('PAIR_NO_CACHE', raising=False)
+    return tmp_path / 'urls'
+
+
+def test_store_and_lookup():
+    url_cache.store(CacheEntry('https://example.com/', 'text', 'Title', 'en', etag='"abc"'))
+    entry = url_cache.lookup('https://example.com/')
+    assert entry.result() == ('text', 'Title', 'en')
+    assert entry.validators() == {'If-None-Match': '"abc"'}
+    assert entry.is_fresh()
+    assert not entry.is_fresh(ttl=0)
+    assert url_cache.lookup('https://example.com/other') is None
+
+
+def test_refresh_restarts_ttl():
+    url_cache.store(CacheEntry('https://example.com/', 'text', '', '', last_modified='Mon, 01 Jan 2024 00:00:00 GMT',
+                               fetched_at=0))
+    entry = url_cache.lookup('https://example.com/')
+    assert not entry.is_fresh()
+    assert entry.validators() == {'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+    url_cache.refresh(entry)
+    assert url_cache.lookup('https://example.com/').is_fresh()
+
+
+def test_evicts_least_recently_used(cache_dir):
+    for i in range(3):
+        url_cache.store(CacheEntry(f'https://example.com/{i}', 'x' * 1000, '', ''))
+        os.utime(url_cache._path(f'https://example.com/{i}'), (i, i))
+    url_cache.lookup('https://example.com/0')       # a lookup marks the entry as used
+    url_cache.evict(max_bytes=2500)
+    assert url_cache.lookup('https://example.com/1') is None
+    assert url_cache.lookup('https://example.com/0') is not None
+    assert url_cache.lookup('https://example.com/2') is not None
+
+
+def test_unreadable_entry_is_discarded():
+    url_cache.store(CacheEntry('https://example.com/', 'text', '', ''))
+    path = url_cache._path('https://example.com/')
+    with open(path, 'w') as f:
+        f.write('{not json')
+    assert url_cache.lookup('https://example.com/') is None
+    assert not os.path.exists(path)
+
+
+def test_disabled(monkeypatch, cache_dir):
+    monkeypatch.setenv('PAIR_NO_CACHE', '1')
+    url_cache.store(CacheEntry('https://example.com/', 'text', '', ''))
+    assert url_cache.lookup('https://example.com/') is None
+    assert not cache_dir.exists()